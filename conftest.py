@@ -0,0 +1,29 @@
+"""
+Runs the test suite against a temporary model cache (see
+vivarium_microbiome.library.model_cache) instead of the user's own.
+"""
+
+import os
+import shutil
+import tempfile
+
+from vivarium_microbiome.library.model_cache import CACHE_ENV
+
+
+_cache_dir = None
+
+
+def pytest_configure(config):
+    # set before collection, which imports (and may construct) the processes;
+    # worker processes of the sweeps and pools inherit it
+    global _cache_dir
+    if os.environ.get(CACHE_ENV):
+        return
+    _cache_dir = tempfile.mkdtemp(prefix='vivarium_microbiome_cache-')
+    os.environ[CACHE_ENV] = _cache_dir
+
+
+def pytest_unconfigure(config):
+    if _cache_dir is not None:
+        os.environ.pop(CACHE_ENV, None)
+        shutil.rmtree(_cache_dir, ignore_errors=True)
@@ -12,13 +12,19 @@ setup(
     packages=[
         'vivarium_microbiome',
         'vivarium_microbiome.processes',
+        'vivarium_microbiome.library',
+        'vivarium_microbiome.experiments',
     ],
     author='Amin Boroomand',
     author_email='boroomand@uchc.edu',
     url='',  # TODO: Put your project URL here.
     license='Apache 2',
     entry_points={
-        'console_scripts': []},
+        'console_scripts': [
+            'vivarium-microbiome-sweep = vivarium_microbiome.experiments.sweep:run',
+            'vivarium-microbiome-benchmark = vivarium_microbiome.experiments.benchmarks:run',
+            'vivarium-microbiome-flux-table = vivarium_microbiome.experiments.flux_tables:run',
+        ]},
     short_description='',  # TODO: Describe your project briefly.
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -29,4 +35,7 @@ setup(
         'pytest',
         'cobra',
     ],
+    extras_require={
+        'columnar': ['pyarrow'],
+    },
 )
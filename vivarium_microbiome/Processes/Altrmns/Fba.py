@@ -2,16 +2,21 @@ from vivarium.core.process import Process
 from vivarium.core.engine import Engine, pf
 import numpy as np
 
-from cobra.io import read_sbml_model
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.lp import FluxReader, solve_conditions
 from cobra.util import create_stoichiometric_matrix
+from cobra.util.solver import check_solver_status
 
 
 class FBA(Process):
-    defaults = {}
+    defaults = {
+        'flux_outputs': 'all',  # 'all' or the list of reaction IDs to output fluxes for
+    }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters["model_file"])
+        self.model = load_model(self.parameters["model_file"])
+        self.flux_reader = FluxReader(self.model, self.parameters['flux_outputs'])
 
     def ports_schema(self):
         return {
@@ -37,10 +42,22 @@ class FBA(Process):
         reaction.lower_bound = lower_bound
         reaction.upper_bound = upper_bound
 
+    def solve_batch(self, conditions, reaction_ids=None):
+        """
+        Solve the model once per condition and return a BatchSolution whose
+        ``fluxes`` is a conditions x reactions matrix. ``conditions`` is a list
+        of ``{reaction_id: (lower, upper)}`` overrides, or an array of shape
+        (conditions, len(reaction_ids), 2). The model's own bounds are left
+        unchanged.
+        """
+        return solve_conditions(self.model, conditions, reaction_ids, self.flux_reader)
+
     def next_update(self, timestep, state):
-        solution = self.model.optimize()
-        objective_value = solution.objective_value
-        fluxes = solution.fluxes.to_dict()
+        self.model.slim_optimize()
+        check_solver_status(self.model.solver.status)
+        objective_value = self.model.solver.objective.value
+        self.flux_reader.read()
+        fluxes = self.flux_reader.to_dict()
         return {
             "fluxes": fluxes,
             "objective_flux": objective_value
@@ -71,4 +88,7 @@ def main(model_path, reaction_id=None, bounds=None):
     return output, processes1, topology1
 
 
-
+def scan(model_path, reaction_id, bounds_list):
+    """Solve ``model_path`` for each ``(lower, upper)`` of ``reaction_id`` in ``bounds_list`` with one model load."""
+    fba = FBA({"model_file": model_path})
+    return fba.solve_batch([[bounds] for bounds in bounds_list], reaction_ids=[reaction_id])
@@ -9,13 +9,21 @@ a model from an SBML file and computing the flux at each time step.
 
 from vivarium.core.process import Process, Step
 from vivarium.core.engine import Engine, pf
-from cobra.io import read_sbml_model
+from vivarium_microbiome.Processes.Ecoli.DynamicFBA import DynamicFBA  # one DynamicFBA for every composite
+from vivarium_microbiome.library.model_cache import load_compiled_model
+from vivarium_microbiome.library.bounds import BoundsArray
+from vivarium_microbiome.library.profiling import Profiler
+from vivarium_microbiome.library.uptake import Substrates
+from vivarium_microbiome.library.checkpoint import Checkpointed, run_checkpointed
+from vivarium_microbiome.library.fva import fva_processes, fva_topology
+from vivarium_microbiome.library.timestep import SharedTimestep, adaptive_processes, adaptive_topology
 import random
+import numpy as np
 # Add the Time_proportion variable, We consider each time-step a minute
 TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
 
 
-class ReactionBounds(Process):
+class ReactionBounds(SharedTimestep, Process):
   
 
     defaults = {
@@ -23,122 +31,83 @@ class ReactionBounds(Process):
         'enz_concentration': 5,
         'kcat': 5,
         'init_concentration': 11.1,
+        'substrates': None,  # {exchange_id: {'kcat', 'km', 'init_concentration', 'enzyme'}}; None limits glucose only
     }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters['model_file'])
+        self.compiled_model = load_compiled_model(self.parameters['model_file'])
         self.bounds = self.initialize_bounds()
-        self.initial_upper_bound = None # an attribute to hold the initial upper bound
-        self.initial_lower_bound = None
+        self.substrates = Substrates.from_parameters(self.parameters)
+        # only the substrates the model has an exchange reaction for are limited
+        self.limited = np.array([
+            index for index, exchange_id in enumerate(self.substrates.exchange_ids)
+            if exchange_id in self.bounds], dtype=np.intp)
+        self.limited_ids = [self.substrates.exchange_ids[index] for index in self.limited]
+        positions = np.array([self.bounds.index[exchange_id] for exchange_id in self.limited_ids], dtype=np.intp)
+        self.initial_lower_bounds = self.bounds.lower[positions]
+        self.upper_bounds = self.bounds.upper[positions]
 
     def initialize_bounds(self):
-        bounds = {}
-        for reaction in self.model.reactions:
-            bounds[reaction.id] = (reaction.lower_bound, reaction.upper_bound)
-        return bounds
+        compiled = self.compiled_model
+        return BoundsArray(compiled.reaction_ids, compiled.lower_bounds, compiled.upper_bounds)
 
     def ports_schema(self):
         return {
             "reaction_bounds": {
                 '_default': self.bounds,
                 '_emit': True,
-                '_updater': 'set'
+                '_updater': 'bounds_array'
             },
             "current_v0": {
                 '_default': -10.0,
                 '_emit': True,
                 '_updater': 'set'
             },
+            # the glucose concentration without the substrates parameter, as before it
             "concentration": {
-                '_default': self.parameters['init_concentration'],
+                '_default': self.substrates.init_concentrations[0].item(),
                 '_emit': True,
-                "_updater": "accumulate",
+                '_updater': 'accumulate'
+            },
+            "concentrations": {
+                '_default': self.substrates.medium(),
+                '_emit': True,
+                '_updater': 'medium'
             },
             "enz_concentration": {
                 "_default": self.parameters['enz_concentration'],
                 "_updater": "set"
             },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
-        concentration = state['concentration']
-        enz_concentration = state['enz_concentration']  # Use 'enz_concentration' instead of 'enz-conc'
-        vmax = self.parameters['kcat'] * enz_concentration
-        current_v0 = vmax * concentration / (self.parameters['km'] + concentration)
-        current_v0 = - current_v0  # it should be negative because it consumes glucose
-        updated_bounds = self.bounds
-        if timestep != 0:
-            current_bounds = state["reaction_bounds"]
-            for reaction_id, old_bounds in current_bounds.items():
-                if reaction_id == "EX_glc__D_e":  # it will be always none if the class was Step instead of Process. why?
-                    if self.initial_lower_bound is None:  # If the initial lower bound has not been stored yet
-                        self.initial_lower_bound = old_bounds[0]  # Store the initial lower bound
-                    new_lower_bound = max(self.initial_lower_bound, current_v0)  # Take the maximum of the initial lower bound and current_v0
-                    new_bounds = (new_lower_bound, old_bounds[1])  # keep the old upper bound
-                    updated_bounds[reaction_id] = new_bounds
+        if self.parameters['substrates']:
+            concentrations = self.substrates.concentrations(state['concentrations'])
+        else:
+            concentrations = np.array([state['concentration']])
+        current_v0 = self.substrates.uptake_rates(concentrations, state['enz_concentration'])
+        updated_bounds = {}  # only the changed entries; the bounds_array updater writes them in place
+        if timestep != 0 and len(self.limited):  # it will be always none if the class was Step instead of Process. why?
+            # the uptake bound never opens beyond the model's initial lower bound
+            lower_bounds = np.maximum(self.initial_lower_bounds, current_v0[self.limited])
+            updated_bounds = dict(zip(self.limited_ids, zip(lower_bounds.tolist(), self.upper_bounds.tolist())))
 
         return {
             "reaction_bounds": updated_bounds,
-            "current_v0": current_v0,
-        }
-
-
-class DynamicFBA(Process):
-   
-
-    defaults = {'reaction_bounds': None}
-
-    def __init__(self, parameters=None):
-        super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters["model_file"])
-        self.reaction_bounds = self.parameters['reaction_bounds']
-
-    def ports_schema(self):
-        return {
-            "fluxes": {
-                '_default': {},
-                '_emit': True,
-                "_updater": "set"
-            },
-            "reactions": {
-                '_default': [str(reaction) for reaction in self.model.reactions],
-                '_emit': True,
-                "_updater": "set"
-            },
-            "objective_flux": {
-                '_default': 0.0,
-                '_emit': True,
-                "_updater": "set"
-            },
-            "reaction_bounds": {
-                '_default': self.reaction_bounds.bounds if self.reaction_bounds else {},
-                '_emit': True,
-                "_updater": "set"
-            }
+            "current_v0": float(current_v0[0]),
         }
 
-    def next_update(self, timestep, state):
-        reaction_bounds = state["reaction_bounds"]
-        for reaction_id, (lower_bound, upper_bound) in reaction_bounds.items():
-            reaction = self.model.reactions.get_by_id(reaction_id)
-            reaction.lower_bound, reaction.upper_bound = lower_bound, upper_bound
-
-        solution = self.model.optimize()
-        objective_value = solution.objective_value
-        fluxes = solution.fluxes.to_dict()
 
-        return {
-            "fluxes": fluxes,
-            "objective_flux": objective_value
-        }
+class BiomassCalculator(Checkpointed, SharedTimestep, Process):
 
 
-
-class BiomassCalculator(Process):
-
-
-    defaults = {'initial_objective_flux': None}
+    defaults = {
+        'initial_objective_flux': None,
+        'time_proportion': TIME_PROPORTION,
+    }
+    checkpoint_attributes = ('current_biomass',)
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
@@ -159,27 +128,32 @@ class BiomassCalculator(Process):
                 '_default': 0.0,
                 '_emit': True,
                 "_updater": "set"
-            }
+            },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
         objective_flux = state["objective_flux"]
-        current_biomass = self.compute_biomass(objective_flux, TIME_PROPORTION)
+        current_biomass = self.compute_biomass(objective_flux, self.parameters['time_proportion'] * timestep)
         return {
             "current_biomass": current_biomass
         }
 
 
-class EnvCalculator(Process):
+class EnvCalculator(SharedTimestep, Process):
 
 
     defaults = {
         'init_concentration': 11.1,
         'volume': 10,
+        'substrates': None,  # as for ReactionBounds; None tracks glucose only
+        'time_proportion': TIME_PROPORTION,
+        'limit_consumption': False,  # True never consumes more than is left, so depleted substrates stay at zero
     }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
+        self.substrates = Substrates.from_parameters(self.parameters, kinetics=False)
 
     def ports_schema(self):
         return {
@@ -195,41 +169,80 @@ class EnvCalculator(Process):
                 "_updater": "accumulate",
             },
             "concentration": {
-                "_default": self.parameters['init_concentration'],
+                "_default": self.substrates.init_concentrations[0].item(),
                 "_emit": True,
                 "_updater": "accumulate",
             },
+            "concentrations": {
+                "_default": self.substrates.medium(),
+                "_emit": True,
+                "_updater": "medium",
+            },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
         current_biomass = state["current_biomass"]
-        concentration = state["concentration"]
         fluxes_values = state["fluxes_values"]
-        env_consumption = 0
-        if "EX_glc__D_e" in fluxes_values:
-            env_consumption = (
-                    current_biomass * (-fluxes_values["EX_glc__D_e"]) * TIME_PROPORTION
-            )
+        fluxes = np.array([fluxes_values.get(exchange_id, 0.0) for exchange_id in self.substrates.exchange_ids])
+        env_consumption = current_biomass * (-fluxes) * self.parameters['time_proportion'] * timestep
+        if self.parameters['limit_consumption']:
+            env_consumption = self.substrates.limit_consumption(
+                env_consumption, self.substrates.concentrations(state["concentrations"]), self.parameters['volume'])
         delta_c = env_consumption / self.parameters['volume']
-        concentration += (-delta_c)
 
+        # current_env_consumption and concentration follow the first substrate
         return {
-            "current_env_consumption": env_consumption,
-            "concentration": - delta_c,
+            "current_env_consumption": float(env_consumption[0]),
+            "concentration": float(-delta_c[0]),
+            "concentrations": dict(zip(self.substrates.exchange_ids, (-delta_c).tolist())),
         }
 
 
-
 def main(config):
+    """
+    Run the Alteromonas dFBA composite over ``config['main']['simulation_time']``.
+
+    ``main`` returns ``(data, output, processes, topology)``. ``data`` is the
+    emitter's ``get_data()``: a dict of the emitted timeseries with the
+    default in-RAM emitter, or a lazy ColumnarData handle with
+    ``config['main']['emitter']`` set to ``{'type': 'columnar', ...}``, see
+    library.emitters. ``output`` is that same object, unless
+    ``config['main']['pf']`` is set, in which case a RAM run's ``output`` is
+    the ``pf()`` string of ``data``; that string costs as much memory as the
+    run's data, so it is only built when asked for.
+    """
+    # opt-in per-process timing: True, a dict of Profiler parameters or a Profiler, see library.profiling
+    profiler = Profiler.from_config(config['main'].get('profile'))
+    if not profiler:
+        return simulate(config)
+    profiler.start()
+    try:
+        return simulate(config, profiler)
+    finally:
+        # also when the run fails, so later runs in this interpreter are not profiled
+        profiler.stop()
+
+
+def simulate(config, profiler=None):
+    """Build and run main's composite, with its processes and Engine instrumented by ``profiler``."""
     initial_state = config['main']['initial_state']
     simulation_time = config['main']['simulation_time']
-    reaction_bounds = ReactionBounds(config['ReactionBounds'])
+    # limiting substrates set in main apply to both ReactionBounds and EnvCalculator;
+    # they go into copies, so a config reused for several runs is left as it was
+    reaction_bounds_config = dict(config['ReactionBounds'])
+    env_calculator_config = dict(config['EnvCalculator'])
+    substrates = config['main'].get('substrates')
+    if substrates:
+        reaction_bounds_config.setdefault('substrates', substrates)
+        env_calculator_config.setdefault('substrates', substrates)
+    reaction_bounds = ReactionBounds(reaction_bounds_config)
     dynamic_fba = DynamicFBA(config['DynamicFBA'])
-    initial_state = {"reaction_bounds": reaction_bounds.bounds}
+    initial_state = {"reaction_bounds": reaction_bounds.bounds.copy()}
     initial_objective_flux_update = dynamic_fba.next_update(1, initial_state)
     initial_objective_flux = initial_objective_flux_update["objective_flux"]
     biomass_calculator = BiomassCalculator({'initial_objective_flux': initial_objective_flux})
-    env_calculator = EnvCalculator(config['EnvCalculator'])
+    env_calculator = EnvCalculator(env_calculator_config)
 
 
     processes = {
@@ -244,6 +257,7 @@ def main(config):
         'reaction_bounds': ('reaction_bounds',),
         'current_v0': ('current_v0',),
         'concentration': ('concentration',),
+        'concentrations': ('concentrations',),
         'enz_concentration': ('enz_concentration',)
     },
     'DynamicFBA': {
@@ -260,14 +274,47 @@ def main(config):
         'current_biomass': ('current_biomass_value',),
         'fluxes_values': ('fluxes_values',),
         'current_env_consumption': ('current_env_consumption_value',),
-        'concentration': ('concentration',)
+        'concentration': ('concentration',),
+        'concentrations': ('concentrations',)
     }
 }
 
-    sim = Engine(processes=processes, topology=topology, initial_state=initial_state)
-    sim.update(simulation_time)
+    # adaptive-step mode: True, or a dict of AdaptiveTimestep parameters, see library.timestep
+    adaptive = config['main'].get('adaptive')
+    if adaptive:
+        adaptive = dict({} if adaptive is True else adaptive)
+        adaptive.setdefault('volume', env_calculator.parameters['volume'])
+        adaptive.setdefault('time_proportion', env_calculator.parameters['time_proportion'])
+        processes.update(adaptive_processes(adaptive, simulation_time))
+        topology.update(adaptive_topology())
+
+    # flux ranges every few steps: True, or a dict of FluxVariability parameters, see library.fva
+    fva = config['main'].get('fva')
+    if fva:
+        fva = dict({} if fva is True else fva)
+        fva.setdefault('model_file', config['DynamicFBA']['model_file'])
+        processes.update(fva_processes(fva))
+        topology.update(fva_topology())
+
+    # per-store emit policies, see library.emitters.EmitPolicy; the reaction list never changes
+    emit_policies = config['main'].get('emit_policies', {'reactions_list': 'once'})
+    # {'type': 'columnar', 'path': ...} streams the run to Parquet instead of keeping it in RAM
+    emitter = dict(config['main'].get('emitter', {'type': 'policy'}), policies=emit_policies)
+    if profiler:
+        profiler.instrument_processes(processes)
+    sim = Engine(
+        processes=processes, topology=topology, initial_state=initial_state,
+        emitter=emitter)
+    if profiler:
+        profiler.instrument_engine(sim)
+    # {'path': ..., 'every': ...} checkpoints the run and resumes from an existing checkpoint, see library.checkpoint
+    checkpoint = config['main'].get('checkpoint')
+    if checkpoint:
+        run_checkpointed(sim, processes, simulation_time, **checkpoint)
+    else:
+        sim.update(simulation_time)
     data = sim.emitter.get_data()
-    output = pf(data)
+    output = pf(data) if config['main'].get('pf') and isinstance(data, dict) else data
     return data, output, processes, topology
 
 
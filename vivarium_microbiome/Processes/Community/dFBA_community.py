@@ -0,0 +1,337 @@
+import os
+
+import numpy as np
+from vivarium.core.process import Process
+from vivarium.core.engine import Engine, pf
+
+from vivarium_microbiome.library.model_cache import load_compiled_model
+from vivarium_microbiome.library.bounds import BoundsArray
+from vivarium_microbiome.library.medium import Medium
+from vivarium_microbiome.library.uptake import Substrates
+# the per-species DynamicFBA and BiomassCalculator are the E. coli ones, which work for any model
+from vivarium_microbiome.Processes.Ecoli.DynamicFBA import DynamicFBA
+from vivarium_microbiome.Processes.Ecoli.BiomassCalculator import BiomassCalculator
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data')
+TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
+
+# inorganic exchanges of the Alteromonas model: ions, trace metals, O2, CO2, NH3, phosphate, sulfate and water
+ALTEROMONAS_MINIMAL_MEDIUM = [
+    'EX_cpd{}_e0'.format(compound) for compound in (
+        '00001', '00007', '00009', '00011', '00013', '00030', '00034', '00048', '00058',
+        '00063', '00067', '00099', '00149', '00205', '00254', '00971', '10516')]
+
+
+class MediumBounds(Process):
+    """
+    ReactionBounds of one species in a shared medium.
+
+    ``exchanges`` maps the species' exchange reactions to the exchange IDs of
+    the shared Medium, e.g. ``{'EX_cpd00027_e0': 'EX_glc__D_e'}``. Every
+    update sets the lower bound of each mapped exchange to
+    ``max(initial lower bound, -kcat * enz_concentration * C / (km + C))``,
+    the Michaelis-Menten uptake of library.uptake.Substrates, in one
+    vectorized pass over the medium. ``bounds`` overrides the model's
+    initial bounds. If ``open_uptakes`` is a list of exchange reactions, every
+    other exchange ("EX_" reaction) that is not mapped to the medium has its
+    uptake closed, which keeps a model with an open default medium from
+    feeding on metabolites the shared medium does not hold.
+    """
+
+    defaults = {
+        'model_file': None,
+        'exchanges': {},
+        'bounds': {},
+        'open_uptakes': None,
+        'kcat': 5,
+        'km': 0.1,
+        'enz_concentration': 5,
+        'medium': None,
+    }
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        compiled = load_compiled_model(self.parameters['model_file'])
+        self.bounds = BoundsArray(compiled.reaction_ids, compiled.lower_bounds, compiled.upper_bounds)
+        self.reaction_ids = list(self.parameters['exchanges'])
+        if self.parameters['open_uptakes'] is not None:
+            keep = set(self.parameters['open_uptakes']) | set(self.reaction_ids)
+            closed = np.array([
+                reaction_id.startswith('EX_') and reaction_id not in keep
+                for reaction_id in self.bounds.reaction_ids])
+            self.bounds.lower[closed] = np.maximum(self.bounds.lower[closed], 0.0)
+        self.bounds.update(self.parameters['bounds'])
+        self.medium_ids = [self.parameters['exchanges'][reaction_id] for reaction_id in self.reaction_ids]
+        positions = np.array([self.bounds.index[reaction_id] for reaction_id in self.reaction_ids], dtype=np.intp)
+        self.initial_lower_bounds = self.bounds.lower[positions]
+        self.upper_bounds = self.bounds.upper[positions]
+        # the medium holds the concentrations, so the substrates' own initial ones are not used
+        self.substrates = Substrates({
+            medium_id: {'kcat': self.parameters['kcat'], 'km': self.parameters['km'], 'init_concentration': 0.0}
+            for medium_id in self.medium_ids})
+        if self.parameters['medium'] is not None:
+            # start from the uptake bounds of the initial medium
+            self.bounds.update(self.uptake_bounds(self.parameters['medium']))
+
+    def ports_schema(self):
+        return {
+            "reaction_bounds": {
+                '_default': self.bounds,
+                '_emit': True,
+                '_updater': 'bounds_array'
+            },
+            "medium": {
+                '_default': self.parameters['medium'],
+                '_emit': True,
+                '_updater': 'medium'
+            },
+        }
+
+    def uptake_bounds(self, medium):
+        concentrations = self.substrates.concentrations(medium)
+        current_v0 = self.substrates.uptake_rates(concentrations, self.parameters['enz_concentration'])
+        lower_bounds = np.maximum(self.initial_lower_bounds, current_v0)
+        return dict(zip(self.reaction_ids, zip(lower_bounds.tolist(), self.upper_bounds.tolist())))
+
+    def next_update(self, timestep, state):
+        return {
+            "reaction_bounds": self.uptake_bounds(state['medium'])
+        }
+
+
+class MediumExchange(Process):
+    """
+    EnvCalculator of all the species in a shared medium.
+
+    ``species`` maps every species' name to its exchanges, as for
+    MediumBounds. Each species takes ``biomass * flux * time_proportion *
+    timestep / volume`` of every mapped exchange out of (uptake) or into
+    (secretion) the shared Medium, as EnvCalculator does, so one species
+    can feed on what another secretes. All uptakes are collected here, so
+    when the species together demand more of an exchange than the medium
+    holds, each gets its share of what is there in proportion to its
+    demand, and the medium ends at zero rather than below.
+    """
+
+    defaults = {
+        'species': {},
+        'volume': 10,
+        'medium': None,
+        'time_proportion': TIME_PROPORTION,
+    }
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        medium = self.parameters['medium']
+        # name: (the species' exchange reactions, their positions in the medium)
+        self.exchanges = {
+            name: (list(exchanges), medium.positions(list(exchanges.values())))
+            for name, exchanges in self.parameters['species'].items()}
+
+    def ports_schema(self):
+        schema = {
+            name: {
+                "current_biomass_value": {
+                    "_default": 0.0,
+                },
+                "fluxes_values": {
+                    "_default": {}
+                },
+            } for name in self.exchanges}
+        schema["medium"] = {
+            '_default': self.parameters['medium'],
+            '_emit': True,
+            '_updater': 'medium'
+        }
+        return schema
+
+    def next_update(self, timestep, state):
+        medium = state['medium']
+        uptake = np.zeros(len(medium))
+        secretion = np.zeros(len(medium))
+        for name, (reaction_ids, positions) in self.exchanges.items():
+            fluxes_values = state[name]['fluxes_values']
+            if not fluxes_values:
+                continue
+            fluxes = np.array([fluxes_values.get(reaction_id, 0.0) for reaction_id in reaction_ids])
+            consumption = (state[name]['current_biomass_value'] * (-fluxes)
+                           * self.parameters['time_proportion'] * timestep)
+            np.add.at(uptake, positions, np.maximum(consumption, 0.0))
+            np.add.at(secretion, positions, np.maximum(-consumption, 0.0))
+        available = np.maximum(medium.concentrations, 0.0) * self.parameters['volume']
+        # the species share what the medium holds in proportion to their uptake
+        share = np.divide(available, uptake, out=np.ones(len(medium)), where=uptake > available)
+        return {
+            "medium": (secretion - uptake * share) / self.parameters['volume']
+        }
+
+
+def default_config():
+    return {
+        'main': {
+            'simulation_time': 60,
+            'parallel': True,
+            'medium': {'EX_glc__D_e': 11.1, 'EX_ac_e': 0.0},
+            'volume': 10,
+        },
+        'species': {
+            'ecoli': {
+                'model_file': os.path.join(DATA_DIR, 'e_coli_core.xml'),
+                'exchanges': {'EX_glc__D_e': 'EX_glc__D_e', 'EX_ac_e': 'EX_ac_e'},
+                'kcat': 5,
+                'km': 0.1,
+                'enz_concentration': 5,
+            },
+            'alteromonas': {
+                'model_file': os.path.join(DATA_DIR, 'Alteromonas_Model.xml'),
+                'exchanges': {'EX_cpd00027_e0': 'EX_glc__D_e', 'EX_cpd00029_e0': 'EX_ac_e'},
+                'open_uptakes': ALTEROMONAS_MINIMAL_MEDIUM,
+                'kcat': 5,
+                'km': 0.1,
+                'enz_concentration': 5,
+            },
+        },
+    }
+
+
+def species_processes(species_config, medium, parallel, executor=None):
+    reaction_bounds = MediumBounds(dict(species_config, medium=medium))
+    dynamic_fba = DynamicFBA({
+        'model_file': species_config['model_file'],
+        'reaction_bounds': reaction_bounds,
+        'warm_start': species_config.get('warm_start', False),
+        'flux_outputs': list(species_config['exchanges']),
+        '_parallel': parallel,
+        'executor': executor,
+    })
+    initial_biomass = species_config.get('initial_biomass')
+    if initial_biomass is None:
+        initial_biomass = dynamic_fba.next_update(1, {"reaction_bounds": reaction_bounds.bounds})["objective_flux"]
+    return {
+        'ReactionBounds': reaction_bounds,
+        'DynamicFBA': dynamic_fba,
+        'BiomassCalculator': BiomassCalculator({'initial_objective_flux': initial_biomass}),
+    }
+
+
+def species_topology():
+    return {
+        'ReactionBounds': {
+            'reaction_bounds': ('reaction_bounds',),
+            'medium': ('..', 'medium'),
+        },
+        'DynamicFBA': {
+            'fluxes': ('fluxes_values',),
+            'reactions': ('reactions_list',),
+            'objective_flux': ('objective_flux_value',),
+            'reaction_bounds': ('reaction_bounds',),
+        },
+        'BiomassCalculator': {
+            'objective_flux': ('objective_flux_value',),
+            'current_biomass': ('current_biomass_value',),
+        },
+    }
+
+
+def main(config):
+    """
+    Runs several species against one shared Medium.
+
+    Each species under ``config['species']`` gets its own ReactionBounds,
+    DynamicFBA and BiomassCalculator under its own store, and one
+    MediumExchange takes the uptakes and secretions of all of them out of
+    and into the top-level ``medium`` store. With
+    ``config['main']['parallel']`` each species' DynamicFBA runs in its own
+    OS process, so the per-species LPs of a timestep are solved concurrently.
+    Starting those processes costs a few seconds, which pays off for long
+    runs of genome-scale models rather than for short runs of core models.
+    ``config['main']['executor']`` instead solves the LPs on a pool shared
+    by all species (``'process'``, or e.g. ``{'kind': 'process', 'workers':
+    4}`` for more species than cores), see library.dispatch.
+
+    Returns ``(data, output, processes, topology)`` like dFBA_modular's
+    ``main``: ``output`` is ``data`` itself unless ``config['main']['pf']``
+    asks for the ``pf()`` string of a RAM run.
+    """
+    main_config = config['main']
+    medium = Medium.from_dict(main_config['medium'])
+    executor = main_config.get('executor')
+    parallel = main_config.get('parallel', executor is None)
+    processes = {}
+    topology = {}
+    initial_state = {'medium': medium.copy()}
+    for name, species_config in config['species'].items():
+        processes[name] = species_processes(species_config, medium, parallel, executor)
+        topology[name] = species_topology()
+        initial_state[name] = {'reaction_bounds': processes[name]['ReactionBounds'].bounds.copy()}
+    processes['MediumExchange'] = MediumExchange({
+        'species': {name: species_config['exchanges'] for name, species_config in config['species'].items()},
+        'volume': main_config.get('volume', 10),
+        'medium': medium})
+    topology['MediumExchange'] = dict({name: (name,) for name in config['species']}, medium=('medium',))
+
+    emit_policies = main_config.get(
+        'emit_policies', {(name, 'reactions_list'): 'once' for name in config['species']})
+    emitter = dict(main_config.get('emitter', {'type': 'policy'}), policies=emit_policies)
+    sim = Engine(
+        processes=processes, topology=topology, initial_state=initial_state,
+        emitter=emitter)
+    try:
+        sim.update(main_config['simulation_time'])
+    finally:
+        sim.end()
+    data = sim.emitter.get_data()
+    output = pf(data) if main_config.get('pf') and isinstance(data, dict) else data
+    return data, output, processes, topology
+
+
+def test_community():
+    config = default_config()
+    config['main']['simulation_time'] = 5
+    serial_config = default_config()
+    serial_config['main'].update(simulation_time=5, parallel=False)
+
+    data = main(config)[0]
+    serial_data = main(serial_config)[0]
+    # the species' solvers are rebuilt in the worker processes, so allow for round-off
+    for exchange_id, concentration in serial_data[5.0]['medium'].items():
+        assert abs(data[5.0]['medium'][exchange_id] - concentration) < 1e-9
+    for name in ('ecoli', 'alteromonas'):
+        biomass = data[5.0][name]['current_biomass_value']
+        assert abs(biomass - serial_data[5.0][name]['current_biomass_value']) < 1e-9 * biomass
+        assert biomass > data[0.0][name]['current_biomass_value']
+    assert data[5.0]['medium']['EX_glc__D_e'] < 11.1
+    assert all(value >= 0.0 for state in data.values() for value in state['medium'].values())
+
+
+def test_medium_exchange():
+    medium = Medium.from_dict({'EX_glc__D_e': 0.01, 'EX_ac_e': 0.0})
+    exchange = MediumExchange({
+        'species': {'a': {'EX_glc': 'EX_glc__D_e', 'EX_ac': 'EX_ac_e'}, 'b': {'EX_cpd00027_e0': 'EX_glc__D_e'}},
+        'medium': medium})
+    state = {
+        'a': {'current_biomass_value': 0.5, 'fluxes_values': {'EX_glc': -0.06, 'EX_ac': 1.2}},
+        'b': {'current_biomass_value': 0.5, 'fluxes_values': {}},
+        'medium': medium}
+    step = exchange.next_update(1.0, state)['medium']
+    # changes scale with the timestep
+    assert exchange.next_update(2.0, state)['medium'][1] == 2 * step[1] > 0
+    # the species together take no more than the medium holds, in proportion to their demand
+    state['b']['fluxes_values'] = {'EX_cpd00027_e0': -0.18}
+    delta = exchange.next_update(10000.0, state)['medium']
+    assert abs(delta[0] + 0.01) < 1e-15
+    medium.add(delta)
+    assert medium['EX_glc__D_e'] >= 0.0
+
+
+def test_community_executor():
+    config = default_config()
+    config['main'].update(simulation_time=5, parallel=False)
+    serial_data = main(config)[0]
+    config['main']['executor'] = {'kind': 'process', 'workers': 2}
+    data, _, processes, _ = main(config)
+    assert processes['ecoli']['DynamicFBA'].dispatcher.remote
+    # every species solves its own copy of its LP, in order, so the run is the serial one
+    assert data[5.0]['medium'] == serial_data[5.0]['medium']
+    for name in ('ecoli', 'alteromonas'):
+        assert data[5.0][name]['current_biomass_value'] == serial_data[5.0][name]['current_biomass_value']
@@ -1,13 +1,19 @@
 from vivarium.core.process import Process
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.timestep import SharedTimestep
 TIME_PROPORTION = (1 / 60)
-class BiomassCalculator(Process):
+class BiomassCalculator(Checkpointed, SharedTimestep, Process):
     """
 This class computes the current biomass based on the objective flux.
 
 BiomassCalculator takes in the initial objective flux and estimates the current biomass at each update. The calculation is based on the objective flux, the time proportion, and the current biomass.
 """
 
-    defaults = {'initial_objective_flux': None}
+    defaults = {
+        'initial_objective_flux': None,
+        'time_proportion': TIME_PROPORTION,
+    }
+    checkpoint_attributes = ('current_biomass',)
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
@@ -28,12 +34,13 @@ BiomassCalculator takes in the initial objective flux and estimates the current
                 '_default': 0.0,
                 '_emit': True,
                 "_updater": "set"
-            }
+            },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
         objective_flux = state["objective_flux"]
-        current_biomass = self.compute_biomass(objective_flux, TIME_PROPORTION)
+        current_biomass = self.compute_biomass(objective_flux, self.parameters['time_proportion'] * timestep)
         return {
             "current_biomass": current_biomass
         }
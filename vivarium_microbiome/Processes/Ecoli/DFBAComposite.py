@@ -0,0 +1,250 @@
+import os
+
+import numpy as np
+from vivarium.core.process import Process
+
+from vivarium_microbiome.Processes.Ecoli.DynamicFBA import DynamicFBA
+from vivarium_microbiome.Processes.Ecoli.ReactionBounds import ReactionBounds
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.dispatch import Dispatched
+from vivarium_microbiome.library.medium import Medium
+from vivarium_microbiome.library.random_streams import RandomStream
+from vivarium_microbiome.library.timestep import SharedTimestep
+
+TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
+REACTION_BOUNDS_PARAMETERS = ('model_file', 'substrates', 'kcat', 'km', 'init_concentration', 'enz_concentration')
+DYNAMIC_FBA_PARAMETERS = ('model_file', 'warm_start', 'flux_outputs', 'solution_cache', 'surrogate', 'executor')
+
+
+class DFBAComposite(Checkpointed, Dispatched, SharedTimestep, Process):
+    """
+    The seven processes of dFBA_modular's main fused into one process.
+
+    One update does what RegulatoryProtein, GeneExpression, ProteinExpression,
+    ReactionBounds, DynamicFBA, BiomassCalculator and EnvCalculator do in one
+    timestep of the modular composite, with the values passed between them
+    held in local variables instead of stores. The modular processes all
+    compute from the stores at the start of the timestep, so each one sees
+    what the one before it wrote a timestep earlier; the fused update keeps
+    that one-step lag, and draws the regulation probability when the
+    RegulatoryProtein Step would, from a RandomStream with the same seed, so
+    a run is numerically identical to the modular one (only
+    ``regulation_probability`` at time 0 is the parameter instead of the
+    first draw). The bounds and the LP solve are those of a ReactionBounds
+    and a DynamicFBA the composite holds, so the fused loop follows every
+    change to them; ``executor`` dispatches the DynamicFBA's solves.
+
+    Only ``reaction_bounds`` and ``concentrations`` are read from stores, so
+    other processes may still change the medium or the bounds. All the
+    stores of the modular composite are written, for the emitter and for
+    AdaptiveTimestep.
+    """
+
+    defaults = {
+        'model_file': None,
+        'substrates': None,  # as for ReactionBounds; None limits glucose only
+        'kcat': 5,
+        'init_concentration': 11.1,
+        'regulation_probability': 0.5,
+        'seed': None,  # the RegulatoryProtein stream parameters
+        'distribution': 'uniform',
+        'distribution_parameters': None,
+        'chunk_size': 1024,
+        'gene_expression': 0.55,
+        'enz_concentration': 5,
+        'volume': 10,
+        'time_proportion': TIME_PROPORTION,
+        'initial_objective_flux': None,  # None starts at the objective flux of the initial bounds
+        'warm_start': False,
+        'flux_outputs': 'all',
+        'solution_cache': None,  # as for DynamicFBA
+        'surrogate': None,  # as for DynamicFBA
+        'executor': None,  # as for DynamicFBA
+        'limit_consumption': False,  # as for EnvCalculator
+    }
+    checkpoint_attributes = (
+        'stream', 'regulation_probability', 'gene_expression', 'enz_concentration', 'objective_flux',
+        'exchange_fluxes', 'current_biomass', 'biomass')
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        # the ReactionBounds and DynamicFBA of the fused loop compute the bounds and solve the LP
+        self.reaction_bounds = ReactionBounds(
+            {key: self.parameters[key] for key in REACTION_BOUNDS_PARAMETERS if key in self.parameters})
+        self.dynamic_fba = DynamicFBA(
+            {key: self.parameters[key] for key in DYNAMIC_FBA_PARAMETERS if key in self.parameters})
+        self.bounds = self.reaction_bounds.bounds
+        self.substrates = self.reaction_bounds.substrates
+        self.dispatcher = self.dynamic_fba.dispatcher
+        flux_positions = {
+            reaction_id: index for index, reaction_id in enumerate(self.dynamic_fba.flux_reader.reaction_ids)}
+        # EnvCalculator reads a substrate without a flux output as 0.0
+        self.exchange_outputs = np.array([
+            flux_positions.get(exchange_id, -1) for exchange_id in self.substrates.exchange_ids], dtype=np.intp)
+        # the solve main does for the initial objective flux
+        initial_objective_flux = self.dynamic_fba.next_update(0, {'reaction_bounds': self.bounds})['objective_flux']
+        if self.parameters['initial_objective_flux'] is not None:
+            initial_objective_flux = self.parameters['initial_objective_flux']
+
+        # the modular stores, at their defaults
+        self.stream = RandomStream.from_parameters(self.parameters)
+        self.regulation_probability = None  # drawn on the first update, as the Step runs when the Engine starts
+        self.gene_expression = self.parameters['gene_expression']
+        self.enz_concentration = self.parameters['enz_concentration']
+        self.objective_flux = 0.0
+        self.exchange_fluxes = np.zeros(len(self.substrates))
+        self.current_biomass = 0.0
+        # BiomassCalculator's own biomass, which the store only gets after the first update
+        self.biomass = initial_objective_flux
+
+    def ports_schema(self):
+        return {
+            "regulation_probability": {
+                '_default': self.parameters['regulation_probability'],
+                '_emit': True,
+                "_updater": "set"
+            },
+            "gene_expression": {
+                '_default': self.parameters['gene_expression'],
+                '_emit': True,
+                "_updater": "set"
+            },
+            "enz_concentration": {
+                "_default": self.parameters['enz_concentration'],
+                '_emit': True,
+                "_updater": "set"
+            },
+            "reaction_bounds": {
+                '_default': self.bounds,
+                '_emit': True,
+                '_updater': 'bounds_array'
+            },
+            "current_v0": {
+                '_default': -10.0,
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "fluxes": {
+                '_default': {},
+                '_emit': True,
+                "_updater": "set"
+            },
+            "reactions": {
+                '_default': [str(reaction) for reaction in self.dynamic_fba.model.reactions],
+                '_emit': True,
+                "_updater": "set"
+            },
+            "objective_flux": {
+                '_default': 0.0,
+                '_emit': True,
+                "_updater": "set"
+            },
+            "current_biomass": {
+                '_default': 0.0,
+                '_emit': True,
+                "_updater": "set"
+            },
+            "current_env_consumption": {
+                "_default": 0.0,
+                "_emit": True,
+                "_updater": "accumulate",
+            },
+            "concentration": {
+                "_default": self.substrates.init_concentrations[0].item(),
+                "_emit": True,
+                "_updater": "accumulate",
+            },
+            "concentrations": {
+                "_default": self.substrates.medium(),
+                "_emit": True,
+                "_updater": "medium",
+            },
+            "timestep": self.timestep_schema(),
+        }
+
+    def checkpoint_state(self):
+        return dict(super().checkpoint_state(), dynamic_fba=self.dynamic_fba.checkpoint_state())
+
+    def restore_state(self, state):
+        state = dict(state)
+        self.dynamic_fba.restore_state(state.pop('dynamic_fba'))
+        super().restore_state(state)
+
+    def next_update(self, timestep, state):
+        return self.dispatch_update(timestep, state)()
+
+    def dispatch_update(self, timestep, state):
+        """Start DynamicFBA's update, which submits the LP when the process has an executor, and finish after it."""
+        bounds_update = self.reaction_bounds_update(timestep, state)
+        fba_state = {'reaction_bounds': state['reaction_bounds']}
+        if self.dispatcher is None:
+            fba_update = self.dynamic_fba.next_update(timestep, fba_state)
+            return lambda: self.finish_update(timestep, bounds_update, fba_update)
+        collect = self.dynamic_fba.dispatch_update(timestep, fba_state)
+        return lambda: self.finish_update(timestep, bounds_update, collect())
+
+    def reaction_bounds_update(self, timestep, state):
+        if self.regulation_probability is None:
+            self.regulation_probability = self.stream.next()
+
+        # ReactionBounds, at the enzyme concentration of the last timestep
+        concentrations = self.substrates.concentrations(state['concentrations']).copy()
+        update = self.reaction_bounds.next_update(timestep, {
+            'concentration': concentrations[0], 'concentrations': state['concentrations'],
+            'enz_concentration': self.enz_concentration})
+        return concentrations, update
+
+    def finish_update(self, timestep, bounds_update, fba_update):
+        concentrations, update = bounds_update
+        # DynamicFBA, at the bounds ReactionBounds set a timestep ago
+        objective_flux = fba_update['objective_flux']
+        fluxes = self.dynamic_fba.flux_reader.fluxes
+        exchange_fluxes = np.where(self.exchange_outputs >= 0, fluxes[self.exchange_outputs], 0.0)
+
+        # BiomassCalculator, from the objective flux of the last timestep
+        self.biomass += self.objective_flux * (self.parameters['time_proportion'] * timestep) * self.biomass
+
+        # EnvCalculator, from the biomass and fluxes of the last timestep
+        env_consumption = self.current_biomass * (-self.exchange_fluxes) * self.parameters['time_proportion'] * timestep
+        if self.parameters['limit_consumption']:
+            env_consumption = self.substrates.limit_consumption(env_consumption, concentrations, self.parameters['volume'])
+        delta_c = env_consumption / self.parameters['volume']
+
+        # ProteinExpression, GeneExpression and then the RegulatoryProtein Step
+        self.enz_concentration = self.gene_expression * 10
+        self.gene_expression = self.regulation_probability * 10/10
+        self.regulation_probability = self.stream.next()
+
+        self.objective_flux = objective_flux
+        self.exchange_fluxes = exchange_fluxes
+        self.current_biomass = self.biomass
+        return {
+            "regulation_probability": self.regulation_probability,
+            "gene_expression": self.gene_expression,
+            "enz_concentration": self.enz_concentration,
+            "reaction_bounds": update['reaction_bounds'],
+            "current_v0": update['current_v0'],
+            "fluxes": fba_update['fluxes'],
+            "objective_flux": objective_flux,
+            "current_biomass": self.current_biomass,
+            "current_env_consumption": float(env_consumption[0]),
+            "concentration": float(-delta_c[0]),
+            "concentrations": dict(zip(self.substrates.exchange_ids, (-delta_c).tolist())),
+        }
+
+
+def test_dfba_composite():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../../data/e_coli_core.xml")
+    fused = DFBAComposite({'model_file': model_path, 'km': 0.1, 'flux_outputs': ['EX_glc__D_e']})
+    state = {'reaction_bounds': fused.bounds.copy(), 'concentrations': fused.substrates.medium()}
+    initial_biomass = fused.biomass
+    for _ in range(3):
+        update = fused.next_update(1.0, state)
+        state['reaction_bounds'].update(update['reaction_bounds'])
+        state['concentrations'].add(update['concentrations'])
+    # the stores trail each other by a timestep, as in the modular composite
+    assert update['current_biomass'] > initial_biomass
+    assert fused.enz_concentration != 5
+    assert state['concentrations']['EX_glc__D_e'] < 11.1
+    assert isinstance(state['concentrations'], Medium)
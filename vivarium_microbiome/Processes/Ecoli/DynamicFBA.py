@@ -1,20 +1,47 @@
 from vivarium.core.process import Process
-from cobra.io import read_sbml_model
+from cobra.util.solver import check_solver_status
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.bounds import BoundsArray, SolverBounds
+from vivarium_microbiome.library.lp import FluxReader, WarmStartLP, restore_solver_state, solution_cache, solver_state
+from vivarium_microbiome.library.surrogate import FluxSurrogate
+from vivarium_microbiome.library.profiling import phase
+from vivarium_microbiome.library.dispatch import Dispatched, dispatcher
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.timestep import SharedTimestep
 
 
-class DynamicFBA(Process):
+class DynamicFBA(Checkpointed, Dispatched, SharedTimestep, Process):
     """
     This class conducts the flux balance analysis for the model.
 
     DynamicFBA accepts an SBML model and the reaction bounds. It calculates flux balance analysis and optimizes it at each update, producing the fluxes and objective value as output.
     """
 
-    defaults = {'reaction_bounds': None}
+    defaults = {
+        'reaction_bounds': None,
+        'warm_start': False,  # re-solve each step from the previous optimal basis
+        'flux_outputs': 'all',  # 'all' or the list of reaction IDs to output fluxes for
+        'solution_cache': None,  # True, or a dict of SolutionCache parameters and 'shared', see library.lp
+        'surrogate': None,  # an exchange ID, or a dict of load_flux_table parameters, see library.surrogate
+        'executor': None,  # 'thread', 'process' or a dict with 'kind' and 'workers', see library.dispatch
+    }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters["model_file"])
+        self.model = load_model(self.parameters["model_file"])
         self.reaction_bounds = self.parameters['reaction_bounds']
+        self.solver_bounds = SolverBounds(self.model)  # bounds currently in the solver
+        self.warm_start = WarmStartLP(self.model) if self.parameters['warm_start'] else None
+        self.flux_reader = FluxReader(self.model, self.parameters['flux_outputs'])
+        self.solution_cache = solution_cache(
+            self.parameters['model_file'], self.model, self.flux_reader.reaction_ids,
+            self.parameters['solution_cache'])
+        self.surrogate = FluxSurrogate.from_parameter(
+            self.parameters['model_file'], self.model, self.flux_reader.reaction_ids,
+            self.parameters['surrogate'])
+        # the copy that solves on a worker process looks up nothing and dispatches nothing
+        self.dispatcher = dispatcher(self, self.parameters['executor'], dict(
+            self.parameters, reaction_bounds=None, solution_cache=None, surrogate=None, executor=None))
 
     def ports_schema(self):
         return {
@@ -34,25 +61,102 @@ class DynamicFBA(Process):
                 "_updater": "set"
             },
             "reaction_bounds": {
-                '_default': self.reaction_bounds.bounds if self.reaction_bounds else {},
+                '_default': self.reaction_bounds.bounds if self.reaction_bounds else BoundsArray.from_model(self.model),
                 '_emit': True,
-                "_updater": "set"
-            }
+                "_updater": "bounds_array"
+            },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
-        reaction_bounds = state["reaction_bounds"]
-        for reaction_id, (lower_bound, upper_bound) in reaction_bounds.items():
-            reaction = self.model.reactions.get_by_id(reaction_id)
-            reaction.lower_bound, reaction.upper_bound = lower_bound, upper_bound
+        if self.dispatcher is not None:
+            # every solve of a dispatched process is on the same LP
+            return self.dispatch_update(timestep, state)()
+        key, solution = self.lookup(state["reaction_bounds"])
+        if solution is None:
+            solution = self.solve_fluxes(state["reaction_bounds"])
+            self.store(key, solution)
+        return self.update_from(solution)
+
+    def dispatch_update(self, timestep, state):
+        """Submit the LP of next_update to the executor, unless the surrogate or the cache has its solution."""
+        key, solution = self.lookup(state["reaction_bounds"])
+        if solution is not None:
+            return lambda: self.update_from(solution)
+        # the store's bounds change in place when the updates of this timestep are applied
+        future = self.dispatcher.solve(state["reaction_bounds"].copy())
+
+        def collect():
+            solved = future.result()
+            self.store(key, solved)
+            return self.update_from(solved)
+        return collect
 
-        solution = self.model.optimize()
-        objective_value = solution.objective_value
-        fluxes = solution.fluxes.to_dict()
+    def lookup(self, reaction_bounds):
+        """The cache key and the surrogate's or the cache's ``(objective value, fluxes)`` at ``reaction_bounds``, or None."""
+        key = solution = None
+        if self.surrogate is not None:
+            solution = self.surrogate.evaluate(reaction_bounds)
+        if solution is None and self.solution_cache is not None:
+            key, solution = self.solution_cache.lookup(reaction_bounds)
+        return key, solution
+
+    def store(self, key, solution):
+        if self.solution_cache is not None:
+            self.solution_cache.store(key, *solution)
+
+    def update_from(self, solution):
+        objective_value, fluxes = solution
+        if fluxes is not self.flux_reader.fluxes:
+            self.flux_reader.fluxes[:] = fluxes
+        with phase('to_dict'):
+            fluxes = self.flux_reader.to_dict()
 
         return {
             "fluxes": fluxes,
             "objective_flux": objective_value
         }
 
+    def solve_fluxes(self, reaction_bounds):
+        """``(objective value, fluxes)`` of the LP at ``reaction_bounds``, with flux_reader's fluxes array."""
+        return self.solve(reaction_bounds), self.flux_reader.fluxes
+
+    def solve(self, reaction_bounds):
+        """Solve the LP at ``reaction_bounds`` and return the objective value; the fluxes are in flux_reader."""
+        # only the reactions whose bounds changed since the last solve reach the solver
+        with phase('apply_bounds'):
+            self.solver_bounds.apply(reaction_bounds)
+
+        with phase('solve'):
+            if self.warm_start:
+                self.warm_start.solve()
+            else:
+                self.model.slim_optimize()
+        check_solver_status(self.model.solver.status)
+        with phase('read_fluxes'):
+            self.flux_reader.read()
+        return self.model.solver.objective.value
+
+    def checkpoint_state(self):
+        state = {'solver': self.solver_checkpoint()}
+        if self.solution_cache is not None:
+            state['solution_cache'] = self.solution_cache.state()
+        return state
+
+    def restore_state(self, state):
+        self.restore_solver(state['solver'])
+        if 'solution_cache' in state:
+            self.solution_cache.restore(state['solution_cache'])
+
+    def solver_checkpoint(self):
+        if self.dispatcher is not None and self.dispatcher.remote:
+            return self.dispatcher.call('solver_checkpoint')
+        return solver_state(self.solver_bounds, self.warm_start)
+
+    def restore_solver(self, state):
+        if self.dispatcher is not None and self.dispatcher.remote:
+            self.dispatcher.call('restore_solver', state)
+        else:
+            restore_solver_state(self.solver_bounds, state, self.warm_start)
+
 
@@ -1,19 +1,26 @@
 from vivarium.core.process import Process
+import numpy as np
+from vivarium_microbiome.library.uptake import Substrates
+from vivarium_microbiome.library.timestep import SharedTimestep
 TIME_PROPORTION = (1 / 60)
-class EnvCalculator(Process):
+class EnvCalculator(SharedTimestep, Process):
     """
-    This class estimates the environmental consumption (Glucose in this case) and concentration.
+    This class estimates the environmental consumption and concentration of the limiting substrates (glucose by default).
 
-    EnvCalculator calculates the environmental consumption using the current biomass and flux values. It also updates the concentration.
+    EnvCalculator calculates the environmental consumption using the current biomass and flux values. It also updates the concentrations store, and the concentration and current_env_consumption of the first substrate.
     """
 
     defaults = {
         'init_concentration': 11.1,
         'volume': 10,
+        'substrates': None,  # as for ReactionBounds; None tracks glucose only
+        'time_proportion': TIME_PROPORTION,
+        'limit_consumption': False,  # True never consumes more than is left, so depleted substrates stay at zero
     }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
+        self.substrates = Substrates.from_parameters(self.parameters, kinetics=False)
 
     def ports_schema(self):
         return {
@@ -29,26 +36,31 @@ class EnvCalculator(Process):
                 "_updater": "accumulate",
             },
             "concentration": {
-                "_default": self.parameters['init_concentration'],
+                "_default": self.substrates.init_concentrations[0].item(),
                 "_emit": True,
                 "_updater": "accumulate",
             },
+            "concentrations": {
+                "_default": self.substrates.medium(),
+                "_emit": True,
+                "_updater": "medium",
+            },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
         current_biomass = state["current_biomass"]
-        concentration = state["concentration"]
         fluxes_values = state["fluxes_values"]
-        env_consumption = 0
-        if "EX_glc__D_e" in fluxes_values:
-            env_consumption = (
-                    current_biomass * (-fluxes_values["EX_glc__D_e"]) * TIME_PROPORTION
-            )
+        fluxes = np.array([fluxes_values.get(exchange_id, 0.0) for exchange_id in self.substrates.exchange_ids])
+        env_consumption = current_biomass * (-fluxes) * self.parameters['time_proportion'] * timestep
+        if self.parameters['limit_consumption']:
+            env_consumption = self.substrates.limit_consumption(
+                env_consumption, self.substrates.concentrations(state["concentrations"]), self.parameters['volume'])
         delta_c = env_consumption / self.parameters['volume']
-        concentration += (-delta_c)
 
+        # current_env_consumption and concentration follow the first substrate
         return {
-            "current_env_consumption": env_consumption,
-            "concentration": - delta_c,
+            "current_env_consumption": float(env_consumption[0]),
+            "concentration": float(-delta_c[0]),
+            "concentrations": dict(zip(self.substrates.exchange_ids, (-delta_c).tolist())),
         }
-
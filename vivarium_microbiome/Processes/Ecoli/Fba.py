@@ -7,14 +7,19 @@ from vivarium.core.process import Process
 from vivarium.core.engine import Engine, pf
 import numpy as np
 
-from cobra.io import read_sbml_model
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.lp import FluxReader, solve_conditions
 from cobra.util import create_stoichiometric_matrix
+from cobra.util.solver import check_solver_status
 
 class FBA(Process):
-    defaults = {}
+    defaults = {
+        'flux_outputs': 'all',  # 'all' or the list of reaction IDs to output fluxes for
+    }
     def __init__(self, parameters = None):
         super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters["model_file"])
+        self.model = load_model(self.parameters["model_file"])
+        self.flux_reader = FluxReader(self.model, self.parameters['flux_outputs'])
 
     def ports_schema(self):
         return {
@@ -35,10 +40,22 @@ class FBA(Process):
             }
         }
 
+    def solve_batch(self, conditions, reaction_ids=None):
+        """
+        Solve the model once per condition and return a BatchSolution whose
+        ``fluxes`` is a conditions x reactions matrix. ``conditions`` is a list
+        of ``{reaction_id: (lower, upper)}`` overrides, or an array of shape
+        (conditions, len(reaction_ids), 2). The model's own bounds are left
+        unchanged.
+        """
+        return solve_conditions(self.model, conditions, reaction_ids, self.flux_reader)
+
     def next_update(self, timestep, state):
-        solution = self.model.optimize()
-        objective_value = solution.objective_value
-        fluxes = solution.fluxes.to_dict()
+        self.model.slim_optimize()
+        check_solver_status(self.model.solver.status)
+        objective_value = self.model.solver.objective.value
+        self.flux_reader.read()
+        fluxes = self.flux_reader.to_dict()
         return {
             "fluxes": fluxes,
             "objective_flux": objective_value
@@ -64,5 +81,13 @@ def main(model_path):
 
 def test_fba():
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    model_path = os.path.join(current_dir, "../../data/e_coli_core.xml")
     main(model_path)
+
+
+def test_fba_batch():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    fba = FBA({"model_file": os.path.join(current_dir, "../../data/e_coli_core.xml")})
+    batch = fba.solve_batch(np.array([[[-10.0, 1000.0]], [[-4.0, 1000.0]]]), reaction_ids=["EX_glc__D_e"])
+    assert batch.fluxes.shape == (2, len(fba.model.reactions))
+    assert batch.objective_values[1] < batch.objective_values[0]
@@ -0,0 +1,279 @@
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from optlang.interface import OPTIMAL
+from vivarium.core.process import Process
+from vivarium.core.engine import Engine, pf
+
+from vivarium_microbiome.library.lattice import SharedArrays, diffuse, row_blocks
+from vivarium_microbiome.library.lp import FluxReader, WarmStartLP, solve_conditions
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.profiling import phase
+from vivarium_microbiome.library.uptake import Substrates
+
+TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
+
+
+class SiteSolver:
+    """
+    ReactionBounds, DynamicFBA, BiomassCalculator and EnvCalculator for the
+    sites of a block of the lattice, on one model.
+    """
+
+    def __init__(self, parameters):
+        self.model = load_model(parameters['model_file'])
+        # only the kinetics: the initial concentrations may be lattice arrays, which the process keeps
+        self.substrates = Substrates.from_parameters(dict(parameters, init_concentration=0.0))
+        self.exchange_ids = list(self.substrates.exchange_ids)
+        exchanges = [self.model.reactions.get_by_id(exchange_id) for exchange_id in self.exchange_ids]
+        self.initial_lower_bounds = np.array([exchange.lower_bound for exchange in exchanges])
+        self.upper_bounds = np.array([exchange.upper_bound for exchange in exchanges])
+        self.flux_reader = FluxReader(self.model, self.exchange_ids)
+        self.lp = WarmStartLP(self.model)  # keeps the basis from one timestep's batch to the next
+        self.enz_concentration = parameters['enz_concentration']
+        self.volume = parameters['volume']
+        self.solves = 0
+
+    def solve(self, lower_bounds):
+        """Growth rate and exchange fluxes of every row of ``lower_bounds``, solving each distinct row once."""
+        unique, inverse = np.unique(lower_bounds, axis=0, return_inverse=True)
+        conditions = np.empty(unique.shape + (2,))
+        conditions[..., 0] = unique
+        conditions[..., 1] = self.upper_bounds
+        batch = solve_conditions(self.model, conditions, self.exchange_ids, self.flux_reader, self.lp)
+        self.solves += len(unique)
+        optimal = np.array([status == OPTIMAL for status in batch.statuses])
+        growth = np.where(optimal, batch.objective_values, 0.0)
+        fluxes = np.where(optimal[:, None], batch.fluxes, 0.0)
+        inverse = inverse.reshape(-1)
+        return growth[inverse], fluxes[inverse]
+
+    def step(self, biomass, concentrations, growth_rate, dt):
+        """
+        One timestep of the sites in the ``biomass`` (rows, columns) and
+        ``concentrations`` (substrates, rows, columns) views, in place.
+        Sites without biomass are not solved.
+        """
+        growth_rate[...] = 0.0
+        occupied = biomass > 0
+        if not occupied.any():
+            return
+        site_biomass = biomass[occupied]
+        site_concentrations = concentrations[:, occupied].T
+        uptake = self.substrates.uptake_rates(site_concentrations, self.enz_concentration)
+        growth, fluxes = self.solve(np.maximum(self.initial_lower_bounds, uptake))
+        change = site_biomass[:, None] * fluxes * dt / self.volume
+        concentrations[:, occupied] = np.maximum(site_concentrations + change, 0.0).T
+        biomass[occupied] = site_biomass + growth * dt * site_biomass
+        growth_rate[occupied] = growth
+
+
+_worker = {}
+
+
+def _init_worker(parameters, spec):
+    _worker['solver'] = SiteSolver(parameters)
+    _worker['shared'] = SharedArrays(spec=spec)
+
+
+def _step_block(start, stop, dt):
+    shared = _worker['shared']
+    solver = _worker['solver']
+    solves = solver.solves
+    solver.step(
+        shared['biomass'][start:stop], shared['concentrations'][:, start:stop],
+        shared['growth_rate'][start:stop], dt)
+    return solver.solves - solves
+
+
+class LatticeDFBA(Process):
+    """
+    dFBA on a 2D lattice of well-mixed sites, for media that are not well mixed.
+
+    Every site holds its own biomass and substrate concentrations and does
+    what ReactionBounds, DynamicFBA, BiomassCalculator and EnvCalculator do
+    for one population, as PopulationDFBA does for its wells: Michaelis-Menten
+    uptake bounds from the local concentrations, one LP, growth by
+    ``growth * dt * biomass``, and the exchange fluxes times the biomass
+    taken out of (or added to) the site's ``volume``. The substrates then
+    diffuse between neighbouring sites, see library.lattice.diffuse; biomass
+    does not move.
+
+    ``substrates`` (or ``kcat``, ``km`` and ``init_concentration`` for
+    glucose alone) are as for ReactionBounds. ``initial_biomass`` and
+    ``init_concentration`` may be arrays over the lattice, e.g. to seed a
+    colony in one corner; ``initial_biomass`` None puts the model's initial
+    objective flux on every site. ``diffusion`` is one coefficient, or one
+    per substrate, in ``dx`` squared per hour.
+
+    The sites are split into ``workers`` blocks of rows. With more than one
+    worker each block is solved on its own worker process, which keeps one
+    model and reads and writes its sites in shared memory; the diffusion
+    stencil is one vectorized pass over the whole lattice in this process,
+    so there is no halo to exchange. Sites with the same uptake bounds in a
+    block share one LP solve, and empty sites are not solved. Every block
+    keeps one WarmStartLP, so each timestep's solves start from the basis
+    the block's last solve ended with.
+    """
+
+    defaults = {
+        'model_file': None,
+        'shape': (10, 10),  # lattice rows and columns
+        'substrates': None,  # as for ReactionBounds; None limits glucose only
+        'kcat': 5,
+        'km': 0.1,
+        'init_concentration': 11.1,
+        'enz_concentration': 5,
+        'volume': 1,  # of one site
+        'dx': 1.0,
+        'diffusion': 0.1,
+        'initial_biomass': None,
+        'time_proportion': TIME_PROPORTION,
+        'workers': 1,
+    }
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        self.shape = tuple(self.parameters['shape'])
+        self.solver = SiteSolver(self.parameters)
+        self.substrates = self.solver.substrates
+        initial_biomass = self.parameters['initial_biomass']
+        if initial_biomass is None:
+            initial_biomass = self.solver.model.slim_optimize()
+        self.initial_biomass = np.broadcast_to(np.asarray(initial_biomass, dtype=float), self.shape).copy()
+        if self.parameters['substrates']:
+            initial = self.substrates.init_concentrations[:, None, None]
+        else:
+            initial = np.asarray(self.parameters['init_concentration'], dtype=float)
+        self.initial_concentrations = np.broadcast_to(initial, (len(self.substrates),) + self.shape).copy()
+        self.diffusion = np.broadcast_to(
+            np.asarray(self.parameters['diffusion'], dtype=float), (len(self.substrates),))
+        self.blocks = row_blocks(self.shape[0], self.parameters['workers'])
+        self.shared = None
+        self.executor = None
+        self.solves = 0
+
+    def ports_schema(self):
+        return {
+            "biomass": {
+                '_default': self.initial_biomass,
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "concentrations": {
+                '_default': self.initial_concentrations,
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "growth_rate": {
+                '_default': np.zeros(self.shape),
+                '_emit': True,
+                '_updater': 'set'
+            },
+        }
+
+    def pool(self):
+        if self.executor is None:
+            self.shared = SharedArrays({
+                'biomass': self.shape,
+                'concentrations': self.initial_concentrations.shape,
+                'growth_rate': self.shape,
+            })
+            self.executor = ProcessPoolExecutor(
+                max_workers=len(self.blocks), initializer=_init_worker,
+                initargs=(self.parameters, self.shared.spec))
+            weakref.finalize(self, _close, self.executor, self.shared)
+        return self.executor
+
+    def react(self, biomass, concentrations, growth_rate, dt):
+        """Solve every block for one timestep, in place."""
+        if len(self.blocks) == 1:
+            solves = self.solver.solves
+            self.solver.step(biomass, concentrations, growth_rate, dt)
+            self.solves += self.solver.solves - solves
+            return
+        pool = self.pool()
+        shared = self.shared
+        np.copyto(shared['biomass'], biomass)
+        np.copyto(shared['concentrations'], concentrations)
+        futures = [pool.submit(_step_block, start, stop, dt) for start, stop in self.blocks]
+        self.solves += sum(future.result() for future in futures)
+        np.copyto(biomass, shared['biomass'])
+        np.copyto(concentrations, shared['concentrations'])
+        np.copyto(growth_rate, shared['growth_rate'])
+
+    def next_update(self, timestep, state):
+        dt = self.parameters['time_proportion'] * timestep
+        biomass = np.array(state['biomass'], dtype=float)
+        concentrations = np.array(state['concentrations'], dtype=float)
+        growth_rate = np.zeros(self.shape)
+        with phase('react'):
+            self.react(biomass, concentrations, growth_rate, dt)
+        with phase('diffuse'):
+            diffuse(concentrations, self.diffusion, self.parameters['dx'], dt)
+        return {
+            "biomass": biomass,
+            "concentrations": concentrations,
+            "growth_rate": growth_rate,
+        }
+
+
+def _close(executor, shared):
+    executor.shutdown()
+    shared.close()
+
+
+def main(config):
+    """
+    Run a LatticeDFBA over ``config['main']['simulation_time']``.
+
+    Returns ``(data, output, processes, topology)`` like dFBA_modular's
+    ``main``: ``output`` is ``data`` itself unless ``config['main']['pf']``
+    asks for the ``pf()`` string of a RAM run.
+    """
+    lattice = LatticeDFBA(config['LatticeDFBA'])
+    processes = {'LatticeDFBA': lattice}
+    topology = {
+        'LatticeDFBA': {
+            'biomass': ('biomass',),
+            'concentrations': ('concentrations',),
+            'growth_rate': ('growth_rate',),
+        }
+    }
+    emitter = dict(
+        config['main'].get('emitter', {'type': 'policy'}),
+        policies=config['main'].get('emit_policies', {}))
+    sim = Engine(processes=processes, topology=topology, emitter=emitter)
+    sim.update(config['main']['simulation_time'])
+    data = sim.emitter.get_data()
+    output = pf(data) if config['main'].get('pf') and isinstance(data, dict) else data
+    return data, output, processes, topology
+
+
+def test_lattice_dfba():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../../data/e_coli_core.xml")
+    initial_biomass = np.zeros((6, 5))
+    initial_biomass[0, 0] = 0.5  # a colony in one corner
+    parameters = {
+        'model_file': model_path, 'shape': (6, 5), 'initial_biomass': initial_biomass,
+        'init_concentration': 1.0, 'diffusion': 0.5}
+    lattice = LatticeDFBA(parameters)
+    state = {'biomass': lattice.initial_biomass, 'concentrations': lattice.initial_concentrations}
+    for _ in range(20):
+        state = lattice.next_update(60, state)
+    biomass, concentrations = state['biomass'], state['concentrations'][0]
+    assert biomass[0, 0] > 0.5 and (biomass[initial_biomass == 0] == 0).all()
+    # glucose is depleted around the colony and flows towards it
+    assert concentrations[0, 0] < concentrations[1, 1] < concentrations[5, 4] < 1.0
+    assert lattice.solves == 20  # only the occupied site is solved
+    assert lattice.solver.lp.cold_solves == 1  # every later solve starts from the previous basis
+
+    blocked = LatticeDFBA(dict(parameters, workers=2))
+    state = {'biomass': blocked.initial_biomass, 'concentrations': blocked.initial_concentrations}
+    for _ in range(20):
+        state = blocked.next_update(60, state)
+    assert np.allclose(state['biomass'], biomass)
+    assert np.allclose(state['concentrations'][0], concentrations)
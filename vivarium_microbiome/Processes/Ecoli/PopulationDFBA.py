@@ -0,0 +1,198 @@
+import os
+
+import numpy as np
+from optlang.interface import OPTIMAL
+from vivarium.core.process import Process
+from vivarium.core.engine import Engine, pf
+
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.lp import FluxReader, WarmStartLP, solve_conditions
+
+TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
+
+
+class PopulationDFBA(Process):
+    """
+    dFBA for many subpopulations (strains, replicate wells) in one process.
+
+    Biomass, substrate concentration and the Michaelis-Menten parameters of
+    every well are NumPy arrays. Each update does what ReactionBounds,
+    DynamicFBA, BiomassCalculator and EnvCalculator do for one population,
+    for all wells at once:
+
+    * the uptake bound of ``exchange_id`` is ``max(initial lower bound, -kcat * enz * C / (km + C))``
+    * the LP is solved once per distinct uptake bound, in a single warm-started
+      batch on one model, and the result is shared by every well with that bound;
+      each timestep's batch starts from the last basis of the one before
+    * biomass grows by ``growth * dt * biomass``
+    * ``biomass * uptake * dt`` of substrate is taken out of the well's volume
+
+    Per-well parameters (``kcat``, ``km``, ``enz_concentration``,
+    ``init_concentration``, ``volume``, ``initial_biomass``) are scalars or
+    arrays of length ``wells``. ``initial_biomass`` None starts every well
+    at the model's initial objective flux, as dFBA's main does. Wells whose
+    LP is not optimal (the substrate is exhausted) stop growing and
+    consuming.
+    """
+
+    defaults = {
+        'model_file': None,
+        'wells': 1,
+        'exchange_id': 'EX_glc__D_e',
+        'kcat': 5,
+        'km': 0.1,
+        'enz_concentration': 5,
+        'init_concentration': 11.1,
+        'volume': 10,
+        'initial_biomass': None,
+        'time_proportion': TIME_PROPORTION,
+    }
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        self.model = load_model(self.parameters['model_file'])
+        self.wells = int(self.parameters['wells'])
+        self.exchange_id = self.parameters['exchange_id']
+        exchange = self.model.reactions.get_by_id(self.exchange_id)
+        self.initial_lower_bound, self.upper_bound = exchange.bounds
+        self.flux_reader = FluxReader(self.model, [self.exchange_id])
+        self.lp = WarmStartLP(self.model)  # keeps the basis from one timestep's batch to the next
+
+        self.vmax = self.per_well('kcat') * self.per_well('enz_concentration')
+        self.km = self.per_well('km')
+        self.volume = self.per_well('volume')
+        initial_biomass = self.parameters['initial_biomass']
+        if initial_biomass is None:
+            initial_biomass = self.model.slim_optimize()
+        self.initial_biomass = self.per_well(value=initial_biomass)
+        self.initial_concentration = self.per_well('init_concentration')
+        self.solves = 0
+
+    def per_well(self, parameter=None, value=None):
+        """Broadcast a scalar or per-well parameter to a float array of length ``wells``."""
+        if parameter is not None:
+            value = self.parameters[parameter]
+        return np.broadcast_to(np.asarray(value, dtype=float), (self.wells,)).copy()
+
+    def ports_schema(self):
+        return {
+            "biomass": {
+                '_default': self.initial_biomass,
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "concentration": {
+                '_default': self.initial_concentration,
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "uptake": {
+                '_default': np.zeros(self.wells),
+                '_emit': True,
+                '_updater': 'set'
+            },
+            "growth_rate": {
+                '_default': np.zeros(self.wells),
+                '_emit': True,
+                '_updater': 'set'
+            },
+        }
+
+    def uptake_bounds(self, concentration):
+        """Michaelis-Menten uptake bound of every well, capped at the model's initial bound."""
+        current_v0 = -self.vmax * concentration / (self.km + concentration)
+        return np.maximum(self.initial_lower_bound, current_v0)
+
+    def solve(self, lower_bounds):
+        """Return the growth rate and exchange flux of every well for its ``lower_bounds``."""
+        unique, inverse = np.unique(lower_bounds, return_inverse=True)
+        conditions = np.empty((len(unique), 1, 2))
+        conditions[:, 0, 0] = unique
+        conditions[:, 0, 1] = self.upper_bound
+        batch = solve_conditions(self.model, conditions, [self.exchange_id], self.flux_reader, self.lp)
+        self.solves += len(unique)
+        optimal = np.array([status == OPTIMAL for status in batch.statuses])
+        growth = np.where(optimal, batch.objective_values, 0.0)
+        uptake = np.where(optimal, batch.fluxes[:, 0], 0.0)
+        return growth[inverse], uptake[inverse]
+
+    def next_update(self, timestep, state):
+        biomass = np.asarray(state['biomass'], dtype=float)
+        concentration = np.asarray(state['concentration'], dtype=float)
+        dt = self.parameters['time_proportion'] * timestep
+
+        growth, uptake = self.solve(self.uptake_bounds(concentration))
+        consumption = np.minimum(biomass * -uptake * dt, concentration * self.volume)
+        return {
+            "biomass": biomass + growth * dt * biomass,
+            "concentration": concentration - consumption / self.volume,
+            "uptake": uptake,
+            "growth_rate": growth,
+        }
+
+
+def main(config):
+    """
+    Run a PopulationDFBA over ``config['main']['simulation_time']``.
+
+    Returns ``(data, output, processes, topology)`` like dFBA_modular's
+    ``main``: ``output`` is ``data`` itself unless ``config['main']['pf']``
+    asks for the ``pf()`` string of a RAM run.
+    """
+    population = PopulationDFBA(config['PopulationDFBA'])
+    processes = {'PopulationDFBA': population}
+    topology = {
+        'PopulationDFBA': {
+            'biomass': ('biomass',),
+            'concentration': ('concentration',),
+            'uptake': ('uptake',),
+            'growth_rate': ('growth_rate',),
+        }
+    }
+    emitter = dict(
+        config['main'].get('emitter', {'type': 'policy'}),
+        policies=config['main'].get('emit_policies', {}))
+    sim = Engine(processes=processes, topology=topology, emitter=emitter)
+    sim.update(config['main']['simulation_time'])
+    data = sim.emitter.get_data()
+    output = pf(data) if config['main'].get('pf') and isinstance(data, dict) else data
+    return data, output, processes, topology
+
+
+def test_population_dfba():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../../data/e_coli_core.xml")
+    population = PopulationDFBA({
+        'model_file': model_path,
+        'wells': 4,
+        'kcat': [5, 5, 5, 10],
+        'init_concentration': [11.1, 11.1, 0.2, 11.1],
+    })
+    state = {'biomass': population.initial_biomass, 'concentration': population.initial_concentration}
+    for _ in range(30):
+        state = population.next_update(1, state)
+    biomass = state['biomass']
+    assert biomass[0] == biomass[1]
+    assert biomass[2] < biomass[0]
+    assert (state['concentration'] < population.initial_concentration).all()
+    assert (state['concentration'] >= 0).all()
+    # identical uptake bounds share one LP solve
+    assert population.solves < 30 * 4
+
+    # one well matches the scalar dFBA arithmetic
+    model = load_model(model_path)
+    exchange = model.reactions.get_by_id('EX_glc__D_e')
+    single = PopulationDFBA({'model_file': model_path, 'kcat': 10})
+    biomass, concentration = single.initial_biomass[0], 11.1
+    state = {'biomass': single.initial_biomass, 'concentration': single.initial_concentration}
+    for _ in range(5):
+        exchange.lower_bound = max(-10.0, -50 * concentration / (0.1 + concentration))
+        growth = model.slim_optimize()
+        uptake = exchange.flux
+        concentration -= biomass * -uptake * TIME_PROPORTION / 10
+        biomass += growth * TIME_PROPORTION * biomass
+        state = single.next_update(1, state)
+    assert abs(state['biomass'][0] - biomass) < 1e-9
+    assert abs(state['concentration'][0] - concentration) < 1e-9
+    # every timestep's batch starts from the basis of the one before
+    assert single.lp.solves == 5 and single.lp.cold_solves == 1
@@ -1,11 +1,15 @@
 from vivarium.core.process import Process
-from cobra.io import read_sbml_model
+import numpy as np
+from vivarium_microbiome.library.model_cache import load_compiled_model
+from vivarium_microbiome.library.bounds import BoundsArray
+from vivarium_microbiome.library.uptake import Substrates
+from vivarium_microbiome.library.timestep import SharedTimestep
 
-class ReactionBounds(Process):
+class ReactionBounds(SharedTimestep, Process):
     """
     This class initializes and updates the reaction bounds for the model.
 
-    ReactionBounds ingests a COBRA model, creating an initial dictionary of reaction bounds. For each update, it adjusts the reaction bounds considering a predefined aging percentage and resource limitation. The resource limitation is evaluated based on the available resources and their consumption at each timestep. This class now also computes the current_v0 value, which represents the flux calculated using the current glucose concentration by the Michaelis-Menten equation.
+    ReactionBounds ingests a compiled COBRA model (see model_cache), creating an initial BoundsArray of reaction bounds. For each update, it adjusts the reaction bounds considering a predefined aging percentage and resource limitation. The resource limitation is evaluated based on the available resources and their consumption at each timestep. The limiting substrates (glucose unless the substrates parameter lists others) each have their own kcat, km and enzyme, and their Michaelis-Menten uptake bounds are computed together from the concentrations store (see library.uptake). current_v0 is the uptake rate of the first substrate. Without the substrates parameter the glucose uptake is computed from the concentration store, as before, so topologies that only wire concentration keep working.
     """
 
     defaults = {
@@ -13,63 +17,70 @@ class ReactionBounds(Process):
         'enz_concentration': 5,
         'kcat': 5,
         'init_concentration': 11.1,
+        'substrates': None,  # {exchange_id: {'kcat', 'km', 'init_concentration', 'enzyme'}}; None limits glucose only
     }
 
     def __init__(self, parameters=None):
         super().__init__(parameters=parameters)
-        self.model = read_sbml_model(self.parameters['model_file'])
+        self.compiled_model = load_compiled_model(self.parameters['model_file'])
         self.bounds = self.initialize_bounds()
-        self.initial_upper_bound = None # an attribute to hold the initial upper bound
-        self.initial_lower_bound = None
+        self.substrates = Substrates.from_parameters(self.parameters)
+        # only the substrates the model has an exchange reaction for are limited
+        self.limited = np.array([
+            index for index, exchange_id in enumerate(self.substrates.exchange_ids)
+            if exchange_id in self.bounds], dtype=np.intp)
+        self.limited_ids = [self.substrates.exchange_ids[index] for index in self.limited]
+        positions = np.array([self.bounds.index[exchange_id] for exchange_id in self.limited_ids], dtype=np.intp)
+        self.initial_lower_bounds = self.bounds.lower[positions]
+        self.upper_bounds = self.bounds.upper[positions]
 
     def initialize_bounds(self):
-        bounds = {}
-        for reaction in self.model.reactions:
-            bounds[reaction.id] = (reaction.lower_bound, reaction.upper_bound)
-        return bounds
+        compiled = self.compiled_model
+        return BoundsArray(compiled.reaction_ids, compiled.lower_bounds, compiled.upper_bounds)
 
     def ports_schema(self):
         return {
             "reaction_bounds": {
                 '_default': self.bounds,
                 '_emit': True,
-                '_updater': 'set'
+                '_updater': 'bounds_array'
             },
             "current_v0": {
                 '_default': -10.0,
                 '_emit': True,
                 '_updater': 'set'
             },
+            # the glucose concentration without the substrates parameter, as before it
             "concentration": {
-                '_default': self.parameters['init_concentration'],
+                '_default': self.substrates.init_concentrations[0].item(),
+                '_emit': True,
+                '_updater': 'accumulate'
+            },
+            "concentrations": {
+                '_default': self.substrates.medium(),
                 '_emit': True,
-                "_updater": "accumulate",
+                '_updater': 'medium'
             },
             "enz_concentration": {
                 "_default": self.parameters['enz_concentration'],
                 "_updater": "set"
             },
+            "timestep": self.timestep_schema(),
         }
 
     def next_update(self, timestep, state):
-        concentration = state['concentration']
-        enz_concentration = state['enz_concentration']  # Use 'enz_concentration' instead of 'enz-conc'
-        vmax = self.parameters['kcat'] * enz_concentration
-        current_v0 = vmax * concentration / (self.parameters['km'] + concentration)
-        current_v0 = - current_v0  # it should be negative because it consumes glucose
-        updated_bounds = self.bounds
-        if timestep != 0:
-            current_bounds = state["reaction_bounds"]
-            for reaction_id, old_bounds in current_bounds.items():
-                if reaction_id == "EX_glc__D_e":  # it will be always none if the class was Step instead of Process. why?
-                    if self.initial_lower_bound is None:  # If the initial lower bound has not been stored yet
-                        self.initial_lower_bound = old_bounds[0]  # Store the initial lower bound
-                    new_lower_bound = max(self.initial_lower_bound, current_v0)  # Take the maximum of the initial lower bound and current_v0
-                    new_bounds = (new_lower_bound, old_bounds[1])  # keep the old upper bound
-                    updated_bounds[reaction_id] = new_bounds
+        if self.parameters['substrates']:
+            concentrations = self.substrates.concentrations(state['concentrations'])
+        else:
+            concentrations = np.array([state['concentration']])
+        current_v0 = self.substrates.uptake_rates(concentrations, state['enz_concentration'])
+        updated_bounds = {}  # only the changed entries; the bounds_array updater writes them in place
+        if timestep != 0 and len(self.limited):  # it will be always none if the class was Step instead of Process. why?
+            # the uptake bound never opens beyond the model's initial lower bound
+            lower_bounds = np.maximum(self.initial_lower_bounds, current_v0[self.limited])
+            updated_bounds = dict(zip(self.limited_ids, zip(lower_bounds.tolist(), self.upper_bounds.tolist())))
 
         return {
             "reaction_bounds": updated_bounds,
-            "current_v0": current_v0,
+            "current_v0": float(current_v0[0]),
         }
-
@@ -1,16 +1,30 @@
 from vivarium.core.process import Step
-import random
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.random_streams import RandomStream
 
 # Add the Time_proportion variable, We consider each time-step a minute
 TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
 
-class RegulatoryProtein(Step):
+class RegulatoryProtein(Checkpointed, Step):
     """
     This class generates a random number (regulation_probability) between 0.0001 and 1.
+
+    The numbers come from the process's own seeded RandomStream, see
+    library.random_streams; ``distribution`` and ``distribution_parameters``
+    replace the uniform distribution.
     """
     defaults = {
         'regulation_probability': 0.5,
+        'seed': None,  # None draws the seed from Python's global random
+        'distribution': 'uniform',
+        'distribution_parameters': None,
+        'chunk_size': 1024,
     }
+    checkpoint_attributes = ('stream',)
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters)
+        self.stream = RandomStream.from_parameters(self.parameters)
 
     def ports_schema(self):
         return {
@@ -22,7 +36,7 @@ class RegulatoryProtein(Step):
         }
 
     def next_update(self, timestep, state):
-        regulation_probability = random.uniform(0.0001, 1)
+        regulation_probability = self.stream.next()
         return {
             'regulation_probability': regulation_probability
         }
@@ -1,11 +1,19 @@
-from RegulatoryProtein import RegulatoryProtein
-from GeneExpression import GeneExpression
-from ProteinExpression import ProteinExpression
-from ReactionBounds import ReactionBounds
-from DynamicFBA import DynamicFBA
-from BiomassCalculator import BiomassCalculator
-from EnvCalculator import EnvCalculator
+import os
+
+from vivarium_microbiome.Processes.Ecoli.RegulatoryProtein import RegulatoryProtein
+from vivarium_microbiome.Processes.Ecoli.GeneExpression import GeneExpression
+from vivarium_microbiome.Processes.Ecoli.ProteinExpression import ProteinExpression
+from vivarium_microbiome.Processes.Ecoli.ReactionBounds import ReactionBounds
+from vivarium_microbiome.Processes.Ecoli.DynamicFBA import DynamicFBA
+from vivarium_microbiome.Processes.Ecoli.BiomassCalculator import BiomassCalculator
+from vivarium_microbiome.Processes.Ecoli.EnvCalculator import EnvCalculator
+from vivarium_microbiome.Processes.Ecoli.DirectDFBA import DirectDFBA
+from vivarium_microbiome.Processes.Ecoli.DFBAComposite import DFBAComposite
 from vivarium.core.engine import Engine, pf
+from vivarium_microbiome.library.timestep import adaptive_processes, adaptive_topology
+from vivarium_microbiome.library.checkpoint import run_checkpointed
+from vivarium_microbiome.library.fva import fva_processes, fva_topology
+from vivarium_microbiome.library.profiling import Profiler
 
 
 
@@ -19,19 +27,77 @@ def main(config):
     It initializes the ReactionBounds, DynamicFBA, BiomassCalculator, EnvCalculator,
     RegulatoryProtein, GeneExpression and ProteinExpression processes,
     establishes the topology between these processes, and executes the simulation for the specified timeframe.
+
+    With ``config['main']['adaptive']`` (True, or a dict of AdaptiveTimestep
+    parameters such as ``tolerance`` and ``max_timestep``) the dFBA loop runs
+    in adaptive-step mode: long steps while growth and consumption are slow,
+    short ones as the substrate runs out, see library.timestep.
+
+    With ``config['main']['direct']`` (True, or a dict of DirectDFBA
+    parameters) one DirectDFBA replaces DynamicFBA, BiomassCalculator and
+    EnvCalculator, and the LP is only solved again when its basis changes.
+
+    With ``config['main']['fused']`` one DFBAComposite replaces all seven
+    processes and gives the same results without passing values through
+    the stores; the modular wiring stays the default for exploration.
+
+    With ``config['main']['fva']`` (True, or a dict of FluxVariability
+    parameters such as ``every`` and ``workers``) the run also writes the
+    flux range of every reaction to the ``flux_ranges`` store every
+    ``every`` steps, see library.fva.
+
+    With ``config['main']['profile']`` (True, a dict of Profiler parameters
+    such as ``memory`` and ``trace``, or a Profiler) the run records the wall
+    time and calls of every process and of the LP solve, store updates and
+    emitter, and prints a summary table at the end, see library.profiling.
+
+    With ``config['main']['checkpoint']`` (``{'path': ..., 'every': ...}``)
+    the run writes a checkpoint every ``every`` time units and, when the
+    checkpoint file exists, resumes from it instead of starting over, see
+    library.checkpoint.
+
+    ``main`` returns ``(data, output, processes, topology)``. ``data`` is the
+    emitter's ``get_data()``: a dict of the emitted timeseries with the
+    default in-RAM emitter, or a lazy ColumnarData handle with
+    ``config['main']['emitter']`` set to ``{'type': 'columnar', ...}``, see
+    library.emitters. ``output`` is that same object, unless
+    ``config['main']['pf']`` is set, in which case a RAM run's ``output`` is
+    the ``pf()`` string of ``data``; that string costs as much memory as the
+    run's data, so it is only built when asked for.
     """
+    profiler = Profiler.from_config(config['main'].get('profile'))
+    if not profiler:
+        return simulate(config)
+    profiler.start()
+    try:
+        return simulate(config, profiler)
+    finally:
+        # also when the run fails, so later runs in this interpreter are not profiled
+        profiler.stop()
+
+
+def simulate(config, profiler=None):
+    """Build and run main's composite, with its processes and Engine instrumented by ``profiler``."""
     initial_conc = config['main'].get('init_concentration', 1.0)
-    config['EnvCalculator'].setdefault('init_concentration', initial_conc)
 
     initial_state = config['main']['initial_state']
     simulation_time = config['main']['simulation_time']
-    reaction_bounds = ReactionBounds(config['ReactionBounds'])
+    # limiting substrates set in main apply to both ReactionBounds and EnvCalculator;
+    # they go into copies, so a config reused for several runs is left as it was
+    reaction_bounds_config = dict(config['ReactionBounds'])
+    env_calculator_config = dict(config['EnvCalculator'])
+    env_calculator_config.setdefault('init_concentration', initial_conc)
+    substrates = config['main'].get('substrates')
+    if substrates:
+        reaction_bounds_config.setdefault('substrates', substrates)
+        env_calculator_config.setdefault('substrates', substrates)
+    reaction_bounds = ReactionBounds(reaction_bounds_config)
     dynamic_fba = DynamicFBA(config['DynamicFBA'])
-    initial_state = {"reaction_bounds": reaction_bounds.bounds}
+    initial_state = {"reaction_bounds": reaction_bounds.bounds.copy()}
     initial_objective_flux_update = dynamic_fba.next_update(1, initial_state)
     initial_objective_flux = initial_objective_flux_update["objective_flux"]
     biomass_calculator = BiomassCalculator({'initial_objective_flux': initial_objective_flux})
-    env_calculator = EnvCalculator(config['EnvCalculator'])
+    env_calculator = EnvCalculator(env_calculator_config)
     regulatory_protein = RegulatoryProtein(config['RegulatoryProtein'])
     gene_expression = GeneExpression(config['GeneExpression'])
     protein_expression = ProteinExpression(config['ProteinExpression'])
@@ -51,6 +117,7 @@ def main(config):
             'reaction_bounds': ('reaction_bounds',),
             'current_v0': ('current_v0',),
             'concentration': ('concentration',),
+            'concentrations': ('concentrations',),
             'enz_concentration': ( 'enz_concentration',)
         },
         'DynamicFBA': {
@@ -67,7 +134,8 @@ def main(config):
             'current_biomass': ('current_biomass_value',),
             'fluxes_values': ('fluxes_values',),
             'current_env_consumption': ('current_env_consumption_value',),
-            'concentration': ('concentration',)
+            'concentration': ('concentration',),
+            'concentrations': ('concentrations',)
         },
         'RegulatoryProtein': {
             'regulation_probability': ('regulation_probability',)
@@ -82,8 +150,162 @@ def main(config):
         }
     }
 
-    sim = Engine(processes=processes, topology=topology, initial_state=initial_state)
-    sim.update(simulation_time)
+    adaptive = config['main'].get('adaptive')
+    if adaptive:
+        adaptive = dict({} if adaptive is True else adaptive)
+        adaptive.setdefault('volume', env_calculator.parameters['volume'])
+        adaptive.setdefault('time_proportion', env_calculator.parameters['time_proportion'])
+        processes.update(adaptive_processes(adaptive, simulation_time))
+        topology.update(adaptive_topology())
+
+    direct = config['main'].get('direct')
+    if direct:
+        direct = dict({} if direct is True else direct)
+        for key in ('substrates', 'kcat', 'km', 'init_concentration'):
+            if key in reaction_bounds_config:
+                direct.setdefault(key, reaction_bounds_config[key])
+        direct.setdefault('volume', env_calculator.parameters['volume'])
+        direct_fba = DirectDFBA(dict(
+            direct, model_file=config['DynamicFBA']['model_file'], reaction_bounds=reaction_bounds,
+            initial_biomass=initial_objective_flux))
+        for name in ('DynamicFBA', 'BiomassCalculator', 'EnvCalculator'):
+            del processes[name]
+            del topology[name]
+        processes['DirectDFBA'] = direct_fba
+        topology['DirectDFBA'] = {
+            'reaction_bounds': ('reaction_bounds',),
+            'enz_concentration': ('enz_concentration',),
+            'concentrations': ('concentrations',),
+            'concentration': ('concentration',),
+            'current_env_consumption': ('current_env_consumption_value',),
+            'current_biomass': ('current_biomass_value',),
+            'objective_flux': ('objective_flux_value',),
+            'fluxes': ('fluxes_values',),
+            'reactions': ('reactions_list',),
+        }
+
+    if config['main'].get('fused'):
+        fused = dict(reaction_bounds_config)
+        fused.update(
+            model_file=config['DynamicFBA']['model_file'],
+            warm_start=config['DynamicFBA'].get('warm_start', False),
+            flux_outputs=config['DynamicFBA'].get('flux_outputs', 'all'),
+            solution_cache=config['DynamicFBA'].get('solution_cache'),
+            surrogate=config['DynamicFBA'].get('surrogate'),
+            executor=config['DynamicFBA'].get('executor'),
+            initial_objective_flux=initial_objective_flux,
+            volume=env_calculator.parameters['volume'],
+            time_proportion=env_calculator.parameters['time_proportion'],
+            limit_consumption=env_calculator.parameters['limit_consumption'],
+            regulation_probability=regulatory_protein.parameters['regulation_probability'],
+            seed=regulatory_protein.stream.seed,
+            distribution=regulatory_protein.stream.distribution,
+            distribution_parameters=regulatory_protein.stream.parameters,
+            chunk_size=regulatory_protein.stream.chunk_size,
+            gene_expression=gene_expression.parameters['gene_expression'],
+            enz_concentration=protein_expression.parameters['enz_concentration'])
+        loop = ('RegulatoryProtein', 'GeneExpression', 'ProteinExpression',
+                'ReactionBounds', 'DynamicFBA', 'BiomassCalculator', 'EnvCalculator')
+        for name in loop:
+            del processes[name]
+            del topology[name]
+        processes['DFBAComposite'] = DFBAComposite(fused)
+        topology['DFBAComposite'] = {
+            'regulation_probability': ('regulation_probability',),
+            'gene_expression': ('gene_expression',),
+            'enz_concentration': ('enz_concentration',),
+            'reaction_bounds': ('reaction_bounds',),
+            'current_v0': ('current_v0',),
+            'fluxes': ('fluxes_values',),
+            'reactions': ('reactions_list',),
+            'objective_flux': ('objective_flux_value',),
+            'current_biomass': ('current_biomass_value',),
+            'current_env_consumption': ('current_env_consumption_value',),
+            'concentration': ('concentration',),
+            'concentrations': ('concentrations',),
+        }
+
+    fva = config['main'].get('fva')
+    if fva:
+        fva = dict({} if fva is True else fva)
+        fva.setdefault('model_file', config['DynamicFBA']['model_file'])
+        processes.update(fva_processes(fva))
+        topology.update(fva_topology())
+
+    # per-store emit policies, see library.emitters.EmitPolicy; the reaction list never changes
+    emit_policies = config['main'].get('emit_policies', {'reactions_list': 'once'})
+    # {'type': 'columnar', 'path': ...} streams the run to Parquet instead of keeping it in RAM
+    emitter = dict(config['main'].get('emitter', {'type': 'policy'}), policies=emit_policies)
+    if profiler:
+        profiler.instrument_processes(processes)
+    sim = Engine(
+        processes=processes, topology=topology, initial_state=initial_state,
+        emitter=emitter)
+    if profiler:
+        profiler.instrument_engine(sim)
+    checkpoint = config['main'].get('checkpoint')
+    if checkpoint:
+        run_checkpointed(sim, processes, simulation_time, **checkpoint)
+    else:
+        sim.update(simulation_time)
     data = sim.emitter.get_data()
-    output = pf(data)
-    return data, output, processes, topology
\ No newline at end of file
+    output = pf(data) if config['main'].get('pf') and isinstance(data, dict) else data
+    return data, output, processes, topology
+
+
+def example_config(simulation_time, seed=1):
+    """The dFBA notebook's E. coli config, with a seeded RegulatoryProtein."""
+    model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/e_coli_core.xml')
+    return {
+        'main': {'simulation_time': simulation_time, 'init_concentration': 11.1, 'initial_state': {}},
+        'RegulatoryProtein': {'regulation_probability': 0.5, 'seed': seed},
+        'GeneExpression': {'gene_expression': 0.55},
+        'ProteinExpression': {'enz_concentration': 5.0},
+        'ReactionBounds': {
+            'model_file': model_path, 'enz_concentration': 5, 'kcat': 5, 'km': 0.1, 'init_concentration': 11.1},
+        'DynamicFBA': {'model_file': model_path},
+        'BiomassCalculator': {'initial_objective_flux': None},
+        'EnvCalculator': {'init_concentration': 11.1, 'volume': 10},
+    }
+
+
+def test_dfba_depletion():
+    # by default glucose runs out at t=188 and goes negative, as it always has, in both stores alike
+    data = main(example_config(200))[0]
+    glucose = [state['concentration'] for state in data.values()]
+    assert glucose == [state['concentrations']['EX_glc__D_e'] for state in data.values()]
+    assert glucose[-1] < 0.0
+
+    config = example_config(200)
+    config['EnvCalculator']['limit_consumption'] = True
+    data = main(config)[0]
+    glucose = [state['concentration'] for state in data.values()]
+    # with limit_consumption both stores stop at zero together
+    assert glucose == [state['concentrations']['EX_glc__D_e'] for state in data.values()]
+    assert min(glucose) == 0.0 and glucose[-1] == 0.0
+    # and no more is consumed than there was
+    assert abs(data[200]['current_env_consumption_value'] - 11.1 * 10) < 1e-9
+
+
+def test_fused_matches_modular():
+    modular = main(example_config(250))[0]
+    config = example_config(250)
+    config['main']['fused'] = True
+    fused = main(config)[0]
+    assert list(fused) == list(modular)
+    for key in ('current_biomass_value', 'concentration', 'concentrations', 'fluxes_values', 'objective_flux_value'):
+        assert [state[key] for state in fused.values()] == [state[key] for state in modular.values()], key
+
+
+def test_profiler_stopped_on_failure():
+    from vivarium_microbiome.library import profiling
+    config = example_config(1)
+    config['main']['profile'] = {'print_summary': False}
+    config['ReactionBounds']['model_file'] = 'missing.xml'
+    try:
+        main(config)
+    except Exception:
+        pass
+    else:
+        raise AssertionError('a missing model file fails the run')
+    assert profiling._active is None
@@ -0,0 +1,254 @@
+"""
+==========
+Benchmarks
+==========
+Timings of the FBA and dFBA processes, written to JSON so that runs from
+different commits can be compared.
+
+The suite covers, for the E. coli core and the Alteromonas models:
+
+* ``load_sbml``: parsing the SBML file with cobra
+* ``fba_next_update``: one ``FBA.next_update``
+* ``dynamic_fba_next_update``: one ``DynamicFBA.next_update``, with the
+  bounds unchanged and with the uptake bound changed on every call
+* ``main``: a full dFBA ``main(config)`` run of 100, 1,000 and 10,000 steps
+* ``emitter_memory``: the memory the emitter of a ``main`` run holds,
+  measured with tracemalloc around its ``emit`` and ``get_data`` calls
+  (see library.profiling), so model loading, the LP and the Engine are
+  not counted
+
+Timings record the best and the mean time of a call over ``repeat`` rounds;
+the single-update benchmarks make ``number`` calls per round, after a
+warm-up call. The JSON file also records the git commit and the Python
+version, and ``--compare`` reports every benchmark that got slower, or
+used more memory, by more than ``--threshold``.
+
+Command line::
+
+    vivarium-microbiome-benchmark --out benchmarks.json
+    vivarium-microbiome-benchmark --steps 100 --out new.json --compare benchmarks.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import cobra
+
+from vivarium_microbiome.experiments.sweep import DATA_DIR, PACKAGE_DIR, default_config, resolve_main
+from vivarium_microbiome.library.bounds import BoundsArray
+from vivarium_microbiome.library.model_cache import CACHE_ENV
+from vivarium_microbiome.library.profiling import Profiler
+
+
+#: model name: (model file, dFBA main, limiting glucose exchange)
+MODELS = {
+    'ecoli': (
+        os.path.join(DATA_DIR, 'e_coli_core.xml'),
+        'vivarium_microbiome.Processes.Ecoli.dFBA_modular:main',
+        'EX_glc__D_e'),
+    'alteromonas': (
+        os.path.join(DATA_DIR, 'Alteromonas_Model.xml'),
+        'vivarium_microbiome.Processes.Altrmns.dFBA:main',
+        'EX_cpd00027_e0'),
+}
+STEPS = (100, 1000, 10000)
+MEMORY_STEPS = 1000
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timing(function, repeat=5, number=1, warmup=True):
+    """
+    Best and mean wall time of a call of ``function``, over ``repeat``
+    rounds of ``number`` calls each.
+    """
+    if warmup:
+        function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'mean': sum(times) / len(times), 'repeat': repeat, 'number': number}
+
+
+def main_config(model, steps):
+    """The dFBA config of ``model`` for a ``steps``-step run."""
+    model_file, main, exchange_id = MODELS[model]
+    config = default_config(model_file)
+    config['main']['simulation_time'] = steps
+    if model != 'ecoli':
+        # the Alteromonas composite has no expression processes
+        for name in ('RegulatoryProtein', 'GeneExpression', 'ProteinExpression'):
+            del config[name]
+        config['main']['substrates'] = {exchange_id: {
+            'kcat': config['ReactionBounds']['kcat'],
+            'km': config['ReactionBounds']['km'],
+            'init_concentration': config['ReactionBounds']['init_concentration']}}
+    return config
+
+
+def run_main(model, steps, **options):
+    """Run the dFBA ``main`` of ``model`` for ``steps`` steps, with ``options`` added to ``config['main']``."""
+    main = resolve_main(MODELS[model][1])
+    config = main_config(model, steps)
+    config['main'].update(options)
+    with contextlib.redirect_stdout(io.StringIO()):  # the Engine's banner and summary
+        return main(config)
+
+
+def emitter_memory(model, steps):
+    """
+    Net bytes allocated by the emitter's ``emit`` calls (the emitted data it
+    keeps) and by its ``get_data`` call in a ``steps``-step ``main`` run.
+    """
+    profiler = Profiler(memory=True, print_summary=False)
+    run_main(model, steps, profile=profiler)
+    emitted = profiler.stats[('engine', 'emit')][2]
+    get_data = max(profiler.stats[('engine', 'get_data')][2], 0)  # the RAM emitters return what they hold
+    return {'bytes': emitted + get_data, 'emit_bytes': emitted, 'get_data_bytes': get_data}
+
+
+def benchmark_model(model, steps=STEPS, memory_steps=MEMORY_STEPS, repeat=5, number=100):
+    """
+    Run every benchmark of ``model`` and return ``{name: result}``. The
+    single-update benchmarks time ``number`` calls per round.
+    """
+    model_file, _, exchange_id = MODELS[model]
+    FBA = resolve_main('vivarium_microbiome.Processes.Ecoli.Fba:FBA')
+    DynamicFBA = resolve_main('vivarium_microbiome.Processes.Ecoli.DynamicFBA:DynamicFBA')
+    results = {}
+
+    results['load_sbml[{}]'.format(model)] = timing(
+        lambda: cobra.io.read_sbml_model(model_file), repeat=max(1, repeat // 2), warmup=False)
+
+    fba = FBA({'model_file': model_file})
+    results['fba_next_update[{}]'.format(model)] = timing(lambda: fba.next_update(1, {}), repeat, number)
+
+    dynamic_fba = DynamicFBA({'model_file': model_file})
+    bounds = BoundsArray.from_model(dynamic_fba.model)
+    results['dynamic_fba_next_update[{},unchanged]'.format(model)] = timing(
+        lambda: dynamic_fba.next_update(1, {'reaction_bounds': bounds}), repeat, number)
+
+    # alternate the uptake bound so every call reaches the solver
+    lower, upper = bounds[exchange_id]
+    changed = [bounds.copy(), bounds.copy()]
+    changed[1].update({exchange_id: (lower / 2, upper)})
+    calls = []
+
+    def changed_update():
+        calls.append(None)
+        dynamic_fba.next_update(1, {'reaction_bounds': changed[len(calls) % 2]})
+    results['dynamic_fba_next_update[{},changed]'.format(model)] = timing(changed_update, repeat, number)
+
+    for step_count in steps:
+        results['main[{},{}]'.format(model, step_count)] = timing(
+            lambda: run_main(model, step_count), repeat=1, warmup=False)
+
+    if memory_steps:
+        results['emitter_memory[{},{}]'.format(model, memory_steps)] = emitter_memory(model, memory_steps)
+    return results
+
+
+def run_benchmarks(models=tuple(MODELS), steps=STEPS, memory_steps=MEMORY_STEPS, repeat=5, number=100):
+    """Run the suite and return it with the commit and environment it ran on."""
+    benchmarks = {}
+    for model in models:
+        benchmarks.update(benchmark_model(model, steps, memory_steps, repeat, number))
+    return {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cobra': cobra.__version__,
+        'benchmarks': benchmarks,
+    }
+
+
+def compare(previous, current, threshold=0.1):
+    """
+    Benchmarks of ``current`` whose best time or memory grew by more
+    than ``threshold`` (a fraction) over ``previous``, as
+    ``{name: (previous, current)}``.
+    """
+    regressions = {}
+    for name, result in current['benchmarks'].items():
+        before = previous['benchmarks'].get(name)
+        if before is None:
+            continue
+        key = 'bytes' if 'bytes' in result else 'min'
+        if key not in before:
+            continue  # measured differently by an older version of the suite
+        if result[key] > before[key] * (1 + threshold):
+            regressions[name] = (before[key], result[key])
+    return regressions
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description='Time the FBA and dFBA processes.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--steps', nargs='+', type=int, default=list(STEPS), help='main() run lengths')
+    parser.add_argument('--memory-steps', type=int, default=MEMORY_STEPS, help='run length of the memory benchmark, 0 to skip')
+    parser.add_argument('--repeat', type=int, default=5, help='timing rounds per benchmark')
+    parser.add_argument('--number', type=int, default=100, help='calls per round of the single-update benchmarks')
+    parser.add_argument('--out', default='benchmarks.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.models, args.steps, args.memory_steps, args.repeat, args.number)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    for name, result in results['benchmarks'].items():
+        if 'bytes' in result:
+            print('{:55s} {:12.3f} MiB'.format(name, result['bytes'] / 2 ** 20))
+        else:
+            print('{:55s} {:12.6f} s'.format(name, result['min']))
+    print('written to {}'.format(args.out))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(previous, results, args.threshold)
+        for name, (before, after) in regressions.items():
+            print('regression {}: {:.6g} -> {:.6g}'.format(name, before, after))
+        if regressions:
+            sys.exit(1)
+
+
+def test_benchmarks(tmp_path, monkeypatch):
+    monkeypatch.setenv(CACHE_ENV, str(tmp_path))  # the model cache of the runs
+    results = run_benchmarks(models=['ecoli'], steps=[3], memory_steps=3, repeat=1, number=2)
+    benchmarks = results['benchmarks']
+    assert set(benchmarks) == {
+        'load_sbml[ecoli]', 'fba_next_update[ecoli]', 'dynamic_fba_next_update[ecoli,unchanged]',
+        'dynamic_fba_next_update[ecoli,changed]', 'main[ecoli,3]', 'emitter_memory[ecoli,3]'}
+    assert all(result['min'] > 0 for name, result in benchmarks.items() if 'min' in result)
+    # the emitted data of a few steps, far less than the models and the LP
+    assert 0 < benchmarks['emitter_memory[ecoli,3]']['bytes'] < 2 ** 20
+    assert emitter_memory('ecoli', 30)['bytes'] > benchmarks['emitter_memory[ecoli,3]']['bytes']
+    json.dumps(results)
+
+    slower = json.loads(json.dumps(results))
+    slower['benchmarks']['main[ecoli,3]']['min'] *= 2
+    assert list(compare(results, slower)) == ['main[ecoli,3]']
+    assert compare(slower, results) == {}
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+"""
+===========
+Flux Tables
+===========
+Builds the flux tables of library.surrogate ahead of a run, so that the
+first DynamicFBA with ``surrogate`` set loads its table from the model
+cache instead of building it, and reports how the tables compare with the
+LP they replace.
+
+For every model (the E. coli core and the Alteromonas models by default,
+over the uptake of their limiting glucose exchange) it prints the number
+of breakpoints, the bound above which the LP is infeasible, the largest
+objective error and residual of the interpolated solution, and the time of
+one table evaluation and of one LP solve.
+
+Command line::
+
+    vivarium-microbiome-flux-table
+    vivarium-microbiome-flux-table --models ecoli --tolerance 1e-8 --rebuild
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from vivarium_microbiome.experiments.benchmarks import MODELS, timing
+from vivarium_microbiome.library.model_cache import cache_path
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.surrogate import flux_table_name, load_flux_table
+
+
+def table_report(model_file, exchange_id, cache_dir=None, rebuild=False, **parameters):
+    """Build (or load) the flux table of ``model_file`` and time it against the LP."""
+    path = cache_path(model_file, flux_table_name(exchange_id, **parameters), cache_dir)
+    if rebuild and os.path.exists(path):
+        os.remove(path)
+    start = time.perf_counter()
+    table = load_flux_table(model_file, exchange_id, cache_dir=cache_dir, **parameters)
+    build_time = time.perf_counter() - start
+
+    model = load_model(model_file)
+    exchange = model.reactions.get_by_id(exchange_id)
+    bounds = np.linspace(table.breakpoints[0], table.feasible_until, 100).tolist()
+
+    def evaluate_all():
+        for bound in bounds:
+            table.evaluate(bound)
+
+    def solve_all():
+        for bound in bounds:
+            exchange.lower_bound = bound
+            model.slim_optimize()
+
+    return {
+        'path': path,
+        'breakpoints': len(table),
+        'range': (float(table.breakpoints[0]), float(table.breakpoints[-1])),
+        'feasible_until': table.feasible_until,
+        'max_error': table.max_error,
+        'build_time': build_time,
+        'evaluate_time': timing(evaluate_all, repeat=3)['min'] / len(bounds),
+        'solve_time': timing(solve_all, repeat=3)['min'] / len(bounds),
+    }
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description='Build the flux tables of the dFBA surrogate.')
+    parser.add_argument('--models', nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--cache-dir', help='directory of the model cache')
+    parser.add_argument('--tolerance', type=float, default=1e-6, help='largest objective error and residual')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild tables that are already cached')
+    args = parser.parse_args(argv)
+
+    for model in args.models:
+        model_file, _, exchange_id = MODELS[model]
+        report = table_report(
+            model_file, exchange_id, cache_dir=args.cache_dir, rebuild=args.rebuild, tolerance=args.tolerance)
+        print('{} ({}): {} breakpoints over [{:g}, {:g}], feasible up to {:g}'.format(
+            model, exchange_id, report['breakpoints'], report['range'][0], report['range'][1],
+            report['feasible_until']))
+        print('  max error: objective {objective:.2e}, residual {residual:.2e}, '
+              'fluxes {fluxes:.2e} (alternative optima included)'.format(**report['max_error']))
+        print('  built in {:.2f} s; {:.1f} us per evaluation, {:.1f} us per LP solve'.format(
+            report['build_time'], report['evaluate_time'] * 1e6, report['solve_time'] * 1e6))
+        print('  written to {}'.format(report['path']))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,260 @@
+"""
+===============
+Parameter Sweep
+===============
+Runs a dFBA ``main(config)`` over a grid of parameters on a process pool
+and collects every run into one table.
+
+Each worker loads the models named in the base config once (through the
+model registry) and then runs its share of the grid. A failing run is
+recorded with its error instead of stopping the sweep. With a ``seed``,
+every run's RegulatoryProtein gets its own stream seeded with
+``[seed, run]``, so a sweep gives the same table on any number of workers.
+
+Command line::
+
+    vivarium-microbiome-sweep --config base.json --grid grid.json --out sweep.csv
+
+where ``grid.json`` maps parameters to lists of values, for example
+``{"kcat": [1, 5, 10], "km": [0.05, 0.1]}``.
+"""
+
+import argparse
+import copy
+import importlib
+import itertools
+import json
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from vivarium_microbiome.library.model_registry import load_model
+
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MAIN = 'vivarium_microbiome.Processes.Ecoli.dFBA_modular:main'
+DATA_DIR = os.path.join(PACKAGE_DIR, 'data')
+
+#: short parameter names and the config paths they set
+PARAMETER_PATHS = {
+    'kcat': [('ReactionBounds', 'kcat')],
+    'km': [('ReactionBounds', 'km')],
+    'init_concentration': [
+        ('main', 'init_concentration'),
+        ('ReactionBounds', 'init_concentration'),
+        ('EnvCalculator', 'init_concentration')],
+    'volume': [('EnvCalculator', 'volume')],
+    'simulation_time': [('main', 'simulation_time')],
+}
+
+#: prefix of the parameter columns of the sweep table
+PARAMETER_PREFIX = 'parameter.'
+
+#: emit policies used unless the base config sets its own; the sweep table only keeps scalars
+SWEEP_EMIT_POLICIES = {
+    'reactions_list': 'once',
+    'fluxes_values': 'once',
+    'reaction_bounds': 'once',
+}
+
+
+def default_config(model_path=None):
+    """The E. coli dFBA config used by the dFBA notebook."""
+    model_path = model_path or os.path.join(DATA_DIR, 'e_coli_core.xml')
+    return {
+        'main': {
+            'model_path': model_path,
+            'simulation_time': 60,
+            'init_concentration': 11.1,
+            'initial_state': {},
+        },
+        'RegulatoryProtein': {'regulation_probability': 0.5},
+        'GeneExpression': {'gene_expression': 0.55},
+        'ProteinExpression': {'enz_concentration': 5.0},
+        'ReactionBounds': {
+            'model_file': model_path,
+            'enz_concentration': 5,
+            'kcat': 5,
+            'km': 0.1,
+            'init_concentration': 11.1},
+        'DynamicFBA': {'model_file': model_path},
+        'BiomassCalculator': {'initial_objective_flux': None},
+        'EnvCalculator': {'init_concentration': 11.1, 'volume': 10},
+    }
+
+
+def parameter_grid(grid):
+    """Expand ``{parameter: [values]}`` into a list of ``{parameter: value}`` points."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def apply_parameters(config, parameters):
+    """Return a copy of ``config`` with ``parameters`` set.
+
+    Parameters are short names from PARAMETER_PATHS or dotted config paths
+    such as ``'ReactionBounds.kcat'``.
+    """
+    config = copy.deepcopy(config)
+    for name, value in parameters.items():
+        paths = PARAMETER_PATHS.get(name) or [tuple(name.split('.'))]
+        for path in paths:
+            target = config
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+    return config
+
+
+def model_files(config):
+    files = set()
+    for section in config.values():
+        if isinstance(section, dict):
+            for key in ('model_file', 'model_path'):
+                if isinstance(section.get(key), str):
+                    files.add(section[key])
+    return sorted(files)
+
+
+def resolve_main(reference):
+    """
+    Import ``'package.module:function'``, or ``'path/to/module.py:function'``
+    of a module in this package, by its package name, so every module is
+    imported once and its classes pickle to the pool workers.
+    """
+    module_name, _, function_name = reference.rpartition(':')
+    if module_name.endswith('.py'):
+        path = os.path.relpath(os.path.abspath(module_name[:-3]), os.path.dirname(PACKAGE_DIR))
+        if path.startswith(os.pardir):
+            raise ValueError("{} is outside the vivarium_microbiome package, pass 'package.module:{}'".format(
+                module_name, function_name))
+        module_name = path.replace(os.sep, '.')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def scalar_timeseries(data):
+    """Rows of the top-level numeric stores of emitted ``data``, one per time."""
+    rows = []
+    for time, state in data.items():
+        row = {'time': time}
+        for key, value in state.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row[key] = value
+        rows.append(row)
+    return rows
+
+
+_worker_main = {}
+
+
+def _init_worker(main_reference, files):
+    _worker_main['main'] = resolve_main(main_reference)
+    for model_file in files:
+        load_model(model_file, copy=False)
+
+
+def parameter_columns(parameters):
+    """The table columns of a run's ``parameters``, prefixed so they never clash with an emitted store."""
+    return {PARAMETER_PREFIX + name: value for name, value in parameters.items()}
+
+
+def _run(run, parameters, config):
+    columns = dict(parameter_columns(parameters), run=run)
+    try:
+        data = _worker_main['main'](config)[0]
+        return [dict(row, **columns) for row in scalar_timeseries(data)]
+    except Exception:
+        return [dict(columns, error=traceback.format_exc())]
+
+
+def seed_runs(configs, seed):
+    """Give the RegulatoryProtein of every run config the independent seed ``[seed, run]``, unless it has one."""
+    for run, run_config in enumerate(configs):
+        if 'RegulatoryProtein' in run_config and run_config['RegulatoryProtein'].get('seed') is None:
+            run_config['RegulatoryProtein']['seed'] = [seed, run]
+
+
+def run_sweep(grid, config=None, main=DEFAULT_MAIN, workers=None, seed=None):
+    """
+    Run ``main`` for every point of ``grid`` on ``workers`` processes.
+
+    Returns a DataFrame with one row per run and emitted time, holding the
+    run's parameters (as ``parameter.<name>`` columns) and its scalar
+    outputs. Failed runs get a single row with the traceback in the
+    ``error`` column.
+    """
+    config = copy.deepcopy(config or default_config())
+    config['main'].setdefault('emit_policies', SWEEP_EMIT_POLICIES)
+    points = parameter_grid(grid) if isinstance(grid, dict) else list(grid)
+    configs = [apply_parameters(config, parameters) for parameters in points]
+    if seed is not None:
+        seed_runs(configs, seed)
+    files = sorted({model_file for run_config in configs for model_file in model_files(run_config)})
+
+    rows = []
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(main, files)) as executor:
+        futures = [
+            executor.submit(_run, run, parameters, run_config)
+            for run, (parameters, run_config) in enumerate(zip(points, configs))]
+        for future in futures:
+            rows.extend(future.result())
+    table = pd.DataFrame(rows)
+    if 'error' not in table:
+        table['error'] = None
+    return table
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description='Run a dFBA parameter sweep on a process pool.')
+    parser.add_argument('--grid', required=True, help='JSON file or string mapping parameters to value lists')
+    parser.add_argument('--config', help='JSON file with the base config (default: E. coli dFBA)')
+    parser.add_argument('--main', default=DEFAULT_MAIN, help="'package.module:main' to run")
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--out', default='sweep.csv', help='output table (.csv or .parquet)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random streams of the runs')
+    args = parser.parse_args(argv)
+
+    def load_json(value):
+        if os.path.exists(value):
+            with open(value) as f:
+                return json.load(f)
+        return json.loads(value)
+
+    config = load_json(args.config) if args.config else None
+    table = run_sweep(load_json(args.grid), config=config, main=args.main, workers=args.workers, seed=args.seed)
+    if args.out.endswith('.parquet'):
+        table.to_parquet(args.out)
+    else:
+        table.to_csv(args.out, index=False)
+    failed = table.loc[table['error'].notna(), 'run'].nunique()
+    print('{} runs, {} failed, written to {}'.format(table['run'].nunique(), failed, args.out))
+
+
+def test_run_sweep():
+    table = run_sweep(
+        [{'kcat': 5, 'simulation_time': 3}, {'kcat': 10, 'simulation_time': 2}, {'km': 'not a number'}],
+        workers=2, seed=0)
+    assert sorted(table['run'].unique()) == [0, 1, 2]
+    assert len(table[table['run'] == 0]) == 4 and len(table[table['run'] == 1]) == 3
+    assert table.loc[table['run'] == 2, 'error'].iloc[0] is not None
+    assert table.loc[table['run'] < 2, 'error'].isna().all()
+    finished = table[(table['run'] < 2) & (table['time'] > 0)]
+    assert (finished['current_biomass_value'] > 0).all()
+    assert list(table.loc[table['time'] == 0, 'parameter.kcat'])[:2] == [5, 10]
+    # a swept store name does not clash with the emitted store
+    assert parameter_columns({'concentration': 1.0}) == {'parameter.concentration': 1.0}
+    # a file path resolves to the same module as its package name
+    path = os.path.join(PACKAGE_DIR, 'Processes', 'Ecoli', 'dFBA_modular.py')
+    assert resolve_main(path + ':main') is resolve_main(DEFAULT_MAIN)
+
+    # seeded runs do not depend on the worker they ran on
+    again = run_sweep([{'kcat': 5, 'simulation_time': 3}, {'kcat': 10, 'simulation_time': 2}], workers=1, seed=0)
+    columns = ['run', 'time', 'regulation_probability', 'current_biomass_value']
+    pd.testing.assert_frame_equal(table.loc[table['run'] < 2, columns].reset_index(drop=True), again[columns])
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,21 @@
+from vivarium.core.registry import emitter_registry, serializer_registry, updater_registry
+
+from vivarium_microbiome.library.bounds import (
+    BoundsArraySerializer, update_bounds_array)
+from vivarium_microbiome.library.emitters import ColumnarEmitter, PolicyEmitter
+from vivarium_microbiome.library.medium import MediumSerializer, update_medium
+
+
+# register updaters
+updater_registry.register('bounds_array', update_bounds_array)
+updater_registry.register('medium', update_medium)
+
+# register serializers
+bounds_array_serializer = BoundsArraySerializer()
+serializer_registry.register(bounds_array_serializer.name, bounds_array_serializer)
+medium_serializer = MediumSerializer()
+serializer_registry.register(medium_serializer.name, medium_serializer)
+
+# register emitters
+emitter_registry.register('policy', PolicyEmitter)
+emitter_registry.register('columnar', ColumnarEmitter)
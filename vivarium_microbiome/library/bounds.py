@@ -0,0 +1,199 @@
+"""
+=============
+Solver Bounds
+=============
+Array-backed reaction bounds for the simulation state, and helpers for
+pushing them into a COBRA model's solver.
+"""
+
+import os
+
+import numpy as np
+from vivarium.core.registry import Serializer
+
+from vivarium_microbiome.library.model_registry import load_model
+
+
+class BoundsArray:
+    """
+    Reaction bounds stored as two contiguous float arrays.
+
+    ``reaction_ids`` fixes the order of ``lower`` and ``upper`` and never
+    changes, and ``index`` maps a reaction ID to its position. Looking up a
+    reaction ID returns its ``(lower, upper)`` pair, like the
+    ``{reaction_id: (lower, upper)}`` dict this class replaces.
+    """
+
+    def __init__(self, reaction_ids, lower, upper, index=None):
+        self.reaction_ids = tuple(reaction_ids)
+        self.index = index if index is not None else {
+            reaction_id: position for position, reaction_id in enumerate(self.reaction_ids)}
+        self.lower = np.array(lower, dtype=float)
+        self.upper = np.array(upper, dtype=float)
+
+    @classmethod
+    def from_dict(cls, bounds):
+        pairs = np.array(list(bounds.values()), dtype=float).reshape(-1, 2)
+        return cls(bounds.keys(), pairs[:, 0], pairs[:, 1])
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(
+            [reaction.id for reaction in model.reactions],
+            [reaction.lower_bound for reaction in model.reactions],
+            [reaction.upper_bound for reaction in model.reactions])
+
+    def to_dict(self):
+        return {
+            reaction_id: (float(lower), float(upper))
+            for reaction_id, lower, upper in zip(self.reaction_ids, self.lower, self.upper)}
+
+    def copy(self):
+        return BoundsArray(self.reaction_ids, self.lower, self.upper, index=self.index)
+
+    def same_reactions(self, other):
+        return other.reaction_ids is self.reaction_ids or other.reaction_ids == self.reaction_ids
+
+    def update(self, bounds):
+        """
+        Write ``bounds`` into the arrays in place. ``bounds`` is either a
+        BoundsArray over the same reactions or a (partial)
+        ``{reaction_id: (lower, upper)}`` dict.
+        """
+        if isinstance(bounds, BoundsArray):
+            if not self.same_reactions(bounds):
+                raise ValueError('cannot update bounds over a different set of reactions')
+            np.copyto(self.lower, bounds.lower)
+            np.copyto(self.upper, bounds.upper)
+        elif bounds:
+            positions = np.fromiter(
+                (self.index[reaction_id] for reaction_id in bounds), dtype=np.intp, count=len(bounds))
+            pairs = np.array(list(bounds.values()), dtype=float).reshape(-1, 2)
+            self.lower[positions] = pairs[:, 0]
+            self.upper[positions] = pairs[:, 1]
+
+    def __len__(self):
+        return len(self.reaction_ids)
+
+    def __contains__(self, reaction_id):
+        return reaction_id in self.index
+
+    def __iter__(self):
+        return iter(self.reaction_ids)
+
+    def __getitem__(self, reaction_id):
+        position = self.index[reaction_id]
+        return float(self.lower[position]), float(self.upper[position])
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if not isinstance(other, BoundsArray):
+            return NotImplemented
+        return (self.same_reactions(other)
+                and np.array_equal(self.lower, other.lower)
+                and np.array_equal(self.upper, other.upper))
+
+    def __repr__(self):
+        return 'BoundsArray({} reactions)'.format(len(self))
+
+
+def update_bounds_array(current_value, new_value):
+    """Updater for BoundsArray stores: vectorized, in-place write of ``new_value``."""
+    if not isinstance(current_value, BoundsArray):
+        if isinstance(new_value, BoundsArray):
+            return new_value.copy()
+        return BoundsArray.from_dict(dict(current_value, **new_value))
+    current_value.update(new_value)
+    return current_value
+
+
+class BoundsArraySerializer(Serializer):
+    """Emits a BoundsArray as its two bound arrays; the reaction order is fixed."""
+    python_type = BoundsArray
+
+    def serialize(self, data):
+        return {'lower': data.lower, 'upper': data.upper}
+
+
+class SolverBounds:
+    """
+    Tracks the bounds last pushed to a model's solver.
+
+    ``apply`` compares the requested bounds with the ones already in the
+    solver and only touches the reactions that changed, setting lower and
+    upper bound together so each changed reaction costs one solver update.
+    Given a BoundsArray the comparison is a single vectorized pass. Bounds
+    set on the model behind its back are not seen by the tracker.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.applied = BoundsArray.from_model(model)
+        self.reactions = {reaction.id: reaction for reaction in model.reactions}
+        self._positions = (None, None)
+
+    def _positions_of(self, bounds):
+        """Model positions of the reactions of ``bounds``, or None when the order matches."""
+        reaction_ids, positions = self._positions
+        if bounds.reaction_ids is not reaction_ids:
+            positions = None
+            if not self.applied.same_reactions(bounds):
+                positions = np.array(
+                    [self.applied.index[reaction_id] for reaction_id in bounds.reaction_ids],
+                    dtype=np.intp)
+            self._positions = (bounds.reaction_ids, positions)
+        return positions
+
+    def changed(self, reaction_bounds):
+        """Return the entries of ``reaction_bounds`` that differ from the solver's bounds."""
+        if isinstance(reaction_bounds, BoundsArray):
+            positions = self._positions_of(reaction_bounds)
+            applied_lower, applied_upper = self.applied.lower, self.applied.upper
+            if positions is not None:
+                applied_lower, applied_upper = applied_lower[positions], applied_upper[positions]
+            differs = np.flatnonzero(
+                (reaction_bounds.lower != applied_lower) | (reaction_bounds.upper != applied_upper))
+            return {
+                reaction_bounds.reaction_ids[position]: (
+                    float(reaction_bounds.lower[position]), float(reaction_bounds.upper[position]))
+                for position in differs}
+
+        applied = self.applied
+        changed = {}
+        for reaction_id, (lower_bound, upper_bound) in reaction_bounds.items():
+            if applied[reaction_id] != (lower_bound, upper_bound):
+                changed[reaction_id] = (lower_bound, upper_bound)
+        return changed
+
+    def apply(self, reaction_bounds):
+        """Push the changed entries of ``reaction_bounds`` to the solver and return them."""
+        changed = self.changed(reaction_bounds)
+        for reaction_id, bounds in changed.items():
+            self.reactions[reaction_id].bounds = bounds
+        self.applied.update(changed)
+        return changed
+
+
+def test_solver_bounds():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    solver_bounds = SolverBounds(model)
+    bounds = {reaction.id: reaction.bounds for reaction in model.reactions}
+    assert solver_bounds.apply(bounds) == {}
+
+    bounds["EX_glc__D_e"] = (-5.0, 1000.0)
+    assert solver_bounds.apply(bounds) == {"EX_glc__D_e": (-5.0, 1000.0)}
+    assert model.reactions.get_by_id("EX_glc__D_e").bounds == (-5.0, 1000.0)
+    assert solver_bounds.apply(bounds) == {}
+
+    bounds_array = BoundsArray.from_dict(bounds)
+    assert solver_bounds.apply(bounds_array) == {}
+    update_bounds_array(bounds_array, {"EX_glc__D_e": (-2.5, 1000.0), "EX_o2_e": (-1.0, 1000.0)})
+    assert bounds_array["EX_glc__D_e"] == (-2.5, 1000.0)
+    assert solver_bounds.apply(bounds_array) == {
+        "EX_glc__D_e": (-2.5, 1000.0), "EX_o2_e": (-1.0, 1000.0)}
+    assert model.reactions.get_by_id("EX_o2_e").lower_bound == -1.0
+    assert solver_bounds.apply(bounds_array) == {}
+    assert BoundsArraySerializer().serialize(bounds_array)['lower'].shape == (len(model.reactions),)
@@ -0,0 +1,194 @@
+"""
+==========
+Checkpoint
+==========
+Periodic checkpoints of a dFBA composite, and resuming a run from one.
+
+A checkpoint holds everything the rest of the run depends on:
+
+* the values of every store, and the global time
+* the state processes keep outside the stores. Processes take the
+  ``Checkpointed`` mixin and list these attributes in
+  ``checkpoint_attributes`` (e.g. BiomassCalculator's ``current_biomass``);
+  processes with an LP also save the bounds and simplex basis in their
+  solver (see library.lp.solver_state), so the next solve after a resume
+  starts where the interrupted run left off
+* the state of Python's and NumPy's global random number generators
+* what the emitter needs to carry on: the data of RAM emitters, the emit
+  policies, and for the columnar emitter the number of Parquet parts
+  written (parts written after the checkpoint are dropped on resume)
+
+It is pickled, compressed with zlib and written through a temporary file,
+so a job killed while writing leaves the previous checkpoint intact.
+
+``run_checkpointed`` replaces ``engine.update(simulation_time)``: it runs
+the simulation in intervals of ``every`` time units, writes a checkpoint
+after each one and, if the checkpoint file already exists, first resumes
+from it. A resumed run gives the same results as one that was never
+interrupted. The processes only complete their timesteps at the interval
+ends, so with adaptive timesteps a checkpointed run can take slightly
+different steps than an ``engine.update`` over the whole time. For long
+runs the columnar emitter keeps checkpoints small, since a RAM emitter's
+whole history goes into every checkpoint.
+"""
+
+import glob
+import os
+import pickle
+import random
+import zlib
+
+import numpy as np
+from vivarium.core.emitter import RAMEmitter
+from vivarium.core.engine import empty_front
+
+from vivarium_microbiome.library.emitters import ColumnarEmitter
+from vivarium_microbiome.library.model_cache import _write_atomic
+
+
+CHECKPOINT_VERSION = 1
+
+
+class Checkpointed:
+    """Mixin for processes that keep state outside the stores."""
+
+    checkpoint_attributes = ()
+
+    def checkpoint_state(self):
+        return {name: getattr(self, name) for name in self.checkpoint_attributes}
+
+    def restore_state(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+def process_paths(processes, prefix=()):
+    """``{path: process}`` of the (nested) ``processes`` dict of a composite."""
+    paths = {}
+    for name, process in processes.items():
+        path = prefix + (name,)
+        if isinstance(process, dict):
+            paths.update(process_paths(process, path))
+        else:
+            paths[path] = process
+    return paths
+
+
+def emitter_state(emitter):
+    if isinstance(emitter, ColumnarEmitter):
+        emitter.flush()  # everything emitted so far is on disk
+        return {'parts': emitter.parts, 'policies': emitter.policies}
+    if isinstance(emitter, RAMEmitter):
+        return {'saved_data': emitter.saved_data, 'policies': getattr(emitter, 'policies', None)}
+    return None
+
+
+def restore_emitter(emitter, state):
+    if state is None:
+        return
+    if isinstance(emitter, ColumnarEmitter):
+        # the part files of the interrupted run after the checkpoint, and the rows of the new Engine's start
+        for part in sorted(glob.glob(os.path.join(emitter.path, 'part-*.parquet')))[state['parts']:]:
+            os.remove(part)
+        emitter.parts = state['parts']
+        emitter.columns = {}
+        emitter.rows = 0
+    elif isinstance(emitter, RAMEmitter):
+        emitter.saved_data = state['saved_data']
+    if state['policies'] is not None:
+        emitter.policies = state['policies']
+
+
+def _not_a_process(store):
+    return not store.topology
+
+
+def make_checkpoint(engine, processes):
+    """The checkpoint of ``engine`` and its ``processes`` at the current time, as a dict."""
+    return {
+        'version': CHECKPOINT_VERSION,
+        'time': engine.global_time,
+        'state': engine.state.get_value(condition=_not_a_process),
+        'processes': {
+            path: process.checkpoint_state()
+            for path, process in process_paths(processes).items()
+            if isinstance(process, Checkpointed)},
+        'random': random.getstate(),
+        'numpy_random': np.random.get_state(),
+        'emitter': emitter_state(engine.emitter),
+    }
+
+
+def save_checkpoint(path, engine, processes, level=6):
+    """Write the checkpoint of ``engine`` to ``path``, replacing the previous one."""
+    data = zlib.compress(pickle.dumps(make_checkpoint(engine, processes), protocol=pickle.HIGHEST_PROTOCOL), level)
+    _write_atomic(os.path.abspath(path), lambda f: f.write(data))
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        checkpoint = pickle.loads(zlib.decompress(f.read()))
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        raise ValueError('{} is not a version {} checkpoint'.format(path, CHECKPOINT_VERSION))
+    return checkpoint
+
+
+def restore_checkpoint(engine, processes, checkpoint):
+    """Put ``engine`` and its ``processes`` (built as for a new run) back in the state of ``checkpoint``."""
+    engine.state.set_value(checkpoint['state'])
+    engine.global_time = checkpoint['time']
+    engine.front = {path: empty_front(engine.global_time) for path in engine.front}
+    paths = process_paths(processes)
+    for path, state in checkpoint['processes'].items():
+        paths[path].restore_state(state)
+    random.setstate(checkpoint['random'])
+    np.random.set_state(checkpoint['numpy_random'])
+    restore_emitter(engine.emitter, checkpoint['emitter'])
+
+
+def run_checkpointed(engine, processes, simulation_time, path, every=100, resume=True):
+    """
+    Run ``engine`` until ``simulation_time``, writing a checkpoint to
+    ``path`` every ``every`` time units. With ``resume``, an existing
+    checkpoint at ``path`` is restored first.
+    """
+    if resume and os.path.exists(path):
+        restore_checkpoint(engine, processes, load_checkpoint(path))
+    while engine.global_time < simulation_time:
+        engine.update(min(every, simulation_time - engine.global_time))
+        save_checkpoint(path, engine, processes)
+
+
+def test_checkpoint(tmp_path):
+    from vivarium.core.engine import Engine
+    from vivarium.core.process import Process
+
+    class Walker(Checkpointed, Process):
+        checkpoint_attributes = ('position',)
+
+        def __init__(self, parameters=None):
+            super().__init__(parameters)
+            self.position = 0.0
+
+        def ports_schema(self):
+            return {'x': {'_default': 0.0, '_emit': True, '_updater': 'accumulate'}}
+
+        def next_update(self, timestep, state):
+            self.position += random.random()
+            return {'x': self.position}
+
+    def run(path, simulation_time):
+        processes = {'Walker': Walker()}
+        engine = Engine(
+            processes=processes, topology={'Walker': {'x': ('x',)}}, display_info=False, progress_bar=False)
+        run_checkpointed(engine, processes, simulation_time, str(path), every=4)
+        return engine.emitter.get_data()
+
+    random.seed(1)
+    uninterrupted = run(tmp_path / 'uninterrupted.ckpt', 10)
+    random.seed(1)
+    run(tmp_path / 'killed.ckpt', 8)
+    random.seed(2)  # the resumed run takes the generator state from the checkpoint
+    resumed = run(tmp_path / 'killed.ckpt', 10)
+    assert resumed == uninterrupted
+    assert load_checkpoint(tmp_path / 'killed.ckpt')['time'] == 10
@@ -0,0 +1,268 @@
+"""
+========
+Dispatch
+========
+Concurrent LP solves for composites with several DynamicFBA processes
+(strains, species or replicate wells).
+
+In every timestep the Engine starts the update of each process that is due
+with ``send_command('next_update', ...)``, and only then collects the
+updates with ``get_command_result()`` and applies them, so before
+BiomassCalculator and EnvCalculator see the new fluxes. A Dispatched
+process submits its LP to an executor when its update is started and waits
+for the solution when it is collected, so the LPs of all of them run at
+the same time.
+
+The executors are shared by every process with the same ``executor``
+parameter: ``'thread'``, ``'process'`` or a dict with ``kind`` and
+``workers`` (default: the number of CPUs).
+
+* ``'thread'``: a thread pool, on which every process solves its own
+  model. This only runs solves in parallel with solvers that release the
+  GIL while they solve; the swiglpk bindings of GLPK (cobra's default
+  solver) do not.
+* ``'process'``: ``workers`` worker processes. Every process is pinned to
+  one of them, round robin, which keeps a copy of it with its own model,
+  solver bounds and basis; only the bounds and the solution are pickled.
+  The solves of one process run in order on the same LP, so its results do
+  not depend on how the others are scheduled.
+
+The pools live until ``shutdown_pools()`` or the end of the interpreter,
+whichever comes first; either shuts their executors down.
+"""
+
+import itertools
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_tokens = itertools.count()
+
+
+class Dispatched:
+    """
+    Mixin for Processes that start their update with
+    ``dispatch_update(timestep, state)``, which returns a function that
+    finishes it, whenever ``dispatcher`` is set.
+    """
+
+    dispatcher = None
+    _collect = None
+
+    def send_command(self, command, args=None, kwargs=None, run_pre_check=True):
+        if command != 'next_update' or self.dispatcher is None:
+            return super().send_command(command, args, kwargs, run_pre_check)
+        if run_pre_check:
+            self.pre_send_command(command, args, kwargs)
+        self._collect = self.dispatch_update(*(args or ()), **(kwargs or {}))
+
+    def get_command_result(self):
+        collect = self._collect
+        if collect is None:
+            return super().get_command_result()
+        self._collect = None
+        self._pending_command = None
+        return collect()
+
+
+class ThreadDispatcher:
+    """Runs the solves of ``process`` on a thread pool."""
+
+    remote = False
+
+    def __init__(self, executor, process):
+        self.executor = executor
+        self.process = process
+
+    def solve(self, reaction_bounds):
+        return self.executor.submit(self.process.solve_fluxes, reaction_bounds)
+
+
+_remote = {}
+
+
+def _create(token, cls, parameters):
+    _remote[token] = cls(parameters)
+
+
+def _call(token, method, args):
+    return getattr(_remote[token], method)(*args)
+
+
+def _discard(token):
+    _remote.pop(token, None)
+
+
+def _discard_remote(lane, token):
+    try:
+        lane.submit(_discard, token)
+    except RuntimeError:  # the pool is already shut down
+        pass
+
+
+class ProcessDispatcher:
+    """
+    Runs the solves of a copy of ``process``, built from ``parameters`` on
+    the worker process of ``lane``.
+    """
+
+    remote = True
+
+    def __init__(self, lane, process, parameters):
+        self.lane = lane
+        self.token = (os.getpid(), next(_tokens))
+        self.created = lane.submit(_create, self.token, type(process), parameters)
+        weakref.finalize(process, _discard_remote, lane, self.token)
+
+    def _submit(self, method, *args):
+        if self.created is not None:
+            self.created.result()  # raises here if the copy could not be built
+            self.created = None
+        return self.lane.submit(_call, self.token, method, args)
+
+    def solve(self, reaction_bounds):
+        return self._submit('solve_fluxes', reaction_bounds)
+
+    def call(self, method, *args):
+        """Call ``method`` of the copy and wait for its result."""
+        return self._submit(method, *args).result()
+
+
+def _shutdown(executors):
+    for executor in executors:
+        executor.shutdown()
+
+
+class ThreadPool:
+    def __init__(self, workers):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lp')
+        self.shutdown = weakref.finalize(self, self.executor.shutdown)
+
+    def dispatcher(self, process, parameters):
+        return ThreadDispatcher(self.executor, process)
+
+
+class ProcessPool:
+    """``workers`` single-process executors, started as processes are pinned to them."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lanes = []
+        self.assigned = 0
+        # _pools keeps the pool alive, so this runs at shutdown_pools() or at exit
+        self.shutdown = weakref.finalize(self, _shutdown, self.lanes)
+
+    def dispatcher(self, process, parameters):
+        index = self.assigned % self.workers
+        self.assigned += 1
+        if index == len(self.lanes):
+            self.lanes.append(ProcessPoolExecutor(max_workers=1))
+        return ProcessDispatcher(self.lanes[index], process, parameters)
+
+
+POOLS = {
+    'thread': ThreadPool,
+    'process': ProcessPool,
+}
+
+
+def shared_pool(kind='thread', workers=None):
+    """The pool of ``kind`` with ``workers`` workers, created on first use."""
+    if kind not in POOLS:
+        raise ValueError('unknown executor {!r}, expected one of {}'.format(kind, sorted(POOLS)))
+    workers = workers or os.cpu_count() or 1
+    with _pools_lock:
+        pool = _pools.get((kind, workers))
+        if pool is None:
+            pool = _pools[(kind, workers)] = POOLS[kind](workers)
+    return pool
+
+
+def shutdown_pools():
+    """Shut down the executors of every shared pool; later dispatchers start new ones."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def dispatcher(process, option, parameters=None):
+    """
+    The dispatcher of ``process`` for an ``executor`` process parameter, or
+    None. ``parameters`` builds the copy of the process on a worker
+    process.
+    """
+    if not option:
+        return None
+    if process.parameters.get('_parallel'):
+        raise ValueError('a process runs either with _parallel or with an executor, not both')
+    option = {'kind': option} if isinstance(option, str) else dict(option)
+    pool = shared_pool(option.get('kind', 'thread'), option.get('workers'))
+    return pool.dispatcher(process, parameters)
+
+
+def test_dispatch():
+    from vivarium.core.process import Process
+
+    class Square(Dispatched, Process):
+        defaults = {'executor': None}
+
+        def __init__(self, parameters=None):
+            super().__init__(parameters=parameters)
+            self.dispatcher = dispatcher(self, self.parameters['executor'], dict(self.parameters, executor=None))
+            self.calls = 0
+
+        def ports_schema(self):
+            return {'x': {'_default': 0.0, '_updater': 'set'}}
+
+        def solve_fluxes(self, x):
+            self.calls += 1
+            return x * x, os.getpid()
+
+        def next_update(self, timestep, state):
+            return {'x': self.solve_fluxes(state['x'])[0]}
+
+        def dispatch_update(self, timestep, state):
+            future = self.dispatcher.solve(state['x'])
+            return lambda: {'x': future.result()[0]}
+
+    serial = Square()
+    threaded = [Square({'executor': 'thread'}) for _ in range(3)]
+    assert serial.dispatcher is None
+    assert threaded[0].dispatcher.executor is threaded[2].dispatcher.executor
+    for process in [serial] + threaded:
+        process.send_command('next_update', (1.0, {'x': 3.0}))
+    assert [process.get_command_result() for process in [serial] + threaded] == [{'x': 9.0}] * 4
+    assert all(process.calls == 1 for process in threaded)
+    # other commands run in place
+    threaded[0].send_command('calculate_timestep', ({},))
+    assert threaded[0].get_command_result() == 1.0
+
+    pool = shared_pool('process', 2)
+    assert shared_pool('process', 2) is pool
+    try:
+        shared_pool('fork')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('unknown executors are rejected')
+
+    # shutting the pools down stops their executors; the next dispatcher starts new ones
+    pool.lanes.append(ProcessPoolExecutor(max_workers=1))
+    assert pool.lanes[0].submit(os.getpid).result() != os.getpid()
+    executors = [threaded[0].dispatcher.executor, pool.lanes[0]]
+    shutdown_pools()
+    assert shared_pool('process', 2) is not pool
+    for executor in executors:
+        try:
+            executor.submit(os.getpid)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('a shut down pool takes no more work')
+    shutdown_pools()
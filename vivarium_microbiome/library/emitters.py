@@ -0,0 +1,287 @@
+"""
+========
+Emitters
+========
+Emitters for dFBA composites, whose largest stores (fluxes, the reaction
+list, reaction bounds) scale with the model rather than with what is
+analysed.
+"""
+
+import glob
+import os
+
+from vivarium.core.emitter import Emitter, RAMEmitter
+from vivarium.core.serialize import make_fallback_serializer_function, serialize_value
+from vivarium.library.topology import get_in
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+EMIT_MODES = ('always', 'once', 'on_change')
+_SKIP = object()
+_fallback_serializer = make_fallback_serializer_function()
+
+
+class EmitPolicy:
+    """
+    Decides what a single store emits at each emit step.
+
+    A policy is a mode name or a dict with any of
+
+    * ``emit``: ``'always'`` (default), ``'once'`` (first emit only) or
+      ``'on_change'`` (only when the emitted value differs from the last one)
+    * ``every``: emit only on every Nth emit step
+    * ``keys``: emit only these keys of a dict-like value
+
+    Stores that skip a step are left out of that step's data, so consumers
+    of ``once``/``on_change`` stores carry the last emitted value forward.
+    """
+
+    def __init__(self, policy='always'):
+        if isinstance(policy, str):
+            policy = {'emit': policy}
+        self.mode = policy.get('emit', 'always')
+        if self.mode not in EMIT_MODES:
+            raise ValueError('unknown emit mode {!r}, expected one of {}'.format(
+                self.mode, EMIT_MODES))
+        self.every = int(policy.get('every', 1))
+        if self.every < 1:
+            raise ValueError('emit policy "every" must be at least 1')
+        self.keys = policy.get('keys')
+        self.steps = 0
+        self.emitted = False
+        self.last = _SKIP
+
+    def select(self, value):
+        """Return the serialized value to emit at this step, or ``_SKIP``."""
+        step = self.steps
+        self.steps += 1
+        if step % self.every:
+            return _SKIP
+        if self.mode == 'once' and self.emitted:
+            return _SKIP
+        if self.keys is not None:
+            value = {key: value[key] for key in self.keys if key in value}
+        value = serialize_value(value, _fallback_serializer)
+        if self.mode == 'on_change':
+            if self.emitted and value == self.last:
+                return _SKIP
+            self.last = value
+        self.emitted = True
+        return value
+
+
+def normalize_path(path):
+    if isinstance(path, str):
+        return (path,)
+    return tuple(path)
+
+
+def make_policies(policies):
+    return {normalize_path(path): EmitPolicy(policy) for path, policy in policies.items()}
+
+
+def apply_policies(policies, data):
+    """Return a copy of emitted ``data`` with every policy applied."""
+    if not policies:
+        return data
+    data = dict(data)
+    for path, policy in policies.items():
+        value = get_in(data, path)
+        if value is None:
+            continue
+        _assoc_copy(data, path, policy.select(value))
+    return data
+
+
+class PolicyEmitter(RAMEmitter):
+    """
+    RAM emitter with per-store emit policies.
+
+    Configured with ``{'type': 'policy', 'policies': {path: policy}}``, where
+    ``path`` is a store name or a path tuple and ``policy`` is anything
+    EmitPolicy accepts. Stores without a policy are emitted every step, as by
+    the plain RAM emitter. Skipped stores are dropped before serialization,
+    so they cost neither memory nor time.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.policies = make_policies(config.get('policies', {}))
+
+    def emit(self, data):
+        if data['table'] == 'history' and self.policies:
+            data = dict(data, data=apply_policies(self.policies, data['data']))
+        super().emit(data)
+
+
+def _assoc_copy(data, path, value):
+    """Set (or, for ``_SKIP``, remove) ``path`` in ``data`` without touching shared inner dicts."""
+    head, *rest = path
+    if not rest:
+        if value is _SKIP:
+            data.pop(head, None)
+        else:
+            data[head] = value
+        return
+    inner = dict(data[head])
+    _assoc_copy(inner, rest, value)
+    data[head] = inner
+
+
+def flatten(data, prefix=''):
+    """Flatten nested dicts into ``{'outer/inner': value}`` columns."""
+    columns = {}
+    for key, value in data.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            columns.update(flatten(value, name + '/'))
+        else:
+            columns[name] = value
+    return columns
+
+
+class ColumnarEmitter(Emitter):
+    """
+    Streams the history table into chunked Parquet files.
+
+    Each emitted step becomes one row. Nested stores are flattened into
+    ``'store/key'`` columns, so a flux dict gives one column per reaction and
+    a BoundsArray gives ``'reaction_bounds/lower'`` and
+    ``'reaction_bounds/upper'`` list columns in the fixed reaction order.
+    Every ``chunk_size`` rows are written to ``<path>/part-NNNNN.parquet``,
+    so memory stays bounded whatever the run length. ``get_data`` returns a
+    ColumnarData handle instead of loading the data.
+
+    Config keys: ``path`` (default ``out/<experiment_id>``), ``chunk_size``
+    (default 1000) and ``policies`` (as for PolicyEmitter). Needs pyarrow.
+    """
+
+    def __init__(self, config):
+        if pyarrow is None:
+            raise ImportError(
+                'the columnar emitter needs pyarrow: pip install vivarium-microbiome[columnar]')
+        super().__init__(config)
+        self.path = config.get('path') or os.path.join('out', str(config.get('experiment_id', 'columnar')))
+        self.chunk_size = config.get('chunk_size', 1000)
+        self.policies = make_policies(config.get('policies', {}))
+        self.fallback_serializer = make_fallback_serializer_function()
+        self.columns = {}
+        self.rows = 0
+        self.parts = len(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def emit(self, data):
+        if data['table'] != 'history':
+            return
+        emit_data = apply_policies(self.policies, data['data'])
+        row = flatten(serialize_value(emit_data, self.fallback_serializer))
+        for name, value in row.items():
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * self.rows
+            column.append(value)
+        self.rows += 1
+        for column in self.columns.values():
+            if len(column) < self.rows:
+                column.append(None)
+        if self.rows >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new part file."""
+        if not self.rows:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        part = os.path.join(self.path, 'part-{:05d}.parquet'.format(self.parts))
+        pyarrow.parquet.write_table(pyarrow.table(self.columns), part)
+        self.parts += 1
+        self.columns = {name: [] for name in self.columns}
+        self.rows = 0
+
+    def get_data(self, query=None):
+        self.flush()
+        return ColumnarData(self.path)
+
+
+class ColumnarData:
+    """Lazy handle on the Parquet parts written by a ColumnarEmitter."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def columns(self):
+        names = []
+        for part in self.parts():
+            for name in pyarrow.parquet.read_schema(part).names:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def iter_tables(self, columns=None):
+        """Yield one pyarrow Table per part file, restricted to ``columns``."""
+        for part in self.parts():
+            if columns is not None:
+                names = pyarrow.parquet.read_schema(part).names
+                yield pyarrow.parquet.read_table(part, columns=[c for c in columns if c in names])
+            else:
+                yield pyarrow.parquet.read_table(part)
+
+    def read(self, columns=None):
+        """Read the whole run (or only ``columns``) into one pyarrow Table."""
+        return pyarrow.concat_tables(list(self.iter_tables(columns)), promote_options='default')
+
+    def to_pandas(self, columns=None):
+        return self.read(columns).to_pandas()
+
+    def __repr__(self):
+        return 'ColumnarData({!r})'.format(self.path)
+
+
+def test_policy_emitter():
+    emitter = PolicyEmitter({'policies': {
+        'reactions_list': 'once',
+        'reaction_bounds': 'on_change',
+        ('bacteria', 'fluxes_values'): {'every': 2, 'keys': ['EX_glc__D_e']},
+    }})
+    for time in range(4):
+        emitter.emit({'table': 'history', 'data': {
+            'time': float(time),
+            'reactions_list': ['a', 'b'],
+            'reaction_bounds': {'lower': [0.0, -10.0 if time < 2 else -5.0]},
+            'bacteria': {'fluxes_values': {'EX_glc__D_e': -float(time), 'PGI': 1.0}, 'biomass': 1.0},
+        }})
+    data = emitter.get_data()
+    assert [t for t in data if 'reactions_list' in data[t]] == [0.0]
+    assert [t for t in data if 'reaction_bounds' in data[t]] == [0.0, 2.0]
+    assert [t for t in data if 'fluxes_values' in data[t]['bacteria']] == [0.0, 2.0]
+    assert data[2.0]['bacteria']['fluxes_values'] == {'EX_glc__D_e': -2.0}
+    assert all(data[t]['bacteria']['biomass'] == 1.0 for t in data)
+
+
+def test_columnar_emitter(tmp_path):
+    import pytest
+    pytest.importorskip('pyarrow')
+    emitter = ColumnarEmitter({
+        'path': str(tmp_path), 'chunk_size': 3, 'policies': {'reactions_list': 'once'}})
+    for time in range(5):
+        emitter.emit({'table': 'history', 'data': {
+            'time': float(time),
+            'reactions_list': ['a', 'b'],
+            'fluxes_values': {'EX_glc__D_e': -float(time), 'PGI': 1.0},
+            'reaction_bounds': {'lower': [0.0, -float(time)], 'upper': [1.0, 1.0]},
+        }})
+    data = emitter.get_data()
+    assert len(data.parts()) == 2
+    table = data.read()
+    assert table.num_rows == 5
+    assert table.column('fluxes_values/EX_glc__D_e').to_pylist() == [0.0, -1.0, -2.0, -3.0, -4.0]
+    assert table.column('reaction_bounds/lower').to_pylist()[4] == [0.0, -4.0]
+    assert table.column('reactions_list').to_pylist()[:2] == [['a', 'b'], None]
+    assert data.read(['time', 'reactions_list']).num_columns == 2
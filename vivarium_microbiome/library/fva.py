@@ -0,0 +1,227 @@
+"""
+==========================
+Flux Variability Analysis
+==========================
+Flux ranges of a dFBA composite, alongside the single optimum DynamicFBA
+reports.
+
+FVA finds, for every reaction, the smallest and the largest flux of any
+solution whose objective value is at least ``fraction_of_optimum`` of the
+optimum, which takes two LPs per reaction. FVASolver keeps the LP on its
+own copy of the model, so every one of them starts from the basis of the
+LP before it: each FVA first re-solves the FBA at the current bounds, then
+holds the objective value with a constraint and changes only the objective
+from one reaction to the next. That leaves the basis primal feasible, and
+the primal simplex re-optimizes it in a few pivots.
+
+The FluxVariability process runs FVA on every ``every``-th step of the
+loop and writes the ranges to the ``flux_ranges`` store as a BoundsArray,
+which the columnar emitter stores as the ``flux_ranges/lower`` and
+``flux_ranges/upper`` list columns (in the order of ``reactions``).
+With ``workers`` above 1 the reactions are split across a process pool
+whose workers each load the model once and keep their own FVASolver; for
+a model as small as the E. coli core the pool costs more than it saves.
+"""
+
+import math
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from optlang.interface import OPTIMAL
+from optlang.symbolics import Zero
+from vivarium.core.process import Process
+
+from vivarium_microbiome.library.bounds import BoundsArray, SolverBounds
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.model_registry import load_model
+from vivarium_microbiome.library.profiling import phase
+from vivarium_microbiome.library.timestep import SharedTimestep
+
+try:
+    import swiglpk
+except ImportError:
+    swiglpk = None
+
+
+class FVASolver:
+    """Flux ranges of ``model`` (which it modifies) at given reaction bounds."""
+
+    def __init__(self, model, fraction_of_optimum=1.0):
+        self.model = model
+        self.fraction_of_optimum = fraction_of_optimum
+        self.solver_bounds = SolverBounds(model)
+        self.fba_objective = model.solver.objective
+        self.optimum = model.problem.Constraint(
+            self.fba_objective.expression, lb=None, name='fva_optimum')
+        model.solver.add(self.optimum)
+        self.flux_objective = model.problem.Objective(Zero, direction='max')
+        self.glpk = swiglpk is not None and model.solver.interface.__name__ == 'optlang.glpk_interface'
+        self.solves = 0
+
+    def _solve(self):
+        self.model.slim_optimize()
+        self.solves += 1
+        if self.model.solver.status != OPTIMAL:
+            return math.nan
+        return self.model.solver.objective.value
+
+    def ranges(self, reaction_bounds, reaction_ids):
+        """Minimum and maximum flux arrays of ``reaction_ids`` at ``reaction_bounds``; NaN where an LP failed."""
+        if not self.glpk:
+            return self._ranges(reaction_bounds, reaction_ids)
+        # changing only the objective keeps the basis primal feasible; the model's own method is restored after
+        smcp = self.model.solver.configuration._smcp
+        method = smcp.meth
+        smcp.meth = swiglpk.GLP_PRIMAL
+        try:
+            return self._ranges(reaction_bounds, reaction_ids)
+        finally:
+            smcp.meth = method
+
+    def _ranges(self, reaction_bounds, reaction_ids):
+        lower = np.full(len(reaction_ids), np.nan)
+        upper = np.full(len(reaction_ids), np.nan)
+        solver = self.model.solver
+        self.solver_bounds.apply(reaction_bounds)
+        self.optimum.lb = None
+        solver.objective = self.fba_objective
+        optimum = self._solve()
+        if math.isnan(optimum):
+            return lower, upper
+        if self.fba_objective.direction == 'max':
+            self.optimum.lb = self.fraction_of_optimum * optimum
+        else:
+            self.optimum.ub = optimum / self.fraction_of_optimum
+        solver.objective = self.flux_objective
+        for index, reaction_id in enumerate(reaction_ids):
+            reaction = self.model.reactions.get_by_id(reaction_id)
+            self.flux_objective.set_linear_coefficients({reaction.forward_variable: 1, reaction.reverse_variable: -1})
+            self.flux_objective.direction = 'min'
+            lower[index] = self._solve()
+            self.flux_objective.direction = 'max'
+            upper[index] = self._solve()
+            self.flux_objective.set_linear_coefficients({reaction.forward_variable: 0, reaction.reverse_variable: 0})
+        self.optimum.lb = self.optimum.ub = None
+        return lower, upper
+
+
+_worker = {}
+
+
+def _init_worker(model_file, fraction_of_optimum):
+    _worker['solver'] = FVASolver(load_model(model_file), fraction_of_optimum)
+
+
+def _worker_ranges(reaction_bounds, reaction_ids):
+    return _worker['solver'].ranges(reaction_bounds, reaction_ids)
+
+
+class FluxVariability(Checkpointed, SharedTimestep, Process):
+    """Writes the flux range of every reaction in ``reactions`` on every ``every``-th step."""
+
+    defaults = {
+        'model_file': None,
+        'every': 10,  # steps of the loop between two FVAs
+        'reactions': 'all',  # 'all' or the list of reaction IDs
+        'fraction_of_optimum': 1.0,
+        'workers': 1,  # more than 1 splits the reactions over a process pool
+    }
+    checkpoint_attributes = ('steps',)
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        model = load_model(self.parameters['model_file'])
+        self.initial_bounds = BoundsArray.from_model(model)
+        reactions = self.parameters['reactions']
+        self.reaction_ids = tuple(self.initial_bounds.reaction_ids if reactions == 'all' else reactions)
+        self.workers = self.parameters['workers']
+        self.solver = FVASolver(model, self.parameters['fraction_of_optimum']) if self.workers <= 1 else None
+        self.executor = None
+        self.steps = 0
+
+    def ports_schema(self):
+        unknown = np.full(len(self.reaction_ids), np.nan)
+        return {
+            'reaction_bounds': {
+                '_default': self.initial_bounds,
+                '_updater': 'bounds_array'
+            },
+            'flux_ranges': {
+                '_default': BoundsArray(self.reaction_ids, unknown, unknown),
+                '_emit': True,
+                '_updater': 'set'
+            },
+            'timestep': self.timestep_schema(),
+        }
+
+    def pool(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker,
+                initargs=(self.parameters['model_file'], self.parameters['fraction_of_optimum']))
+            weakref.finalize(self, self.executor.shutdown)
+        return self.executor
+
+    def ranges(self, reaction_bounds):
+        """The flux ranges at ``reaction_bounds``, as a BoundsArray over ``reaction_ids``."""
+        if self.solver:
+            lower, upper = self.solver.ranges(reaction_bounds, self.reaction_ids)
+        else:
+            chunks = [list(chunk) for chunk in np.array_split(self.reaction_ids, self.workers) if len(chunk)]
+            results = list(self.pool().map(_worker_ranges, [reaction_bounds] * len(chunks), chunks))
+            lower = np.concatenate([chunk_lower for chunk_lower, _ in results])
+            upper = np.concatenate([chunk_upper for _, chunk_upper in results])
+        return BoundsArray(self.reaction_ids, lower, upper)
+
+    def next_update(self, timestep, state):
+        step = self.steps
+        self.steps += 1
+        if step % self.parameters['every']:
+            return {}
+        with phase('fva'):
+            return {'flux_ranges': self.ranges(state['reaction_bounds'])}
+
+
+def fva_processes(parameters):
+    return {'FluxVariability': FluxVariability(parameters)}
+
+
+def fva_topology():
+    return {
+        'FluxVariability': {
+            'reaction_bounds': ('reaction_bounds',),
+            'flux_ranges': ('flux_ranges',),
+        },
+    }
+
+
+def test_flux_variability():
+    import os
+    from cobra.flux_analysis import flux_variability_analysis
+
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_file = os.path.join(current_dir, "../data/e_coli_core.xml")
+    reactions = ['EX_glc__D_e', 'PGI', 'G6PDH2r', 'BIOMASS_Ecoli_core_w_GAM']
+    bounds = BoundsArray.from_model(load_model(model_file))
+    bounds.update({'EX_glc__D_e': (-5.0, 1000.0)})
+    model = load_model(model_file)
+    with model:
+        model.reactions.get_by_id('EX_glc__D_e').lower_bound = -5.0
+        expected = flux_variability_analysis(model, reactions, fraction_of_optimum=0.9, processes=1)
+
+    fva = FluxVariability({'model_file': model_file, 'reactions': reactions, 'fraction_of_optimum': 0.9, 'every': 2})
+    updates = [fva.next_update(1, {'reaction_bounds': bounds}) for _ in range(3)]
+    assert updates[1] == {}
+    if fva.solver.glpk:
+        assert fva.solver.model.solver.configuration._smcp.meth == model.solver.configuration._smcp.meth
+    for update in (updates[0], updates[2]):
+        ranges = update['flux_ranges']
+        assert np.allclose(ranges.lower, expected['minimum'][reactions].values, atol=1e-6)
+        assert np.allclose(ranges.upper, expected['maximum'][reactions].values, atol=1e-6)
+
+    pooled = FluxVariability({'model_file': model_file, 'reactions': reactions, 'fraction_of_optimum': 0.9, 'workers': 2})
+    ranges = pooled.ranges(bounds)
+    assert ranges.reaction_ids == tuple(reactions)
+    assert np.allclose(ranges.lower, updates[0]['flux_ranges'].lower)
+    assert np.allclose(ranges.upper, updates[0]['flux_ranges'].upper)
@@ -0,0 +1,648 @@
+"""
+==========
+LP Solving
+==========
+Helpers for re-solving the FBA linear program of a COBRA model across
+consecutive dFBA timesteps.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from cobra.core.solution import get_solution
+from optlang.interface import OPTIMAL
+
+from vivarium_microbiome.library.bounds import BoundsArray, SolverBounds
+from vivarium_microbiome.library.model_registry import load_model, model_key
+
+try:
+    import swiglpk
+except ImportError:
+    swiglpk = None
+
+
+class WarmStartLP:
+    """
+    Re-solves a model's LP starting from the previous optimal basis.
+
+    Between dFBA steps only a few bounds move, so the last optimal basis
+    stays dual feasible and the dual simplex reaches the new optimum in a
+    handful of pivots. If the warm re-solve does not end optimal, the basis
+    is reset and the LP is solved again from scratch (cold).
+
+    Counters and iteration accounting need the GLPK interface; with other
+    solvers the model's solver is simply called, which keeps its own basis.
+    ``iterations_saved`` estimates the pivots avoided by comparing each warm
+    solve with the iterations of the most recent cold solve.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.glpk = swiglpk is not None and model.solver.interface.__name__ == 'optlang.glpk_interface'
+        self.warm = False
+        self.solves = 0
+        self.warm_solves = 0
+        self.cold_solves = 0
+        self.fallbacks = 0
+        self.iterations = 0
+        self.cold_iterations = None
+        self.iterations_saved = 0
+
+    def __setstate__(self, state):
+        # an unpickled model gets a fresh solver, without the previous basis
+        self.__dict__.update(state)
+        self.warm = False
+
+    def _iteration_count(self):
+        if self.glpk:
+            return swiglpk.glp_get_it_cnt(self.model.solver.problem)
+        return 0
+
+    def _solve(self, warm):
+        if self.glpk:
+            if not warm:
+                swiglpk.glp_std_basis(self.model.solver.problem)
+            # the simplex method is set for this solve only, later solves of the model get its own
+            smcp = self.model.solver.configuration._smcp
+            method = smcp.meth
+            smcp.meth = swiglpk.GLP_DUALP if warm else swiglpk.GLP_PRIMAL
+        start = self._iteration_count()
+        try:
+            self.model.slim_optimize()
+        finally:
+            if self.glpk:
+                smcp.meth = method
+        iterations = self._iteration_count() - start
+        self.solves += 1
+        self.iterations += iterations
+        return self.model.solver.status, iterations
+
+    def solve(self):
+        """Solve the LP and return the optlang status."""
+        if self.warm:
+            status, iterations = self._solve(warm=True)
+            if status == OPTIMAL:
+                self.warm_solves += 1
+                if self.cold_iterations is not None:
+                    self.iterations_saved += max(self.cold_iterations - iterations, 0)
+                return status
+            self.fallbacks += 1
+
+        status, iterations = self._solve(warm=False)
+        self.cold_solves += 1
+        self.cold_iterations = iterations
+        self.warm = status == OPTIMAL
+        return status
+
+    def optimize(self):
+        """Solve the LP and return a COBRA Solution, like ``model.optimize()``."""
+        self.solve()
+        return get_solution(self.model)
+
+    def statistics(self):
+        return {
+            'solves': self.solves,
+            'warm_solves': self.warm_solves,
+            'cold_solves': self.cold_solves,
+            'fallbacks': self.fallbacks,
+            'iterations': self.iterations,
+            'iterations_saved': self.iterations_saved,
+        }
+
+
+def get_basis(model):
+    """The simplex basis (row and column statuses) of a GLPK model's LP, or None with other solvers."""
+    if swiglpk is None or model.solver.interface.__name__ != 'optlang.glpk_interface':
+        return None
+    problem = model.solver.problem
+    rows = [swiglpk.glp_get_row_stat(problem, row) for row in range(1, swiglpk.glp_get_num_rows(problem) + 1)]
+    columns = [swiglpk.glp_get_col_stat(problem, column) for column in range(1, swiglpk.glp_get_num_cols(problem) + 1)]
+    return np.array(rows, dtype=np.int8), np.array(columns, dtype=np.int8)
+
+
+def set_basis(model, basis):
+    if basis is None:
+        return
+    problem = model.solver.problem
+    rows, columns = basis
+    for row, status in enumerate(rows.tolist(), 1):
+        swiglpk.glp_set_row_stat(problem, row, status)
+    for column, status in enumerate(columns.tolist(), 1):
+        swiglpk.glp_set_col_stat(problem, column, status)
+
+
+def get_primal_values(model):
+    """The primal values of every solver variable of ``model``, in the order of ``model.solver.variables``."""
+    if swiglpk is None or model.solver.interface.__name__ != 'optlang.glpk_interface':
+        return np.fromiter(model.solver.primal_values.values(), dtype=float)
+    # GLPK's columns are the solver variables in order; swiglpk reads all of them in one call
+    return np.asarray(swiglpk.get_col_primals(model.solver.problem), dtype=float)
+
+
+def solver_state(solver_bounds, warm_start=None):
+    """
+    The bounds and basis in the solver of ``solver_bounds``' model, and the
+    state of its WarmStartLP, as saved in a checkpoint. The bounds are read
+    from the model, which also holds bounds set behind the tracker's back.
+    """
+    model = solver_bounds.model
+    state = {'bounds': BoundsArray.from_model(model), 'basis': get_basis(model)}
+    if warm_start is not None:
+        state['warm_start'] = {
+            name: value for name, value in vars(warm_start).items() if name not in ('model', 'glpk')}
+    return state
+
+
+def restore_solver_state(solver_bounds, state, warm_start=None):
+    """Put the bounds and basis of ``solver_state`` back in the solver, so the next solve starts where it left off."""
+    solver_bounds.apply(state['bounds'])
+    set_basis(solver_bounds.model, state['basis'])
+    if warm_start is not None and 'warm_start' in state:
+        vars(warm_start).update(state['warm_start'])
+
+
+class SolutionCache:
+    """
+    Least-recently-used cache of LP solutions, keyed on reaction bounds.
+
+    Once the substrate is exhausted, or while uptake is capped at the
+    model's bound, ReactionBounds keeps setting the same bounds, and the LP
+    need not be solved again. The key holds the bounds that differ from
+    ``reference`` (the model's own bounds), rounded to multiples of
+    ``tolerance``, so bounds closer than that share a solution; a tolerance
+    of 0 only matches identical bounds. An entry is the objective value and
+    the flux array of a FluxReader. ``hits`` and ``misses`` count lookups.
+    """
+
+    def __init__(self, reference, maxsize=1024, tolerance=1e-9):
+        self.reference = reference
+        self.maxsize = maxsize
+        self.tolerance = tolerance
+        self.reference_lower = self.quantize(reference.lower)
+        self.reference_upper = self.quantize(reference.upper)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def quantize(self, values):
+        if not self.tolerance:
+            return values
+        return np.round(values / self.tolerance)
+
+    def key(self, bounds):
+        if not self.reference.same_reactions(bounds):
+            raise ValueError('the solution cache holds bounds of other reactions')
+        lower = self.quantize(bounds.lower)
+        upper = self.quantize(bounds.upper)
+        changed = np.flatnonzero((lower != self.reference_lower) | (upper != self.reference_upper))
+        return changed.tobytes(), lower[changed].tobytes(), upper[changed].tobytes()
+
+    def lookup(self, bounds):
+        """The key of ``bounds`` and its cached ``(objective, fluxes)``, or None."""
+        key = self.key(bounds)
+        solution = self.entries.get(key)
+        if solution is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return key, solution
+
+    def store(self, key, objective, fluxes):
+        self.entries[key] = (objective, np.array(fluxes))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def state(self):
+        return {'entries': OrderedDict(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def restore(self, state):
+        self.entries = OrderedDict(state['entries'])
+        self.hits = state['hits']
+        self.misses = state['misses']
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self.entries),
+        }
+
+
+_shared_caches = {}
+_shared_caches_lock = threading.Lock()
+
+
+def solution_cache(model_file, model, reaction_ids, option):
+    """
+    The SolutionCache of a ``solution_cache`` process parameter: None, True,
+    or a dict of SolutionCache parameters. With ``'shared': True`` every
+    process with the same model file, flux outputs and tolerance gets the
+    same cache, so consecutive runs (such as the runs of a sweep worker)
+    reuse each other's solutions.
+    """
+    if not option:
+        return None
+    parameters = dict({} if option is True else option)
+    shared = parameters.pop('shared', False)
+    if not shared:
+        return SolutionCache(BoundsArray.from_model(model), **parameters)
+    key = (model_key(model_file), tuple(reaction_ids), parameters.get('tolerance', 1e-9))
+    with _shared_caches_lock:
+        cache = _shared_caches.get(key)
+        if cache is None:
+            cache = _shared_caches[key] = SolutionCache(BoundsArray.from_model(model), **parameters)
+    return cache
+
+
+class FluxReader:
+    """
+    Reads reaction fluxes straight from the solver after a solve.
+
+    ``reaction_ids`` is ``'all'`` or a list of reaction IDs. Each flux is the
+    forward minus the reverse primal, as in cobra's Solution, written into
+    the preallocated ``fluxes`` array. No Solution, pandas Series, reduced
+    costs or shadow prices are built.
+    """
+
+    def __init__(self, model, reaction_ids='all'):
+        self.model = model
+        self.all = reaction_ids == 'all'
+        if self.all:
+            reactions = list(model.reactions)
+        else:
+            reactions = [model.reactions.get_by_id(reaction_id) for reaction_id in reaction_ids]
+        self.reaction_ids = [reaction.id for reaction in reactions]
+        self.variables = [
+            (reaction.forward_variable, reaction.reverse_variable) for reaction in reactions]
+        position = {variable.name: index for index, variable in enumerate(model.solver.variables)}
+        self.forward = np.array([position[reaction.id] for reaction in reactions], dtype=np.intp)
+        self.reverse = np.array([position[reaction.reverse_id] for reaction in reactions], dtype=np.intp)
+        self.fluxes = np.zeros(len(reactions))
+
+    def __reduce__(self):
+        # solver variables do not survive pickling, so rebuild the reader on the unpickled model
+        return FluxReader, (self.model, 'all' if self.all else self.reaction_ids)
+
+    def read(self):
+        """Fill and return ``fluxes`` from the solver's current primal values."""
+        if self.all:
+            # one call for every column instead of one per variable
+            primals = get_primal_values(self.model)
+            np.subtract(primals[self.forward], primals[self.reverse], out=self.fluxes)
+        else:
+            for index, (forward, reverse) in enumerate(self.variables):
+                self.fluxes[index] = forward.primal - reverse.primal
+        return self.fluxes
+
+    def to_dict(self):
+        return dict(zip(self.reaction_ids, self.fluxes.tolist()))
+
+
+class BatchSolution:
+    """
+    Results of solving one model under many bound conditions.
+
+    ``fluxes`` is a conditions x reactions matrix in the order of
+    ``reaction_ids``; ``objective_values`` and ``statuses`` hold one entry per
+    condition. Conditions that do not solve to optimality get NaN fluxes and
+    objective value instead of raising, so one bad condition does not lose
+    the batch.
+    """
+
+    def __init__(self, reaction_ids, objective_values, fluxes, statuses):
+        self.reaction_ids = list(reaction_ids)
+        self.objective_values = objective_values
+        self.fluxes = fluxes
+        self.statuses = statuses
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.fluxes, columns=self.reaction_ids)
+
+
+def condition_bounds(conditions, reaction_ids=None):
+    """
+    Yield one ``{reaction_id: (lower, upper)}`` override dict per condition.
+
+    ``conditions`` is either a list of such dicts, or an array of shape
+    (conditions, len(reaction_ids), 2) holding the bound pairs of
+    ``reaction_ids`` for every condition.
+    """
+    if reaction_ids is None:
+        for overrides in conditions:
+            yield {reaction_id: tuple(bounds) for reaction_id, bounds in overrides.items()}
+        return
+    bounds = np.asarray(conditions, dtype=float)
+    if bounds.ndim != 3 or bounds.shape[1:] != (len(reaction_ids), 2):
+        raise ValueError('expected bounds of shape (conditions, {}, 2), got {}'.format(
+            len(reaction_ids), bounds.shape))
+    for row in bounds.tolist():
+        yield dict(zip(reaction_ids, map(tuple, row)))
+
+
+def solve_conditions(model, conditions, reaction_ids=None, flux_reader=None, lp=None):
+    """
+    Solve ``model`` once per condition of ``conditions`` (see condition_bounds)
+    and return a BatchSolution.
+
+    Bound changes are made inside the model's context, so the model gets its
+    original bounds back afterwards. Each condition only touches the bounds
+    that differ from the previous one, and the LP is warm-started from the
+    previous condition's basis, so scans over neighbouring bounds cost a few
+    pivots per condition. ``lp`` is a WarmStartLP of ``model`` to solve
+    with; callers that solve a batch every timestep pass the same one, so
+    that the first condition starts from the last basis of the previous
+    batch instead of cold.
+    """
+    flux_reader = flux_reader or FluxReader(model)
+    overrides = list(condition_bounds(conditions, reaction_ids))
+    objective_values = np.full(len(overrides), np.nan)
+    fluxes = np.full((len(overrides), len(flux_reader.reaction_ids)), np.nan)
+    statuses = []
+    if lp is None:
+        lp = WarmStartLP(model)
+    with model:
+        solver_bounds = SolverBounds(model)
+        original = solver_bounds.applied.copy()
+        previous = {}
+        for index, bounds in enumerate(overrides):
+            # overrides of the previous condition that this one does not set go back to the original
+            target = {
+                reaction_id: original[reaction_id]
+                for reaction_id in previous if reaction_id not in bounds}
+            target.update(bounds)
+            solver_bounds.apply(target)
+            previous = bounds
+            status = lp.solve()
+            statuses.append(status)
+            if status == OPTIMAL:
+                objective_values[index] = model.solver.objective.value
+                fluxes[index] = flux_reader.read()
+    return BatchSolution(flux_reader.reaction_ids, objective_values, fluxes, statuses)
+
+
+class FluxPiece:
+    """
+    The LP solution as an affine function of the lower bounds ``b`` of a few
+    reactions, over the region where the optimal basis found at ``b0`` stays
+    feasible.
+
+    The solver's primal values are ``primals + slopes @ (b - b0)`` and the
+    objective ``objective + objective_slopes @ (b - b0)``. The distance of the
+    basic variables to their bounds, ``slack + slack_slopes @ (b - b0)``, is
+    what tells that ``b`` left the region: the objective and the constraint
+    matrix do not depend on ``b``, so the basis stays optimal for as long as
+    it stays primal feasible. ``ahead`` is False when the LP turns infeasible
+    within ``delta`` of ``b0`` towards less uptake. A piece with ``feasible``
+    False stands for an infeasible LP (the population starves), which stays
+    infeasible for every ``b`` that allows no more uptake than ``b0``.
+    """
+
+    def __init__(self, lower_bounds, primals, slopes, objective, objective_slopes,
+                 slack, slack_slopes, feasible=True, ahead=True):
+        self.lower_bounds = lower_bounds
+        self.primals = primals
+        self.slopes = slopes
+        self.objective = objective
+        self.objective_slopes = objective_slopes
+        self.slack = slack
+        self.slack_slopes = slack_slopes
+        self.feasible = feasible
+        self.ahead = ahead
+
+    @classmethod
+    def infeasible(cls, lower_bounds, variables):
+        k = len(lower_bounds)
+        return cls(
+            lower_bounds, np.zeros(variables), np.zeros((variables, k)), 0.0, np.zeros(k),
+            np.zeros(k), np.eye(k), feasible=False, ahead=False)
+
+    def primals_at(self, lower_bounds):
+        return self.primals + self.slopes @ (lower_bounds - self.lower_bounds)
+
+    def objective_at(self, lower_bounds):
+        return self.objective + self.objective_slopes @ (lower_bounds - self.lower_bounds)
+
+    def min_slack(self, lower_bounds):
+        if not len(self.slack):
+            return np.inf
+        return (self.slack + self.slack_slopes @ (lower_bounds - self.lower_bounds)).min()
+
+    def contains(self, lower_bounds, tolerance):
+        return self.min_slack(lower_bounds) >= -tolerance
+
+
+class ParametricLP:
+    """
+    Solves a model's LP for the lower bounds of ``reaction_ids`` and returns
+    the FluxPiece of the basis it ends in.
+
+    The slopes of the piece come from one more warm-started solve per
+    reaction, ``delta`` towards less uptake (or more, when that one is
+    infeasible). Between the two solves the dual simplex keeps the basis
+    unless it is no longer feasible, so the slopes are those of the basis
+    that holds as the bounds move on. Reaction lower bounds are taken to be
+    at most zero, as uptake bounds are.
+    """
+
+    def __init__(self, model, reaction_ids, delta=1e-3, zero_slope=1e-8):
+        self.model = model
+        self.reactions = [model.reactions.get_by_id(reaction_id) for reaction_id in reaction_ids]
+        self.reaction_ids = [reaction.id for reaction in self.reactions]
+        self.delta = delta
+        self.zero_slope = zero_slope
+        self.variables = list(model.solver.variables)
+        position = {variable.name: index for index, variable in enumerate(self.variables)}
+        self.reverse = np.array([position[reaction.reverse_id] for reaction in self.reactions], dtype=np.intp)
+        self.lp = WarmStartLP(model)
+
+    @property
+    def solves(self):
+        return self.lp.solves
+
+    def _solve(self, lower_bounds):
+        for reaction, lower_bound in zip(self.reactions, lower_bounds.tolist()):
+            reaction.lower_bound = lower_bound
+        if self.lp.solve() != OPTIMAL:
+            return None
+        primals = get_primal_values(self.model)
+        return primals, self.model.solver.objective.value
+
+    def piece(self, lower_bounds):
+        """The FluxPiece of the LP at ``lower_bounds``; the solver is left at these bounds."""
+        lower_bounds = np.array(lower_bounds, dtype=float)
+        solution = self._solve(lower_bounds)
+        if solution is None:
+            return FluxPiece.infeasible(lower_bounds, len(self.variables))
+        primals, objective = solution
+
+        slopes = np.zeros((len(primals), len(lower_bounds)))
+        objective_slopes = np.zeros(len(lower_bounds))
+        ahead = True
+        for index in range(len(lower_bounds)):
+            for delta in (self.delta, -self.delta):
+                moved = lower_bounds.copy()
+                moved[index] += delta
+                solution = self._solve(moved)
+                if solution is not None:
+                    slopes[:, index] = (solution[0] - primals) / delta
+                    objective_slopes[index] = (solution[1] - objective) / delta
+                    break
+                ahead = False
+        self._solve(lower_bounds)
+
+        lower = np.array([variable.lb if variable.lb is not None else -np.inf for variable in self.variables])
+        upper = np.array([variable.ub if variable.ub is not None else np.inf for variable in self.variables])
+        # the upper bound of each reverse variable is minus the reaction's lower bound
+        upper_slopes = np.zeros_like(slopes)
+        upper_slopes[self.reverse, np.arange(len(lower_bounds))] = -1.0
+        slack = np.concatenate([primals - lower, upper - primals])
+        slack_slopes = np.concatenate([slopes, upper_slopes - slopes])
+        slack_slopes[np.abs(slack_slopes) < self.zero_slope] = 0.0
+        moving = np.isfinite(slack) & slack_slopes.any(axis=1)
+        return FluxPiece(
+            lower_bounds, primals, slopes, objective, objective_slopes,
+            slack[moving], slack_slopes[moving], ahead=ahead)
+
+
+def test_warm_start_lp():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    model = load_model(model_path)
+    reference = load_model(model_path)
+    lp = WarmStartLP(model)
+    for lower_bound in [-10.0, -9.5, -8.0, -3.0, -0.5]:
+        model.reactions.get_by_id("EX_glc__D_e").lower_bound = lower_bound
+        reference.reactions.get_by_id("EX_glc__D_e").lower_bound = lower_bound
+        solution = lp.optimize()
+        assert abs(solution.objective_value - reference.slim_optimize()) < 1e-9
+    stats = lp.statistics()
+    assert stats['cold_solves'] == 1 and stats['warm_solves'] == 4
+    # the model's own simplex method is left as it was
+    if lp.glpk:
+        assert model.solver.configuration._smcp.meth == reference.solver.configuration._smcp.meth
+
+    # an infeasible warm re-solve falls back to a cold solve
+    model.reactions.get_by_id("ATPM").lower_bound = 500.0
+    assert lp.solve() != OPTIMAL
+    assert lp.statistics()['fallbacks'] == 1
+    model.reactions.get_by_id("ATPM").lower_bound = 8.39
+    assert lp.solve() == OPTIMAL
+
+
+def test_solver_state():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    model = load_model(model_path)
+    solver_bounds = SolverBounds(model)
+    bounds = BoundsArray.from_model(model)
+    bounds.update({"EX_glc__D_e": (-4.0, 1000.0)})
+    solver_bounds.apply(bounds)
+    lp = WarmStartLP(model)
+    lp.solve()
+    state = solver_state(solver_bounds, lp)
+
+    restored = load_model(model_path)
+    restored_lp = WarmStartLP(restored)
+    restore_solver_state(SolverBounds(restored), state, restored_lp)
+    assert restored.reactions.get_by_id("EX_glc__D_e").lower_bound == -4.0
+    assert restored_lp.statistics() == lp.statistics()
+    # the next solve starts from the saved optimal basis
+    restored_lp.solve()
+    assert restored_lp.iterations == lp.iterations
+    assert abs(restored.solver.objective.value - model.slim_optimize()) < 1e-9
+
+def test_solution_cache():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    model = load_model(model_path)
+    cache = SolutionCache(BoundsArray.from_model(model), maxsize=2, tolerance=1e-6)
+    bounds = BoundsArray.from_model(model)
+    key, solution = cache.lookup(bounds)
+    assert solution is None and key == cache.key(BoundsArray.from_model(model))
+    cache.store(key, 0.87, np.ones(3))
+
+    bounds.update({"EX_glc__D_e": (-10.0 + 1e-8, 1000.0)})  # within the tolerance
+    assert cache.lookup(bounds)[1][0] == 0.87
+    bounds.update({"EX_glc__D_e": (-5.0, 1000.0)})
+    key, solution = cache.lookup(bounds)
+    assert solution is None
+    cache.store(key, 0.4, np.zeros(3))
+    bounds.update({"EX_glc__D_e": (-4.0, 1000.0)})
+    cache.store(cache.lookup(bounds)[0], 0.3, np.zeros(3))
+    # the least recently used entry, at the model's bounds, was evicted
+    assert cache.lookup(BoundsArray.from_model(model))[1] is None
+    assert cache.statistics() == {'hits': 1, 'misses': 4, 'hit_rate': 0.2, 'size': 2}
+
+    shared = solution_cache(model_path, model, ['EX_glc__D_e'], {'shared': True, 'maxsize': 8})
+    assert solution_cache(model_path, load_model(model_path), ['EX_glc__D_e'], {'shared': True}) is shared
+    assert solution_cache(model_path, model, ['EX_glc__D_e'], True) is not shared
+    assert solution_cache(model_path, model, ['EX_glc__D_e'], None) is None
+
+def test_flux_reader():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    solution = model.optimize()
+    everything = FluxReader(model)
+    everything.read()
+    assert everything.to_dict() == solution.fluxes.to_dict()
+    assert get_primal_values(model).tolist() == list(model.solver.primal_values.values())
+
+    subset = FluxReader(model, ["EX_glc__D_e", "BIOMASS_Ecoli_core_w_GAM"])
+    subset.read()
+    assert subset.to_dict() == {
+        "EX_glc__D_e": solution.fluxes["EX_glc__D_e"],
+        "BIOMASS_Ecoli_core_w_GAM": solution.fluxes["BIOMASS_Ecoli_core_w_GAM"]}
+
+
+def test_solve_conditions():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    reference = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    uptakes = [-10.0, -8.0, -5.0, -2.0, -1.0]
+    batch = solve_conditions(
+        model, [[[uptake, 1000.0]] for uptake in uptakes], reaction_ids=["EX_glc__D_e"])
+    assert batch.fluxes.shape == (len(uptakes), len(model.reactions))
+    for index, uptake in enumerate(uptakes):
+        reference.reactions.get_by_id("EX_glc__D_e").lower_bound = uptake
+        assert abs(batch.objective_values[index] - reference.slim_optimize()) < 1e-9
+    assert batch.fluxes[2, batch.reaction_ids.index("EX_glc__D_e")] == -5.0
+    assert model.reactions.get_by_id("EX_glc__D_e").bounds == (-10.0, 1000.0)
+
+    # overrides only last for their own condition, and failures stay in their row
+    batch = solve_conditions(model, [{"EX_o2_e": (0.0, 1000.0)}, {"ATPM": (500.0, 1000.0)}, {}])
+    assert batch.statuses[1] != OPTIMAL and np.isnan(batch.fluxes[1]).all()
+    assert abs(batch.objective_values[2] - model.slim_optimize()) < 1e-9
+    assert batch.objective_values[0] < batch.objective_values[2]
+
+    # a WarmStartLP passed from batch to batch starts the next batch warm
+    lp = WarmStartLP(model)
+    for uptakes in ([-10.0, -9.0], [-8.0, -7.0]):
+        batch = solve_conditions(model, [[[uptake, 1000.0]] for uptake in uptakes], ["EX_glc__D_e"], lp=lp)
+        assert all(status == OPTIMAL for status in batch.statuses)
+    assert lp.cold_solves == 1 and lp.warm_solves == 3
+
+
+def test_parametric_lp():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    reference = load_model(os.path.join(current_dir, "../data/e_coli_core.xml"))
+    parametric = ParametricLP(model, ["EX_glc__D_e"])
+    piece = parametric.piece([-10.0])
+    assert piece.feasible and piece.ahead
+    for uptake in [-9.0, -5.0, -2.0]:
+        # one basis holds from -10 down to about -1.77
+        assert piece.contains(np.array([uptake]), 1e-6)
+        reference.reactions.get_by_id("EX_glc__D_e").lower_bound = uptake
+        assert abs(piece.objective_at(np.array([uptake])) - reference.slim_optimize()) < 1e-9
+    assert not piece.contains(np.array([-1.0]), 1e-6)
+    assert not parametric.piece([-0.1]).feasible
@@ -0,0 +1,103 @@
+"""
+======
+Medium
+======
+Array-backed store of the exchange metabolites in an environment shared by
+several species.
+"""
+
+import numpy as np
+from vivarium.core.registry import Serializer
+
+
+class Medium:
+    """
+    Concentrations of the shared exchange metabolites, keyed by exchange ID.
+
+    ``exchange_ids`` fixes the order of ``concentrations`` and never changes.
+    Species address the medium through ``positions``, so their per-step
+    reads and writes are array operations over a fixed index array.
+    """
+
+    def __init__(self, exchange_ids, concentrations, index=None):
+        self.exchange_ids = tuple(exchange_ids)
+        self.index = index if index is not None else {
+            exchange_id: position for position, exchange_id in enumerate(self.exchange_ids)}
+        self.concentrations = np.array(concentrations, dtype=float)
+
+    @classmethod
+    def from_dict(cls, concentrations):
+        return cls(concentrations.keys(), list(concentrations.values()))
+
+    def to_dict(self):
+        return dict(zip(self.exchange_ids, self.concentrations.tolist()))
+
+    def copy(self):
+        return Medium(self.exchange_ids, self.concentrations, index=self.index)
+
+    def positions(self, exchange_ids):
+        return np.array([self.index[exchange_id] for exchange_id in exchange_ids], dtype=np.intp)
+
+    def add(self, delta):
+        """
+        Add ``delta`` in place, either a ``{exchange_id: delta}`` dict or an
+        array over all exchanges.
+        """
+        if isinstance(delta, dict):
+            if not delta:
+                return
+            self.concentrations[self.positions(delta)] += np.fromiter(
+                delta.values(), dtype=float, count=len(delta))
+        else:
+            self.concentrations += delta
+
+    def __len__(self):
+        return len(self.exchange_ids)
+
+    def __contains__(self, exchange_id):
+        return exchange_id in self.index
+
+    def __iter__(self):
+        return iter(self.exchange_ids)
+
+    def __getitem__(self, exchange_id):
+        return float(self.concentrations[self.index[exchange_id]])
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if not isinstance(other, Medium):
+            return NotImplemented
+        return (self.exchange_ids == other.exchange_ids
+                and np.array_equal(self.concentrations, other.concentrations))
+
+    def __repr__(self):
+        return 'Medium({})'.format(self.to_dict())
+
+
+def update_medium(current_value, new_value):
+    """Updater for Medium stores: adds the (partial) deltas of ``new_value`` in place."""
+    if not isinstance(current_value, Medium):
+        current_value = Medium.from_dict(current_value)
+    current_value.add(new_value)
+    return current_value
+
+
+class MediumSerializer(Serializer):
+    """Emits a Medium as ``{exchange_id: concentration}``."""
+    python_type = Medium
+
+    def serialize(self, data):
+        return data.to_dict()
+
+
+def test_medium():
+    medium = Medium.from_dict({'EX_glc__D_e': 11.1, 'EX_ac_e': 0.0})
+    assert list(medium.positions(['EX_ac_e'])) == [1]
+    update_medium(medium, {'EX_glc__D_e': -1.1, 'EX_ac_e': 0.5})
+    assert medium.to_dict() == {'EX_glc__D_e': 10.0, 'EX_ac_e': 0.5}
+    update_medium(medium, {'EX_ac_e': -0.5})
+    assert medium['EX_ac_e'] == 0.0
+    update_medium(medium, np.array([1.0, 1.0]))
+    assert MediumSerializer().serialize(medium) == {'EX_glc__D_e': 11.0, 'EX_ac_e': 1.0}
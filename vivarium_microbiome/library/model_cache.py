@@ -0,0 +1,217 @@
+"""
+===========
+Model Cache
+===========
+On-disk cache of compiled SBML models. For every model file it keeps
+
+* ``<name>-<hash>.npz``: the stoichiometric matrix, the bounds arrays, the
+  reaction/metabolite IDs and the objective vector, which is all that
+  ReactionBounds needs to start.
+* ``<name>-<hash>.pkl``: the pickled COBRA model, which loads much faster
+  than libSBML can parse the XML.
+
+Entries are keyed by a hash of the file content (and the cobra version), so
+an edited model file gets a new entry instead of a stale one. The hash of a
+file is computed again only when its modification time or size changes. The
+cache directory is ``$VIVARIUM_MICROBIOME_CACHE`` or
+``~/.cache/vivarium_microbiome``.
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import cobra
+from cobra.io import read_sbml_model
+from cobra.util import create_stoichiometric_matrix
+
+from vivarium_microbiome.library.profiling import phase
+
+
+CACHE_VERSION = 1
+CACHE_ENV = 'VIVARIUM_MICROBIOME_CACHE'
+
+
+def cache_directory(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_ENV) or os.path.join(
+            os.path.expanduser('~'), '.cache', 'vivarium_microbiome')
+    return cache_dir
+
+
+def file_hash(model_file):
+    """Return the content hash that keys the cache entries of ``model_file``."""
+    path = os.path.abspath(model_file)
+    stat = os.stat(path)
+    return _content_hash(path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def _content_hash(model_file, mtime, size):
+    digest = hashlib.sha256()
+    digest.update('{}:{}:'.format(CACHE_VERSION, cobra.__version__).encode())
+    with open(model_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(model_file, extension, cache_dir=None):
+    stem = os.path.splitext(os.path.basename(model_file))[0]
+    name = '{}-{}.{}'.format(stem, file_hash(model_file)[:16], extension)
+    return os.path.join(cache_directory(cache_dir), name)
+
+
+def _write_atomic(path, write):
+    """Write ``path`` through a temporary file so concurrent readers never see a partial entry."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class CompiledModel:
+    """
+    Array form of a COBRA model.
+
+    Holds the reaction and metabolite IDs, the stoichiometric matrix
+    (metabolites x reactions), the lower/upper bound arrays and the objective
+    coefficients, all in the reaction order of the source model.
+    """
+
+    def __init__(self, reaction_ids, metabolite_ids, stoichiometry,
+                 lower_bounds, upper_bounds, objective):
+        self.reaction_ids = list(reaction_ids)
+        self.metabolite_ids = list(metabolite_ids)
+        self.stoichiometry = stoichiometry
+        self.lower_bounds = lower_bounds
+        self.upper_bounds = upper_bounds
+        self.objective = objective
+        self.reaction_index = {
+            reaction_id: index for index, reaction_id in enumerate(self.reaction_ids)}
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(
+            reaction_ids=[reaction.id for reaction in model.reactions],
+            metabolite_ids=[metabolite.id for metabolite in model.metabolites],
+            stoichiometry=create_stoichiometric_matrix(model),
+            lower_bounds=np.array([reaction.lower_bound for reaction in model.reactions], dtype=float),
+            upper_bounds=np.array([reaction.upper_bound for reaction in model.reactions], dtype=float),
+            objective=np.array([reaction.objective_coefficient for reaction in model.reactions], dtype=float),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                reaction_ids=data['reaction_ids'].tolist(),
+                metabolite_ids=data['metabolite_ids'].tolist(),
+                stoichiometry=data['stoichiometry'],
+                lower_bounds=data['lower_bounds'],
+                upper_bounds=data['upper_bounds'],
+                objective=data['objective'],
+            )
+
+    def save(self, f):
+        np.savez_compressed(
+            f,
+            reaction_ids=np.array(self.reaction_ids),
+            metabolite_ids=np.array(self.metabolite_ids),
+            stoichiometry=self.stoichiometry,
+            lower_bounds=self.lower_bounds,
+            upper_bounds=self.upper_bounds,
+            objective=self.objective,
+        )
+
+    def bounds(self):
+        """Return the bounds as a ``{reaction_id: (lower_bound, upper_bound)}`` dict."""
+        return {
+            reaction_id: (float(lower), float(upper))
+            for reaction_id, lower, upper in zip(
+                self.reaction_ids, self.lower_bounds, self.upper_bounds)}
+
+
+def read_cached_model(model_file, cache_dir=None):
+    """
+    Return the COBRA model of ``model_file``, loading the pickled copy from
+    the cache when there is one and parsing (and caching) the SBML otherwise.
+    """
+    path = cache_path(model_file, 'pkl', cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    with phase('read_sbml', 'models'):
+        model = read_sbml_model(model_file)
+    try:
+        _write_atomic(path, lambda f: pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass  # a read-only cache only costs us the speed-up
+    return model
+
+
+def load_compiled_model(model_file, cache_dir=None):
+    """Return the CompiledModel of ``model_file``, compiling and caching it on a miss."""
+    with phase('load_compiled_model', 'models'):
+        path = cache_path(model_file, 'npz', cache_dir)
+        try:
+            return CompiledModel.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+        # imported here because the registry itself reads models through this module
+        from vivarium_microbiome.library.model_registry import load_model
+        compiled = CompiledModel.from_model(load_model(model_file, copy=False))
+        try:
+            _write_atomic(path, compiled.save)
+        except OSError:
+            pass
+        return compiled
+
+
+def clear_cache(cache_dir=None):
+    """Remove every cached entry from the cache directory."""
+    directory = cache_directory(cache_dir)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith(('.npz', '.pkl')):
+            os.remove(os.path.join(directory, name))
+
+
+def test_compiled_model(tmp_path):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    compiled = load_compiled_model(model_path, cache_dir=str(tmp_path))
+    assert os.path.exists(cache_path(model_path, 'npz', str(tmp_path)))
+
+    cached = load_compiled_model(model_path, cache_dir=str(tmp_path))
+    assert cached.reaction_ids == compiled.reaction_ids
+    assert cached.stoichiometry.shape == (len(cached.metabolite_ids), len(cached.reaction_ids))
+    assert np.array_equal(cached.lower_bounds, compiled.lower_bounds)
+    assert cached.bounds()['EX_glc__D_e'] == (-10.0, 1000.0)
+    assert cached.objective[cached.reaction_index['BIOMASS_Ecoli_core_w_GAM']] == 1.0
+
+    model = read_cached_model(model_path, cache_dir=str(tmp_path))
+    assert os.path.exists(cache_path(model_path, 'pkl', str(tmp_path)))
+    assert read_cached_model(model_path, cache_dir=str(tmp_path)).slim_optimize() == model.slim_optimize()
+
+    # the hash is computed again only when the file changes
+    copy = tmp_path / 'model.xml'
+    copy.write_bytes(open(model_path, 'rb').read())
+    hits = _content_hash.cache_info().hits
+    assert file_hash(str(copy)) == file_hash(model_path)
+    assert _content_hash.cache_info().hits == hits + 1
+    with open(copy, 'ab') as f:
+        f.write(b'\n')
+    assert file_hash(str(copy)) != file_hash(model_path)
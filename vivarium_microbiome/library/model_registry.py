@@ -0,0 +1,69 @@
+"""
+==============
+Model Registry
+==============
+Process-wide registry of parsed COBRA models. Every ReactionBounds,
+DynamicFBA and FBA process reads the same SBML file, so the file is
+parsed once per process and later requests get a copy (or the shared
+instance) of the parsed model. Parsing itself goes through the on-disk
+cache in model_cache, so a fresh worker usually skips libSBML as well.
+"""
+
+import os
+import threading
+
+from vivarium_microbiome.library.model_cache import read_cached_model
+from vivarium_microbiome.library.profiling import phase
+
+
+_models = {}
+_lock = threading.Lock()
+
+
+def model_key(model_file):
+    """Return the registry key of a model file: its absolute path, mtime and size."""
+    path = os.path.abspath(model_file)
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+def load_model(model_file, copy=True):
+    """
+    Return the COBRA model stored in ``model_file``.
+
+    The file is parsed only the first time it is requested (or after it
+    changes on disk). With ``copy=True`` the caller gets its own copy that
+    it may modify freely; with ``copy=False`` it gets the shared instance,
+    which must be treated as read-only.
+    """
+    with phase('load_model', 'models'):
+        key = model_key(model_file)
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                for stale in [k for k in _models if k[0] == key[0]]:
+                    del _models[stale]
+                model = read_cached_model(key[0])
+                _models[key] = model
+        if copy:
+            return model.copy()
+        return model
+
+
+def clear_models():
+    """Drop every model held by the registry."""
+    with _lock:
+        _models.clear()
+
+
+def test_load_model():
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    clear_models()
+    shared = load_model(model_path, copy=False)
+    assert load_model(model_path, copy=False) is shared
+
+    model = load_model(model_path)
+    assert model is not shared
+    model.reactions.get_by_id("EX_glc__D_e").lower_bound = -1.0
+    assert shared.reactions.get_by_id("EX_glc__D_e").lower_bound == -10.0
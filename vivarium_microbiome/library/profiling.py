@@ -0,0 +1,223 @@
+"""
+=========
+Profiling
+=========
+Opt-in timing instrumentation for composite runs.
+
+A Profiler records the wall time, the call count and, with
+``memory=True``, the net memory allocated (traced with tracemalloc) of
+every phase of a run, per process:
+
+* ``instrument_processes`` wraps the ``next_update`` of every process of a
+  composite (phase ``next_update``). DynamicFBA splits its update further
+  into ``apply_bounds``, ``solve``, ``read_fluxes`` and ``to_dict``.
+* ``instrument_engine`` wraps the Engine's state views (``view``), its
+  store updates (``apply_update``) and the emitter (``emit`` and
+  ``get_data``), which are recorded under ``engine``.
+* while the profiler is started, model loading is recorded under
+  ``models`` (``load_model``, ``read_sbml`` and ``load_compiled_model``).
+
+Phases nest: a phase opened inside a process's ``next_update`` belongs to
+that process, and its time is also part of the ``next_update``. ``stop()``
+prints the summary table, and with ``trace`` set writes every call as a
+Chrome trace, which chrome://tracing, Perfetto and speedscope open.
+Processes run with ``_parallel`` compute their updates in another OS
+process, so only their phases on the Engine's side are recorded. Each
+thread nests its own phases, so the phases of solves on a thread executor
+(see library.dispatch) are recorded under ``main``.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+_active = None
+_inactive = contextlib.nullcontext()
+
+
+def phase(name, owner=None):
+    """
+    A context manager that records ``name`` in the started profiler, if
+    any. ``owner`` defaults to the process whose update is running, or
+    ``main`` outside of process updates.
+    """
+    if _active is None:
+        return _inactive
+    return _active.phase(name, owner)
+
+
+class Profiler:
+    """Per-process, per-phase wall time, call count and allocation of a run."""
+
+    def __init__(self, memory=False, trace=None, print_summary=True):
+        self.memory = memory
+        self.trace = trace  # path of the Chrome trace file, or None
+        self.print_summary = print_summary
+        self.stats = {}  # (owner, phase): [calls, seconds, net bytes]
+        self.events = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.start_time = None
+        self.wall_time = None
+        self._started_tracemalloc = False
+
+    @classmethod
+    def from_config(cls, option):
+        """A Profiler from a ``config['main']['profile']`` value: None, True, a dict of parameters or a Profiler."""
+        if not option:
+            return None
+        if isinstance(option, Profiler):
+            return option
+        return cls(**({} if option is True else option))
+
+    def start(self):
+        global _active
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.start_time = time.perf_counter()
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        self.wall_time = time.perf_counter() - self.start_time
+        if _active is self:
+            _active = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if self.trace:
+            self.write_trace(self.trace)
+        if self.print_summary:
+            print(self.format_summary())
+        return self
+
+    @property
+    def owners(self):
+        """The owners of the open phases of the calling thread."""
+        owners = getattr(self._local, 'owners', None)
+        if owners is None:
+            owners = self._local.owners = []
+        return owners
+
+    @contextlib.contextmanager
+    def phase(self, name, owner=None):
+        if owner is None:
+            owner = self.owners[-1] if self.owners else 'main'
+        self.owners.append(owner)
+        memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.owners.pop()
+            allocated = tracemalloc.get_traced_memory()[0] - memory if self.memory else 0
+            with self._lock:
+                stats = self.stats.get((owner, name))
+                if stats is None:
+                    stats = self.stats[(owner, name)] = [0, 0.0, 0]
+                stats[0] += 1
+                stats[1] += end - start
+                stats[2] += allocated
+                if self.trace:
+                    self.events.append((owner, name, start, end))
+
+    def wrap(self, function, name, owner):
+        def wrapped(*args, **kwargs):
+            with self.phase(name, owner):
+                return function(*args, **kwargs)
+        return wrapped
+
+    def instrument_processes(self, processes, prefix=()):
+        """Wrap the ``next_update`` of every process in the (nested) ``processes`` dict."""
+        for name, process in processes.items():
+            path = prefix + (name,)
+            if isinstance(process, dict):
+                self.instrument_processes(process, path)
+            elif not process.parameters.get('_parallel', False):
+                process.next_update = self.wrap(process.next_update, 'next_update', '/'.join(path))
+
+    def instrument_engine(self, engine):
+        """Wrap the state views, store updates and emitter of an Engine."""
+        engine._process_state = self.wrap(engine._process_state, 'view', 'engine')
+        engine.apply_update = self.wrap(engine.apply_update, 'apply_update', 'engine')
+        engine.emitter.emit = self.wrap(engine.emitter.emit, 'emit', 'engine')
+        engine.emitter.get_data = self.wrap(engine.emitter.get_data, 'get_data', 'engine')
+
+    def summary(self):
+        """One row per process and phase, the most expensive first."""
+        wall_time = self.wall_time or sum(seconds for _, seconds, _ in self.stats.values())
+        rows = []
+        for (owner, name), (calls, seconds, allocated) in self.stats.items():
+            row = {
+                'process': owner,
+                'phase': name,
+                'calls': calls,
+                'seconds': seconds,
+                'mean_ms': 1000 * seconds / calls,
+                'percent': 100 * seconds / wall_time if wall_time else 0.0,
+            }
+            if self.memory:
+                row['allocated_mib'] = allocated / 2 ** 20
+            rows.append(row)
+        return sorted(rows, key=lambda row: -row['seconds'])
+
+    def format_summary(self):
+        lines = ['{:30s} {:20s} {:>8s} {:>10s} {:>10s} {:>7s}{}'.format(
+            'process', 'phase', 'calls', 'seconds', 'mean ms', '%', ' {:>10s}'.format('MiB') if self.memory else '')]
+        for row in self.summary():
+            lines.append('{:30s} {:20s} {:8d} {:10.4f} {:10.4f} {:7.1f}{}'.format(
+                row['process'], row['phase'], row['calls'], row['seconds'], row['mean_ms'], row['percent'],
+                ' {:10.3f}'.format(row['allocated_mib']) if self.memory else ''))
+        if self.wall_time is not None:
+            lines.append('wall time {:.4f} s'.format(self.wall_time))
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write the recorded calls as complete ("X") events of the Chrome trace format."""
+        pid = os.getpid()
+        events = [{
+            'name': '{}.{}'.format(owner, name),
+            'cat': owner,
+            'ph': 'X',
+            'ts': (start - self.start_time) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': pid,
+            'tid': 0,
+            'args': {'process': owner},
+        } for owner, name, start, end in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def test_profiler(tmp_path):
+    class Adder:
+        parameters = {}
+
+        def next_update(self, timestep, state):
+            with phase('inner'):
+                return {'x': state['x'] + timestep}
+
+    processes = {'outer': {'Adder': Adder()}}
+    profiler = Profiler(memory=True, trace=str(tmp_path / 'trace.json'), print_summary=False)
+    profiler.instrument_processes(processes)
+    profiler.start()
+    for _ in range(3):
+        assert processes['outer']['Adder'].next_update(1, {'x': 1}) == {'x': 2}
+    profiler.stop()
+    with phase('inner'):
+        pass  # not recorded once stopped
+
+    rows = {(row['process'], row['phase']): row for row in profiler.summary()}
+    assert set(rows) == {('outer/Adder', 'next_update'), ('outer/Adder', 'inner')}
+    assert rows[('outer/Adder', 'inner')]['calls'] == 3
+    assert rows[('outer/Adder', 'inner')]['seconds'] <= rows[('outer/Adder', 'next_update')]['seconds']
+    with open(tmp_path / 'trace.json') as f:
+        trace = json.load(f)
+    assert len(trace['traceEvents']) == 6
@@ -0,0 +1,132 @@
+"""
+==============
+Random Streams
+==============
+Seeded, per-process streams of random samples.
+
+A RandomStream owns a NumPy ``Generator`` and draws its samples
+``chunk_size`` at a time, so a process that needs one sample per timestep
+does not call into the generator on every update. The distribution is a
+name from DISTRIBUTIONS (``uniform``, ``beta``, ``normal``, ``lognormal``,
+``triangular``) with its NumPy parameters, or a function
+``sample(generator, size, **parameters)`` returning an array;
+``register_distribution`` adds one under a name.
+
+``seed`` is anything ``numpy.random.SeedSequence`` takes: an int, a list
+of ints (e.g. ``[sweep_seed, run]`` for one independent stream per run of
+a sweep) or a SeedSequence. With ``seed=None`` the seed is drawn from
+Python's global ``random``, so a ``random.seed()`` call still makes a
+whole run reproducible. A stream pickles with its generator state, so
+checkpoints resume it where it stopped.
+"""
+
+import random
+
+import numpy as np
+
+
+def _uniform(generator, size, low=0.0001, high=1.0):
+    return generator.uniform(low, high, size)
+
+
+def _beta(generator, size, a=1.0, b=1.0):
+    return generator.beta(a, b, size)
+
+
+def _normal(generator, size, loc=0.0, scale=1.0):
+    return generator.normal(loc, scale, size)
+
+
+def _lognormal(generator, size, mean=0.0, sigma=1.0):
+    return generator.lognormal(mean, sigma, size)
+
+
+def _triangular(generator, size, left=0.0001, mode=0.5, right=1.0):
+    return generator.triangular(left, mode, right, size)
+
+
+DISTRIBUTIONS = {
+    'uniform': _uniform,
+    'beta': _beta,
+    'normal': _normal,
+    'lognormal': _lognormal,
+    'triangular': _triangular,
+}
+
+
+def register_distribution(name, sample):
+    DISTRIBUTIONS[name] = sample
+
+
+def resolve_seed(seed=None):
+    """``seed``, or a 64-bit seed drawn from Python's global ``random`` if it is None."""
+    if seed is None:
+        return random.getrandbits(64)
+    return seed
+
+
+class RandomStream:
+    """Samples of one distribution from a seeded Generator, drawn ``chunk_size`` at a time."""
+
+    def __init__(self, seed=None, distribution='uniform', parameters=None, chunk_size=1024):
+        if isinstance(distribution, str) and distribution not in DISTRIBUTIONS:
+            raise ValueError('unknown distribution {!r}, expected one of {}'.format(
+                distribution, sorted(DISTRIBUTIONS)))
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        self.seed = resolve_seed(seed)
+        self.distribution = distribution
+        self.parameters = dict(parameters or {})
+        self.chunk_size = chunk_size
+        self.generator = np.random.default_rng(self.seed)
+        self.block = np.empty(0)
+        self.position = 0
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """The stream of a process's ``seed``, ``distribution``, ``distribution_parameters`` and ``chunk_size``."""
+        return cls(
+            parameters.get('seed'), parameters.get('distribution', 'uniform'),
+            parameters.get('distribution_parameters'), parameters.get('chunk_size', 1024))
+
+    def sample(self, size):
+        """``size`` new samples straight from the generator, bypassing the block."""
+        sample = self.distribution
+        if isinstance(sample, str):
+            sample = DISTRIBUTIONS[sample]
+        return np.asarray(sample(self.generator, size, **self.parameters), dtype=float)
+
+    def refill(self):
+        self.block = self.sample(self.chunk_size)
+        self.position = 0
+
+    def next(self):
+        """The next sample, as a float."""
+        if self.position == len(self.block):
+            self.refill()
+        value = self.block[self.position]
+        self.position += 1
+        return value.item()
+
+
+def test_random_stream():
+    first = RandomStream(seed=3, chunk_size=4)
+    samples = [first.next() for _ in range(10)]
+    assert all(0.0001 <= value < 1 for value in samples)
+    # the chunk size only changes how often the generator is called, not what it returns
+    other = RandomStream(seed=3, chunk_size=1000)
+    assert [other.next() for _ in range(10)] == samples
+    assert RandomStream(seed=[3, 1]).next() != samples[0]
+
+    random.seed(5)
+    seeded = RandomStream().next()
+    random.seed(5)
+    assert RandomStream().next() == seeded
+
+    beta = RandomStream(seed=0, distribution='beta', parameters={'a': 2, 'b': 5})
+    assert 0 < beta.next() < 1
+    register_distribution('constant', lambda generator, size, value=0.5: np.full(size, value))
+    try:
+        assert RandomStream(distribution='constant').next() == 0.5
+    finally:
+        del DISTRIBUTIONS['constant']
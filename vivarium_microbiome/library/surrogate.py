@@ -0,0 +1,368 @@
+"""
+=========
+Surrogate
+=========
+Flux tables: the FBA solution of a model as a piecewise-linear function of
+the lower bound of one exchange reaction, for dFBA runs whose only dynamic
+bound is that uptake.
+
+The objective and the fluxes are affine in the bound for as long as the
+optimal basis stays feasible (see library.lp.FluxPiece), so
+``build_flux_table`` walks the bound from the model's own lower bound
+towards zero one basis at a time with ParametricLP, recording the solution
+at both ends of every piece. Where the LP turns infeasible (an uptake too
+small for the maintenance requirement) it bisects the last feasible bound,
+and the table ends there.
+
+``check_flux_table`` compares the interpolated table with the LP at
+evenly spaced bounds and at the middle of every segment: the objective
+value, and whether the interpolated fluxes are a solution of the LP at all.
+The table keeps the largest errors it found, and ``build_flux_table`` adds
+the LP solution as a breakpoint wherever an error is above ``tolerance``
+until none is.
+``load_flux_table`` builds a table once per model file, exchange and set of
+build parameters and keeps it in the model cache directory, see
+library.model_cache.
+
+Evaluating a table is a binary search and one interpolation over the flux
+array, which takes microseconds; FluxSurrogate does it for DynamicFBA when
+the other reaction bounds are the model's own and the uptake bound is
+within the table, and leaves every other solve (an infeasible one
+included) to the LP.
+"""
+
+import hashlib
+import inspect
+import os
+
+import numpy as np
+from cobra.util import create_stoichiometric_matrix
+from optlang.interface import OPTIMAL
+
+from vivarium_microbiome.library.bounds import BoundsArray
+from vivarium_microbiome.library.lp import FluxReader, ParametricLP
+from vivarium_microbiome.library.model_cache import _write_atomic, cache_path
+from vivarium_microbiome.library.model_registry import load_model
+
+
+TABLE_VERSION = 1
+ERRORS = ('objective', 'residual', 'fluxes')
+
+
+class FluxTable:
+    """
+    The objective value and fluxes of ``reaction_ids`` at the increasing
+    ``breakpoints`` of an exchange's lower bound, interpolated linearly in
+    between. Above ``feasible_until`` the LP is infeasible.
+    """
+
+    def __init__(self, exchange_id, reaction_ids, breakpoints, objective, fluxes,
+                 feasible_until, max_error=None):
+        self.exchange_id = exchange_id
+        self.reaction_ids = list(reaction_ids)
+        self.breakpoints = np.asarray(breakpoints, dtype=float)
+        self.objective = np.asarray(objective, dtype=float)
+        self.fluxes = np.asarray(fluxes, dtype=float)
+        self.feasible_until = float(feasible_until)
+        self.max_error = max_error or {}
+
+    def __len__(self):
+        return len(self.breakpoints)
+
+    def evaluate(self, lower_bound):
+        """``(objective, fluxes)`` at ``lower_bound``, or None outside the table."""
+        breakpoints = self.breakpoints
+        if not breakpoints[0] <= lower_bound <= self.feasible_until or len(breakpoints) < 2:
+            return None
+        index = min(np.searchsorted(breakpoints, lower_bound, side='right') - 1, len(breakpoints) - 2)
+        width = breakpoints[index + 1] - breakpoints[index]
+        weight = (lower_bound - breakpoints[index]) / width if width > 0 else 0.0
+        objective = self.objective[index] + weight * (self.objective[index + 1] - self.objective[index])
+        fluxes = self.fluxes[index] + weight * (self.fluxes[index + 1] - self.fluxes[index])
+        return float(objective), fluxes
+
+    def insert(self, lower_bound, objective, fluxes):
+        index = np.searchsorted(self.breakpoints, lower_bound)
+        self.breakpoints = np.insert(self.breakpoints, index, lower_bound)
+        self.objective = np.insert(self.objective, index, objective)
+        self.fluxes = np.insert(self.fluxes, index, fluxes, axis=0)
+
+    def save(self, f):
+        np.savez_compressed(
+            f,
+            version=TABLE_VERSION,
+            exchange_id=self.exchange_id,
+            reaction_ids=np.array(self.reaction_ids),
+            breakpoints=self.breakpoints,
+            objective=self.objective,
+            fluxes=self.fluxes,
+            feasible_until=self.feasible_until,
+            max_error=np.array([self.max_error.get(name, np.nan) for name in ERRORS]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != TABLE_VERSION:
+                raise ValueError('{} is not a version {} flux table'.format(path, TABLE_VERSION))
+            return cls(
+                exchange_id=str(data['exchange_id']),
+                reaction_ids=data['reaction_ids'].tolist(),
+                breakpoints=data['breakpoints'],
+                objective=data['objective'],
+                fluxes=data['fluxes'],
+                feasible_until=float(data['feasible_until']),
+                max_error=dict(zip(ERRORS, data['max_error'].tolist())),
+            )
+
+
+def _lp_solution(model, flux_reader, exchange, lower_bound):
+    exchange.lower_bound = lower_bound
+    model.slim_optimize()
+    if model.solver.status != OPTIMAL:
+        return None
+    return model.solver.objective.value, flux_reader.read().copy()
+
+
+def check_flux_table(table, model, points=200):
+    """
+    Compares ``table`` with the LP of ``model`` at ``points`` evenly spaced
+    feasible bounds and at the middle of every segment. Returns the largest
+    errors, as ``{'objective': ..., 'residual': ..., 'fluxes': ...}``, and
+    the bounds with their LP solutions, as ``[(lower_bound, error,
+    objective, fluxes)]`` where ``error`` is the larger of the objective
+    error and the residual.
+
+    The residual is the largest mass imbalance or bound violation of the
+    interpolated fluxes, so where both errors are small the table's fluxes
+    are an optimal solution of the LP. They need not be the LP's own: with
+    alternative optima the solver's choice depends on where it starts, and
+    ``fluxes`` (their largest difference) can be large.
+    """
+    if table.reaction_ids != [reaction.id for reaction in model.reactions]:
+        raise ValueError('only a table of every reaction of {} can be checked'.format(model.id))
+    flux_reader = FluxReader(model)
+    exchange = model.reactions.get_by_id(table.exchange_id)
+    stoichiometry = create_stoichiometric_matrix(model)
+    lower = np.array([reaction.lower_bound for reaction in model.reactions], dtype=float)
+    upper = np.array([reaction.upper_bound for reaction in model.reactions], dtype=float)
+    position = table.reaction_ids.index(table.exchange_id)
+    start, stop = table.breakpoints[0], min(table.breakpoints[-1], table.feasible_until)
+    samples = np.concatenate([
+        np.linspace(start, stop, points),
+        (table.breakpoints[:-1] + table.breakpoints[1:]) / 2])
+    samples = np.unique(samples[samples <= stop])
+    errors = {'objective': 0.0, 'residual': 0.0, 'fluxes': 0.0}
+    checked = []
+    with model:
+        for lower_bound in samples.tolist():
+            solution = _lp_solution(model, flux_reader, exchange, lower_bound)
+            if solution is None:
+                continue
+            objective, fluxes = table.evaluate(lower_bound)
+            lower[position] = lower_bound
+            residual = max(
+                np.abs(stoichiometry @ fluxes).max(initial=0.0),
+                (lower - fluxes).max(initial=0.0),
+                (fluxes - upper).max(initial=0.0))
+            objective_error = abs(objective - solution[0])
+            errors['objective'] = max(errors['objective'], objective_error)
+            errors['residual'] = max(errors['residual'], residual)
+            errors['fluxes'] = max(errors['fluxes'], np.abs(fluxes - solution[1]).max(initial=0.0))
+            checked.append((lower_bound, max(objective_error, residual), solution[0], solution[1]))
+    return errors, checked
+
+
+def build_flux_table(model, exchange_id, lower_bound=None, upper_bound=0.0, tolerance=1e-6,
+                     points=200, refinements=5, step=1e-7, delta=1e-3):
+    """
+    The FluxTable of ``model`` over lower bounds of ``exchange_id`` from
+    ``lower_bound`` (default: the model's) to ``upper_bound``. The model's
+    bounds are restored afterwards.
+    """
+    exchange = model.reactions.get_by_id(exchange_id)
+    lower_bound = exchange.lower_bound if lower_bound is None else lower_bound
+    flux_reader = FluxReader(model)
+    breakpoints, objective, fluxes = [], [], []
+
+    def record(bound, solution):
+        breakpoints.append(bound)
+        objective.append(solution[0])
+        fluxes.append(solution[1])
+
+    def last_feasible(low, high):
+        # bisect the largest feasible bound between a feasible ``low`` and an infeasible ``high``
+        solution = None
+        while high - low > step:
+            middle = (low + high) / 2
+            middle_solution = _lp_solution(model, flux_reader, exchange, middle)
+            if middle_solution is None:
+                high = middle
+            else:
+                low, solution = middle, middle_solution
+        if solution is not None:
+            record(low, solution)
+        return low
+
+    with model:
+        lp = ParametricLP(model, [exchange_id], delta=delta)
+        feasible_until = upper_bound
+        bound, previous = lower_bound, None
+        while bound <= upper_bound:
+            piece = lp.piece([bound])
+            if not piece.feasible:
+                if previous is None:
+                    raise ValueError('the LP of {} is infeasible at {} = {}'.format(model.id, exchange_id, bound))
+                feasible_until = last_feasible(previous, bound)
+                break
+            primals = piece.primals
+            record(bound, (piece.objective, primals[flux_reader.forward] - primals[flux_reader.reverse]))
+            if not piece.ahead:
+                # the LP turns infeasible within delta
+                feasible_until = last_feasible(bound, min(bound + delta, upper_bound + step))
+                break
+            # the bound where a basic variable of the piece reaches its own bound
+            slopes = piece.slack_slopes[:, 0]
+            leaving = slopes < 0
+            end = upper_bound
+            if leaving.any():
+                end = min(end, bound + max((piece.slack[leaving] / -slopes[leaving]).min(), 0.0))
+            previous = bound
+            if end > bound:
+                # the solution at the end of the piece is the LP's, not the extrapolated one
+                solution = _lp_solution(model, flux_reader, exchange, end)
+                if solution is None:
+                    feasible_until = last_feasible(bound, end)
+                    break
+                record(end, solution)
+                previous = end
+            if end >= upper_bound:
+                break
+            bound = end + step
+        table = FluxTable(
+            exchange_id, flux_reader.reaction_ids, breakpoints, objective, fluxes, feasible_until)
+
+        for _ in range(refinements):
+            table.max_error, checked = check_flux_table(table, model, points)
+            worse = [entry for entry in checked if entry[1] > tolerance]
+            if not worse:
+                break
+            for lower, _, solution_objective, solution_fluxes in worse:
+                table.insert(lower, solution_objective, solution_fluxes)
+        else:
+            table.max_error, _ = check_flux_table(table, model, points)
+    return table
+
+
+def flux_table_name(exchange_id, **parameters):
+    """
+    The cache file name of the FluxTable of ``exchange_id`` built with
+    ``parameters``, which holds a hash of every build_flux_table parameter,
+    defaults included, so a table is never reused for other settings.
+    """
+    arguments = inspect.signature(build_flux_table).bind(None, exchange_id, **parameters)
+    arguments.apply_defaults()
+    settings = sorted((name, value) for name, value in arguments.arguments.items() if name != 'model')
+    return '{}-{}.flux.npz'.format(exchange_id, hashlib.sha256(repr(settings).encode()).hexdigest()[:16])
+
+
+def load_flux_table(model_file, exchange_id, cache_dir=None, **parameters):
+    """The FluxTable of ``model_file`` and ``exchange_id`` built with ``parameters``, built and cached on a miss."""
+    path = cache_path(model_file, flux_table_name(exchange_id, **parameters), cache_dir)
+    try:
+        return FluxTable.load(path)
+    except (OSError, ValueError, KeyError):
+        pass
+    table = build_flux_table(load_model(model_file), exchange_id, **parameters)
+    try:
+        _write_atomic(path, table.save)
+    except OSError:
+        pass
+    return table
+
+
+class FluxSurrogate:
+    """
+    Evaluates a FluxTable in place of the LP, for the fluxes of
+    ``reaction_ids``, when all bounds other than the lower bound of the
+    table's exchange are those of ``reference``.
+    """
+
+    def __init__(self, table, reference, reaction_ids):
+        self.table = table
+        self.position = reference.index[table.exchange_id]
+        self.others = np.array([index for index in range(len(reference)) if index != self.position], dtype=np.intp)
+        self.reference = reference
+        self.other_lower = reference.lower[self.others]
+        self.other_upper = reference.upper[self.others]
+        table_index = {reaction_id: index for index, reaction_id in enumerate(table.reaction_ids)}
+        self.outputs = np.array([table_index[reaction_id] for reaction_id in reaction_ids], dtype=np.intp)
+        self.evaluations = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_parameter(cls, model_file, model, reaction_ids, option):
+        """
+        The FluxSurrogate of a ``surrogate`` process parameter: None, an
+        exchange ID, or a dict of load_flux_table parameters with
+        ``exchange_id``.
+        """
+        if not option:
+            return None
+        parameters = {'exchange_id': option} if isinstance(option, str) else dict(option)
+        table = load_flux_table(model_file, **parameters)
+        return cls(table, BoundsArray.from_model(model), reaction_ids)
+
+    def evaluate(self, bounds):
+        """``(objective, fluxes)`` at ``bounds``, or None where the table does not apply."""
+        if (bounds.upper[self.position] != self.reference.upper[self.position]
+                or not self.reference.same_reactions(bounds)
+                or not np.array_equal(bounds.lower[self.others], self.other_lower)
+                or not np.array_equal(bounds.upper[self.others], self.other_upper)):
+            self.fallbacks += 1
+            return None
+        solution = self.table.evaluate(float(bounds.lower[self.position]))
+        if solution is None:
+            self.fallbacks += 1
+            return None
+        self.evaluations += 1
+        return solution[0], solution[1][self.outputs]
+
+    def statistics(self):
+        return {
+            'evaluations': self.evaluations,
+            'fallbacks': self.fallbacks,
+            'breakpoints': len(self.table),
+            'max_error': self.table.max_error,
+        }
+
+
+def test_flux_table(tmp_path):
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    model_path = os.path.join(current_dir, "../data/e_coli_core.xml")
+    table = load_flux_table(model_path, 'EX_glc__D_e', cache_dir=str(tmp_path))
+    name = flux_table_name('EX_glc__D_e')
+    assert os.path.exists(cache_path(model_path, name, str(tmp_path)))
+    # other build parameters get their own table
+    assert flux_table_name('EX_glc__D_e', tolerance=1e-6) == name
+    assert flux_table_name('EX_glc__D_e', tolerance=1e-8) != name
+    assert flux_table_name('EX_glc__D_e', lower_bound=-20.0) != name
+    assert table.max_error['objective'] < 1e-6 and table.max_error['residual'] < 1e-6
+    assert len(table) < 50
+    # the LP is infeasible below the maintenance requirement
+    assert -10 < table.feasible_until < 0
+    assert table.evaluate(table.feasible_until / 2) is None
+
+    model = load_model(model_path)
+    reference = BoundsArray.from_model(model)
+    surrogate = FluxSurrogate(FluxTable.load(
+        cache_path(model_path, name, str(tmp_path))), reference, ['EX_glc__D_e', 'PGI'])
+    bounds = reference.copy()
+    bounds.update({'EX_glc__D_e': (-4.321, 1000.0)})
+    objective, fluxes = surrogate.evaluate(bounds)
+    model.reactions.get_by_id('EX_glc__D_e').lower_bound = -4.321
+    assert abs(objective - model.slim_optimize()) < 1e-6
+    assert abs(fluxes[0] + 4.321) < 1e-6
+    bounds.update({'PGI': (0.0, 1000.0)})
+    assert surrogate.evaluate(bounds) is None
+    assert surrogate.statistics()['fallbacks'] == 1
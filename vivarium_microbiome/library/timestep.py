@@ -0,0 +1,217 @@
+"""
+=================
+Adaptive Timestep
+=================
+Adaptive-step mode for the dFBA loop.
+
+The loop processes (ReactionBounds, DynamicFBA, BiomassCalculator and
+EnvCalculator) take the ``SharedTimestep`` mixin, which makes them read
+their timestep from a shared ``timestep`` store instead of their fixed
+``timestep`` parameter. Without anything writing that store it keeps the
+processes' own timestep, so a composite without an AdaptiveTimestep runs
+exactly as before.
+
+AdaptiveTimestep is a Step that rewrites the store after every step of
+the loop, which it tells from the ``global_time`` store of a LoopClock:
+
+* the next step is the largest one that changes the biomass and the
+  concentration of every consumed substrate by at most ``tolerance``,
+  relative to their current values, at the current fluxes
+* while the growth rate and uptake fluxes are stable it grows by at most
+  ``step_factor`` per step; when one of them changed by more than
+  ``tolerance`` since the previous step it shrinks by ``step_factor``
+* ``end_time`` shortens the last step so the loop ends on the end time
+
+Steps are long while the population grows slowly or not at all, and short
+as a substrate runs out or while the bounds keep changing the solution.
+"""
+
+import numpy as np
+from vivarium.core.process import Step
+from vivarium.processes.clock import Clock
+
+from vivarium_microbiome.library.checkpoint import Checkpointed
+from vivarium_microbiome.library.medium import Medium
+
+
+TIME_PROPORTION = (1 / 60)  # we set each time-step as an hour and the Time_proportion as a minute
+TIMESTEP_PORT = 'timestep'
+
+
+class SharedTimestep:
+    """Mixin for processes that advance by the value of the shared ``timestep`` store."""
+
+    def timestep_schema(self):
+        return {
+            '_default': self.parameters['timestep'],
+            '_updater': 'set'
+        }
+
+    def calculate_timestep(self, states):
+        if states and TIMESTEP_PORT in states:
+            return states[TIMESTEP_PORT]
+        return self.parameters['timestep']
+
+
+class LoopClock(SharedTimestep, Clock):
+    """vivarium's Clock, advancing together with the dFBA loop."""
+
+    def ports_schema(self):
+        schema = super().ports_schema()
+        schema[TIMESTEP_PORT] = self.timestep_schema()
+        return schema
+
+
+class AdaptiveTimestep(Checkpointed, Step):
+    """
+    Sets the ``timestep`` store from the relative rates of change of the
+    biomass and of the concentrations of the substrates being consumed.
+    """
+
+    defaults = {
+        'tolerance': 0.02,  # largest relative change of biomass or a concentration in one step
+        'min_timestep': 0.1,
+        'max_timestep': 60.0,
+        'step_factor': 2.0,  # most a step grows, or shrinks, from one step to the next
+        'time_proportion': TIME_PROPORTION,
+        'volume': 10,
+        'end_time': None,
+    }
+    checkpoint_attributes = ('time', 'rates')
+
+    def __init__(self, parameters=None):
+        super().__init__(parameters=parameters)
+        self.exchange_ids = None
+        self.positions = None
+        self.time = None  # global time of the last loop step
+        self.rates = None  # growth rate and uptakes of the last loop step
+
+    def ports_schema(self):
+        return {
+            'current_biomass': {
+                '_default': 0.0,
+            },
+            'objective_flux': {
+                '_default': 0.0,
+            },
+            'fluxes_values': {
+                '_default': {},
+            },
+            'concentrations': {
+                '_updater': 'medium',
+            },
+            'global_time': {
+                '_default': 0.0,
+            },
+            TIMESTEP_PORT: {
+                '_default': 1.0,
+                '_emit': True,
+                '_updater': 'set'
+            },
+        }
+
+    def next_timestep(self, biomass, growth_rate, uptakes, concentrations):
+        """
+        The largest step, within [min_timestep, max_timestep], over which
+        ``growth_rate`` changes ``biomass`` and ``uptakes`` change each of
+        ``concentrations`` by at most ``tolerance`` of their current value.
+        """
+        scale = self.parameters['time_proportion']
+        rate = abs(growth_rate) * scale
+        consumption = biomass * np.maximum(uptakes, 0.0) * scale / self.parameters['volume']
+        if consumption.any():
+            # a substrate that is gone but still consumed forces the shortest step
+            with np.errstate(divide='ignore'):
+                relative = np.where(consumption > 0, consumption / concentrations, 0.0)
+            rate = max(rate, relative.max())
+        timestep = self.parameters['tolerance'] / rate if rate > 0 else self.parameters['max_timestep']
+        return min(max(timestep, self.parameters['min_timestep']), self.parameters['max_timestep'])
+
+    def changed(self, rates):
+        """Whether any of ``rates`` moved by more than ``tolerance`` since the last loop step."""
+        previous, self.rates = self.rates, rates
+        if previous is None:
+            return False
+        scale = np.maximum(np.abs(rates), np.abs(previous))
+        return bool((np.abs(rates - previous) > self.parameters['tolerance'] * scale).any())
+
+    def next_update(self, timestep, states):
+        fluxes_values = states['fluxes_values']
+        if not fluxes_values or states['global_time'] == self.time:
+            # nothing solved yet, or the loop has not moved since the last step was set
+            return {}
+        self.time = states['global_time']
+        medium = states['concentrations']
+        if medium.exchange_ids is not self.exchange_ids:
+            self.exchange_ids = medium.exchange_ids
+            self.positions = np.array([
+                index for index, exchange_id in enumerate(medium.exchange_ids)
+                if exchange_id in fluxes_values], dtype=np.intp)
+        uptakes = -np.array([fluxes_values[medium.exchange_ids[index]] for index in self.positions])
+        growth_rate = states['objective_flux']
+        next_timestep = self.next_timestep(
+            states['current_biomass'], growth_rate, uptakes, medium.concentrations[self.positions])
+
+        step_factor = self.parameters['step_factor']
+        previous_timestep = states[TIMESTEP_PORT]
+        if self.changed(np.append(uptakes, growth_rate)):
+            next_timestep = min(next_timestep, max(
+                previous_timestep / step_factor, self.parameters['min_timestep']))
+        else:
+            next_timestep = min(next_timestep, previous_timestep * step_factor)
+
+        end_time = self.parameters['end_time']
+        if end_time is not None:
+            remaining = end_time - states['global_time']
+            if remaining > 0:
+                next_timestep = min(next_timestep, remaining)
+        return {TIMESTEP_PORT: next_timestep}
+
+
+def adaptive_processes(parameters, end_time):
+    """The LoopClock and AdaptiveTimestep that put a dFBA loop in adaptive-step mode."""
+    return {
+        'Clock': LoopClock(),
+        'AdaptiveTimestep': AdaptiveTimestep(dict({'end_time': end_time}, **parameters)),
+    }
+
+
+def adaptive_topology():
+    return {
+        'Clock': {
+            'global_time': ('global_time',),
+            TIMESTEP_PORT: (TIMESTEP_PORT,),
+        },
+        'AdaptiveTimestep': {
+            'current_biomass': ('current_biomass_value',),
+            'objective_flux': ('objective_flux_value',),
+            'fluxes_values': ('fluxes_values',),
+            'concentrations': ('concentrations',),
+            'global_time': ('global_time',),
+            TIMESTEP_PORT: (TIMESTEP_PORT,),
+        },
+    }
+
+
+def test_adaptive_timestep():
+    controller = AdaptiveTimestep({'tolerance': 0.05, 'max_timestep': 60.0, 'end_time': 100})
+    # growth alone: 0.05 / (0.6 / 60)
+    assert abs(controller.next_timestep(1.0, 0.6, np.array([0.0]), np.array([10.0])) - 5.0) < 1e-12
+    # consumption of a scarce substrate shortens the step
+    assert abs(controller.next_timestep(1.0, 0.6, np.array([10.0]), np.array([0.1])) - 0.3) < 1e-12
+    assert controller.next_timestep(1.0, 0.6, np.array([10.0]), np.array([0.0])) == 0.1
+    # no growth and no consumption: the longest step
+    assert controller.next_timestep(1.0, 0.0, np.array([0.0]), np.array([0.0])) == 60.0
+
+    states = {
+        'current_biomass': 1.0, 'objective_flux': 0.6, 'fluxes_values': {'EX_glc__D_e': -1.0},
+        'concentrations': Medium.from_dict({'EX_glc__D_e': 10.0}), 'global_time': 10.0, TIMESTEP_PORT: 1.0}
+    assert controller.next_update(0, dict(states, fluxes_values={})) == {}
+    # stable rates: the step grows by step_factor at most
+    assert controller.next_update(0, states) == {TIMESTEP_PORT: 2.0}
+    assert controller.next_update(0, states) == {}  # the loop has not moved
+    assert controller.next_update(0, dict(states, global_time=12.0, timestep=2.0)) == {TIMESTEP_PORT: 4.0}
+    # the growth rate dropped: the step shrinks
+    assert controller.next_update(0, dict(states, objective_flux=0.3, global_time=16.0, timestep=4.0)) == {TIMESTEP_PORT: 2.0}
+    # the last step ends on end_time
+    assert controller.next_update(0, dict(states, objective_flux=0.3, global_time=99.0, timestep=2.0)) == {TIMESTEP_PORT: 1.0}
@@ -0,0 +1,114 @@
+"""
+================
+Substrate Uptake
+================
+Michaelis-Menten uptake over a configurable set of limiting substrates.
+
+A substrate is an exchange reaction with its own ``kcat``, ``km``,
+``init_concentration`` and enzyme link. ``enzyme`` is a fixed enzyme
+concentration, or None (the default) to use the expressed enzyme
+concentration of the ``enz_concentration`` store. The parameters of all
+substrates are kept as arrays in a fixed exchange order, so the uptake
+bounds and concentration changes of every substrate are one NumPy
+expression however many substrates are limiting.
+"""
+
+import numpy as np
+
+from vivarium_microbiome.library.medium import Medium
+
+
+GLUCOSE_EXCHANGE = 'EX_glc__D_e'
+
+
+class Substrates:
+    """Per-substrate kinetic parameters, in the order of ``exchange_ids``."""
+
+    def __init__(self, substrates):
+        self.exchange_ids = tuple(substrates)
+        specs = [substrates[exchange_id] for exchange_id in self.exchange_ids]
+        self.kcat = np.array([spec['kcat'] for spec in specs], dtype=float)
+        self.km = np.array([spec['km'] for spec in specs], dtype=float)
+        self.init_concentrations = np.array(
+            [spec['init_concentration'] for spec in specs], dtype=float)
+        enzyme = [spec.get('enzyme') for spec in specs]
+        self.expressed = np.array([value is None for value in enzyme])
+        self.enzyme = np.array([np.nan if value is None else value for value in enzyme], dtype=float)
+        self._positions = (None, None)
+
+    @classmethod
+    def from_parameters(cls, parameters, kinetics=True):
+        """
+        Read ``parameters['substrates']``, or fall back to the single glucose
+        substrate described by the process's own kcat/km/init_concentration.
+        Processes that only track concentrations pass ``kinetics=False`` and
+        need no kcat or km.
+        """
+        substrates = parameters.get('substrates')
+        if not substrates:
+            substrates = {GLUCOSE_EXCHANGE: {
+                'kcat': parameters['kcat'] if kinetics else np.nan,
+                'km': parameters['km'] if kinetics else np.nan,
+                'init_concentration': parameters['init_concentration']}}
+        return cls(substrates)
+
+    def __len__(self):
+        return len(self.exchange_ids)
+
+    def medium(self):
+        """A Medium holding the initial concentration of every substrate."""
+        return Medium(self.exchange_ids, self.init_concentrations)
+
+    def concentrations(self, medium):
+        """The concentration of every substrate in ``medium``, which may hold other exchanges too."""
+        if medium.exchange_ids == self.exchange_ids:
+            return medium.concentrations
+        exchange_ids, positions = self._positions
+        if medium.exchange_ids is not exchange_ids:
+            positions = medium.positions(self.exchange_ids)
+            self._positions = (medium.exchange_ids, positions)
+        return medium.concentrations[positions]
+
+    def vmax(self, enz_concentration):
+        if self.expressed.all():
+            return self.kcat * enz_concentration
+        return self.kcat * np.where(self.expressed, enz_concentration, self.enzyme)
+
+    def uptake_rates(self, concentrations, enz_concentration):
+        """Michaelis-Menten uptake of every substrate, negative because it is consumed."""
+        current_v0 = self.vmax(enz_concentration) * concentrations / (self.km + concentrations)
+        return -current_v0
+
+    def limit_consumption(self, consumption, concentrations, volume):
+        """
+        ``consumption`` of every substrate, but never more than its
+        ``concentrations`` in ``volume``, so that a depleted substrate ends at
+        zero and not below.
+        """
+        return np.minimum(consumption, concentrations * volume)
+
+
+def test_substrates():
+    substrates = Substrates({
+        'EX_glc__D_e': {'kcat': 5, 'km': 0.1, 'init_concentration': 11.1},
+        'EX_o2_e': {'kcat': 20, 'km': 0.01, 'init_concentration': 0.25, 'enzyme': 1.0},
+    })
+    medium = substrates.medium()
+    assert medium.to_dict() == {'EX_glc__D_e': 11.1, 'EX_o2_e': 0.25}
+    shared = Medium.from_dict({'EX_ac_e': 1.0, 'EX_o2_e': 0.25, 'EX_glc__D_e': 11.1})
+    assert list(substrates.concentrations(shared)) == [11.1, 0.25]
+    rates = substrates.uptake_rates(substrates.concentrations(medium), 5.0)
+    assert rates[0] == -(5 * 5.0 * 11.1 / (0.1 + 11.1))
+    assert rates[1] == -(20 * 1.0 * 0.25 / (0.01 + 0.25))
+    consumption = substrates.limit_consumption(np.array([200.0, -1.0]), substrates.concentrations(medium), 10)
+    assert list(consumption) == [111.0, -1.0]
+
+    legacy = Substrates.from_parameters({'kcat': 5, 'km': 0.1, 'init_concentration': 11.1})
+    assert legacy.exchange_ids == ('EX_glc__D_e',)
+    try:
+        Substrates.from_parameters({'kcat': 5, 'init_concentration': 11.1})
+    except KeyError:
+        pass
+    else:
+        raise AssertionError('a missing km is not zero-order uptake')
+    assert Substrates.from_parameters({'init_concentration': 11.1}, kinetics=False).init_concentrations[0] == 11.1